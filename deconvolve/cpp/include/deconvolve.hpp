@@ -28,7 +28,9 @@
 #include <vector>
 #include <memory>
 #include <functional>
+#include <string>
 #include <stddef.h>
+#include <stdint.h>
 
 namespace deconvolve {
 
@@ -135,6 +137,50 @@ namespace deconvolve {
     /// \param v3 voxel size along dimension 3, in meters
     void set_psf(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
 
+    /// \brief Optical transfer function for the given image dimensions
+    ///
+    /// Calculates OTF of the point spread function specified earlier by
+    /// \ref set_psf after scaling it to the given image dimensions and
+    /// voxel sizes. The returned data is in the internal format used
+    /// by the library (FFTW real-to-complex transform, complex values
+    /// stored as consecutive real and imaginary parts) and is of size
+    /// n1*n2*2*(n3/2+1). Use it together with \ref set_otf to avoid
+    /// recalculating OTF when the same PSF is used with many images.
+    ///
+    /// \param n1 the slowest changing dimension
+    /// \param n2 the medium changing dimension
+    /// \param n3 the fastest changing dimension
+    /// \param v1 voxel size along dimension 1, in meters
+    /// \param v2 voxel size along dimension 2, in meters
+    /// \param v3 voxel size along dimension 3, in meters
+    ///
+    /// \return OTF in the internal format
+    ///
+    /// \sa set_otf
+    ///
+    std::vector<T> otf(size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
+    /// \brief Set optical transfer function calculated earlier
+    ///
+    /// Sets OTF, as returned by \ref otf, for the current point
+    /// spread function. The following \ref convolve and \ref
+    /// deconvolve calls for images with the same dimensions and voxel
+    /// sizes will use it instead of calculating OTF from PSF. Note
+    /// that PSF has to be set by \ref set_psf before and that
+    /// setting a new PSF drops the OTF.
+    ///
+    /// \param data OTF in the format returned by \ref otf
+    /// \param n1 the slowest changing dimension
+    /// \param n2 the medium changing dimension
+    /// \param n3 the fastest changing dimension
+    /// \param v1 voxel size along dimension 1, in meters
+    /// \param v2 voxel size along dimension 2, in meters
+    /// \param v3 voxel size along dimension 3, in meters
+    ///
+    /// \sa otf
+    ///
+    void set_otf(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
     /// \brief Set callback function to communicate during deconvolution
     ///
     /// Callback function can be specified to provide user interface
@@ -199,6 +245,26 @@ namespace deconvolve {
     ///
     bool regularized() const;
 
+    /// \brief Use accelerated deconvolution
+    ///
+    /// Use vector extrapolation by Biggs and Andrews (Applied Optics
+    /// 36, 1766-1775, 1997) to accelerate deconvolution. At each
+    /// iteration, the next estimate is predicted from the last two
+    /// iterations and the iteration is applied to the prediction. The
+    /// same result is reached in fewer iterations, at the cost of
+    /// three additional images in memory. Can be combined with
+    /// regularization. Acceleration is disabled by default.
+    void enable_acceleration();
+
+    /// \brief Use deconvolution without acceleration
+    void disable_acceleration();
+
+    /// \brief Current state of acceleration
+    ///
+    /// \return `true` if accelerated deconvolution is set to be used
+    ///
+    bool accelerated() const;
+
     /// \brief Set SNR for the image
     ///
     /// Sets SNR that will be used to estimate lambda factor at the
@@ -333,6 +399,88 @@ namespace deconvolve {
     /// \sa set_fftw_handlers
     ///
     void clear_fftw_handlers();
+
+    /// \brief Set FFTW planner flags
+    ///
+    /// Set flags used by the default FFTW plan handlers, such as
+    /// `FFTW_ESTIMATE` (default), `FFTW_MEASURE`, or
+    /// `FFTW_PATIENT`. With the flags other than `FFTW_ESTIMATE`,
+    /// FFTW measures the performance of several algorithms when the
+    /// plan is created for the first time for the given
+    /// dimensions. This takes time, but results in faster transforms
+    /// and is worth it when many iterations are performed on the
+    /// images of the same size. Use \ref import_fftw_wisdom and \ref
+    /// export_fftw_wisdom to keep the found plans between the
+    /// runs. The data is preserved during planning.
+    ///
+    /// The flags are not used if FFTW plan handlers are specified by
+    /// \ref set_fftw_handlers .
+    ///
+    /// \param flags FFTW planner flags
+    ///
+    void set_fftw_flags(unsigned flags);
+
+    /// \brief Current FFTW planner flags
+    ///
+    /// \return FFTW planner flags used by the default FFTW handlers
+    ///
+    /// \sa set_fftw_flags
+    ///
+    unsigned fftw_flags() const;
+
+    /// \brief Set number of threads
+    ///
+    /// Sets the number of threads used by the FFTs and by the
+    /// operations on the images. With 0 (default), the OpenMP
+    /// default is used: all processors, unless limited by the
+    /// `OMP_NUM_THREADS` environment variable. The library has to be
+    /// compiled with OpenMP support and `USE_FFTW_THREADS` defined
+    /// for the FFTs to be multithreaded, otherwise everything runs in
+    /// one thread.
+    ///
+    /// The FFTW plans are made again after the number of threads is
+    /// changed.
+    ///
+    /// \param threads number of threads, 0 for the OpenMP default
+    ///
+    void set_threads(int threads);
+
+    /// \brief Number of threads as set by \ref set_threads
+    ///
+    /// \return number of threads, 0 standing for the OpenMP default
+    ///
+    int threads() const;
+
+    /// \brief Number of threads actually used
+    ///
+    /// \return number of threads, resolving the OpenMP default. It
+    /// is 1 if the library is compiled without OpenMP support.
+    ///
+    int max_threads() const;
+
+    /// \brief Import FFTW wisdom from file
+    ///
+    /// Imports wisdom, as exported earlier by \ref
+    /// export_fftw_wisdom, into FFTW. The wisdom is shared by all
+    /// objects using the same precision.
+    ///
+    /// \param filename name of the wisdom file
+    ///
+    /// \return `true` if the wisdom was imported successfully
+    ///
+    static bool import_fftw_wisdom(const std::string &filename);
+
+    /// \brief Export FFTW wisdom to file
+    ///
+    /// Exports wisdom accumulated by FFTW for the used precision.
+    ///
+    /// \param filename name of the wisdom file
+    ///
+    /// \return `true` if the wisdom was exported successfully
+    ///
+    /// \sa import_fftw_wisdom
+    ///
+    static bool export_fftw_wisdom(const std::string &filename);
     
     /// \brief Convolve image with the point spread function
     ///
@@ -368,6 +516,66 @@ namespace deconvolve {
     ///
     std::vector<T> deconvolve(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
 
+    /// \brief Deconvolve image in place
+    ///
+    /// Deconvolves the image given in the format used internally by
+    /// the library and replaces it with the result. Compared to \ref
+    /// deconvolve, there are no copies of the image between the user
+    /// and the library and no additional memory is used for the input
+    /// and the result.
+    ///
+    /// In the used format, the last dimension is padded to
+    /// 2*(n3/2+1) elements: the data is an array of size
+    /// n1*n2*2*(n3/2+1) where voxel (i, j, k) is at index
+    /// (i*n2 + j)*2*(n3/2+1) + k. The padding values are ignored.
+    ///
+    /// \param data pointer to the padded image, overwritten by the deconvolved image
+    /// \param n1 the slowest changing dimension
+    /// \param n2 the medium changing dimension
+    /// \param n3 the fastest changing dimension
+    /// \param v1 voxel size along dimension 1, in meters
+    /// \param v2 voxel size along dimension 2, in meters
+    /// \param v3 voxel size along dimension 3, in meters
+    ///
+    void deconvolve_inplace(T *data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
+    /// \brief Deconvolve camera counts
+    ///
+    /// Deconvolves an image as recorded by the camera, in counts,
+    /// and writes the result in counts. On loading, the counts are
+    /// converted into photon counts, max(round((data -
+    /// offset)/gain), 0), and on output the result is converted back
+    /// into counts, max(x, 0)*gain + offset, rounded and clipped to
+    /// the range of uint16_t. The conversions are done while copying
+    /// the data between the user arrays and the library, without
+    /// intermediate images.
+    ///
+    /// \param data array of size n1*n2*n3 with the last dimension (n3) changing the fastest
+    /// \param result array of size n1*n2*n3, filled with the deconvolved image
+    /// \param n1 the slowest changing dimension
+    /// \param n2 the medium changing dimension
+    /// \param n3 the fastest changing dimension
+    /// \param v1 voxel size along dimension 1, in meters
+    /// \param v2 voxel size along dimension 2, in meters
+    /// \param v3 voxel size along dimension 3, in meters
+    /// \param offset camera offset
+    /// \param gain camera gain, positive
+    ///
+    void deconvolve_counts(const uint16_t *data, uint16_t *result, size_t n1, size_t n2, size_t n3,
+                           T v1, T v2, T v3, T offset, T gain);
+
+    /// \brief Release memory used by work images
+    ///
+    /// Work images, together with their FFTW plans, are kept between
+    /// \ref convolve and \ref deconvolve calls and are reused when
+    /// the next image has the same dimensions. This avoids allocation
+    /// and planning for every image in a series of same-sized
+    /// images. Use this method to release the memory when the
+    /// object is not used for a while. The images are allocated again
+    /// on the next call.
+    ///
+    void release_buffers();
+
   private:
 
     std::unique_ptr<DeconvolvePrivate<T> > m_dec; ///< Pointer to the private implementation of deconvolution class
@@ -62,6 +62,20 @@ namespace deconvolve {
     m_dec->set_psf(data, n1, n2, n3, v1*1e9, v2*1e9, v3*1e9);
   }
 
+  template <typename T> 
+  std::vector<T> Deconvolve<T>::otf(size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+  {
+    std::vector<T> result;
+    m_dec->otf(result, n1, n2, n3, v1*1e9, v2*1e9, v3*1e9);
+    return result;
+  }
+
+  template <typename T> 
+  void Deconvolve<T>::set_otf(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+  {
+    m_dec->set_otf(data, n1, n2, n3, v1*1e9, v2*1e9, v3*1e9);
+  }
+
   template <typename T> 
   void Deconvolve<T>::set_callback(callback_type callback)
   {
@@ -105,6 +119,24 @@ namespace deconvolve {
     return m_dec->regularized();
   }
   
+  template <typename T> 
+  void Deconvolve<T>::enable_acceleration()
+  {
+    m_dec->enable_acceleration();
+  }
+  
+  template <typename T> 
+  void Deconvolve<T>::disable_acceleration()
+  {
+    m_dec->disable_acceleration();
+  }
+  
+  template <typename T> 
+  bool Deconvolve<T>::accelerated() const
+  {
+    return m_dec->accelerated();
+  }
+  
   template <typename T> 
   void Deconvolve<T>::set_snr(T snr)
   {
@@ -149,6 +181,48 @@ namespace deconvolve {
     m_dec->clear_fftw_handlers();
   }
   
+  template <typename T>
+  void Deconvolve<T>::set_fftw_flags(unsigned flags)
+  {
+    m_dec->set_fftw_flags(flags);
+  }
+
+  template <typename T>
+  unsigned Deconvolve<T>::fftw_flags() const
+  {
+    return m_dec->fftw_flags();
+  }
+
+  template <typename T>
+  void Deconvolve<T>::set_threads(int threads)
+  {
+    m_dec->set_threads(threads);
+  }
+
+  template <typename T>
+  int Deconvolve<T>::threads() const
+  {
+    return m_dec->threads();
+  }
+
+  template <typename T>
+  int Deconvolve<T>::max_threads() const
+  {
+    return m_dec->max_threads();
+  }
+
+  template <typename T>
+  bool Deconvolve<T>::import_fftw_wisdom(const std::string &filename)
+  {
+    return ImageSettings<T>::fftw_import_wisdom(filename);
+  }
+
+  template <typename T>
+  bool Deconvolve<T>::export_fftw_wisdom(const std::string &filename)
+  {
+    return ImageSettings<T>::fftw_export_wisdom(filename);
+  }
+  
   template <typename T> 
   std::vector<T> Deconvolve<T>::convolve(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
   {
@@ -165,6 +239,25 @@ namespace deconvolve {
     return result;
   }
 
+  template <typename T> 
+  void Deconvolve<T>::deconvolve_inplace(T *data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+  {
+    m_dec->deconvolve_inplace(data, n1, n2, n3, v1*1e9, v2*1e9, v3*1e9);
+  }
+
+  template <typename T>
+  void Deconvolve<T>::deconvolve_counts(const uint16_t *data, uint16_t *result, size_t n1, size_t n2, size_t n3,
+                                        T v1, T v2, T v3, T offset, T gain)
+  {
+    m_dec->deconvolve_counts(data, result, n1, n2, n3, v1*1e9, v2*1e9, v3*1e9, offset, gain);
+  }
+
+  template <typename T> 
+  void Deconvolve<T>::release_buffers()
+  {
+    m_dec->release_buffers();
+  }
+
   
   ////////////////////////////////////////
   // instantiate
@@ -23,11 +23,44 @@
 #include "deconvolve_priv.hpp"
 #include "constants.hpp"
 
+#include <algorithm>
 #include <exception>
 #include <iostream>
 
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
 using namespace deconvolve;
 
+namespace {
+  /// \brief Sets the number of OpenMP threads for the lifetime of the object
+  ///
+  /// The number of threads of the calling thread is restored on
+  /// destruction. Threads set to 0 keep the OpenMP default.
+  class OMPThreadsGuard {
+  public:
+    OMPThreadsGuard(int threads)
+    {
+#ifdef _OPENMP
+      if (threads <= 0) return;
+      m_previous = omp_get_max_threads();
+      omp_set_num_threads(threads);
+#endif
+    }
+
+    ~OMPThreadsGuard()
+    {
+#ifdef _OPENMP
+      if (m_previous > 0) omp_set_num_threads(m_previous);
+#endif
+    }
+
+  private:
+    int m_previous{0};
+  };
+}
+
 // private class implementation
 template <typename T>
 DeconvolvePrivate<T>::DeconvolvePrivate():
@@ -46,6 +79,22 @@ void DeconvolvePrivate<T>::set_psf(const std::vector<T> &data, size_t n1, size_t
   m_psf.set(data, n1, n2, n3, v1, v2, v3);  
 }
 
+template <typename T>
+void DeconvolvePrivate<T>::otf(std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+{
+  OMPThreadsGuard _threads(m_settings->threads());
+  if (!m_psf)
+    throw std::runtime_error(EXCPT_USER "Cannot calculate OTF without PSF. Please set PSF before calling otf");
+
+  m_psf.otf(m_settings, n1, n2, n3, v1, v2, v3).get_raw(data);
+}
+
+template <typename T>
+void DeconvolvePrivate<T>::set_otf(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+{
+  m_psf.set_otf(m_settings, data, n1, n2, n3, v1, v2, v3);
+}
+
 template <typename T>
 void DeconvolvePrivate<T>::set_callback(callback_cpp_type callback)
 {
@@ -70,6 +119,18 @@ void DeconvolvePrivate<T>::disable_regularization()
   m_regularize = false;
 }
 
+template <typename T>
+void DeconvolvePrivate<T>::enable_acceleration()
+{
+  m_accelerate = true;
+}
+
+template <typename T>
+void DeconvolvePrivate<T>::disable_acceleration()
+{
+  m_accelerate = false;
+}
+
 template <typename T>
 void DeconvolvePrivate<T>::set_snr(T snr)
 {
@@ -99,13 +160,58 @@ void DeconvolvePrivate<T>::clear_fftw_handlers()
                                         typename fftw_implementation<T>::clear_function() ));
 }
 
+template <typename T>
+void DeconvolvePrivate<T>::set_fftw_flags(unsigned flags)
+{
+  if (flags == m_settings->fftw_flags()) return;
+  m_settings.reset(new ImageSettings<T>(*m_settings, flags, m_settings->threads()));
+}
+
+template <typename T>
+void DeconvolvePrivate<T>::set_threads(int threads)
+{
+  if (threads < 0)
+    throw std::runtime_error(EXCPT_USER "Number of threads cannot be negative");
+  if (threads == m_settings->threads()) return;
+  // new settings lead to new FFTW plans with the requested number of threads
+  m_settings.reset(new ImageSettings<T>(*m_settings, m_settings->fftw_flags(), threads));
+}
+
+template <typename T>
+void DeconvolvePrivate<T>::prepare_buffer(std::unique_ptr< Image<T> > &image, const std::vector<T> &data,
+                                          size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+{
+  if (image && image->same_settings(m_settings))
+    image->set(data, n1, n2, n3, v1, v2, v3);
+  else
+    {
+      image.reset(); // release old memory before allocating the new one
+      image.reset(new Image<T>(m_settings, data, n1, n2, n3, v1, v2, v3));
+    }
+}
+
+template <typename T>
+void DeconvolvePrivate<T>::release_buffers()
+{
+  m_image.reset();
+  m_oC.reset();
+  m_o0.reset();
+  m_om1.reset();
+  m_div.reset();
+  m_xprev.reset();
+  m_g.reset();
+  m_gprev.reset();
+}
+
 template <typename T>
 void DeconvolvePrivate<T>::convolve(std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
 {
+  OMPThreadsGuard _threads(m_settings->threads());
   if (!m_psf)
     throw std::runtime_error(EXCPT_USER "Cannot convolve without PSF. Please set PSF before calling convolve");
 
-  Image<T> image(m_settings, data, n1, n2, n3, v1, v2, v3);
+  prepare_buffer(m_image, data, n1, n2, n3, v1, v2, v3);
+  Image<T> &image = *m_image;
   Image<T> &otf = m_psf.otf(m_settings, n1, n2, n3, v1, v2, v3);
 
   image.convolve(otf);
@@ -116,17 +222,82 @@ void DeconvolvePrivate<T>::convolve(std::vector<T> &data, size_t n1, size_t n2,
 template <typename T>
 void DeconvolvePrivate<T>::deconvolve(std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
 {
+  OMPThreadsGuard _threads(m_settings->threads());
   if (!m_psf)
     throw std::runtime_error(EXCPT_USER "Cannot deconvolve without PSF. Please set PSF before calling deconvolve");
 
+  prepare_buffer(m_image, data, n1, n2, n3, v1, v2, v3);
+  iterate(*m_image, n1, n2, n3, v1, v2, v3);
+  m_oC->get_image(data);
+}
+
+
+template <typename T>
+void DeconvolvePrivate<T>::deconvolve_inplace(T *data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+{
+  OMPThreadsGuard _threads(m_settings->threads());
+  if (!m_psf)
+    throw std::runtime_error(EXCPT_USER "Cannot deconvolve without PSF. Please set PSF before calling deconvolve");
+
+  // user data is used as the image to deconvolve and is overwritten
+  // by the result at the end
   Image<T> image(m_settings, data, n1, n2, n3, v1, v2, v3);
+  iterate(image, n1, n2, n3, v1, v2, v3);
+  image.copy_data(*m_oC);
+}
+
+
+template <typename T>
+void DeconvolvePrivate<T>::deconvolve_counts(const uint16_t *data, uint16_t *result, size_t n1, size_t n2, size_t n3,
+                                             T v1, T v2, T v3, T offset, T gain)
+{
+  OMPThreadsGuard _threads(m_settings->threads());
+  if (!m_psf)
+    throw std::runtime_error(EXCPT_USER "Cannot deconvolve without PSF. Please set PSF before calling deconvolve");
+  if (!(gain > 0))
+    throw std::runtime_error(EXCPT_USER "Camera gain has to be positive");
+
+  // counts are converted while loading them into the work image
+  const std::vector<T> empty;
+  prepare_buffer(m_image, empty, n1, n2, n3, v1, v2, v3);
+  m_image->set_counts(data, offset, gain);
+  iterate(*m_image, n1, n2, n3, v1, v2, v3);
+  m_oC->get_counts(result, offset, gain);
+}
+
+
+template <typename T>
+void DeconvolvePrivate<T>::iterate(const Image<T> &image, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+{
+  const std::vector<T> empty;
   Image<T> &otf = m_psf.otf(m_settings, n1, n2, n3, v1, v2, v3);
 
   // temporary images
-  Image<T> oC(m_settings, data, n1, n2, n3, v1, v2, v3); // current iteration
-  Image<T> o0(m_settings, data, n1, n2, n3, v1, v2, v3); // previous iteration
-  Image<T> om1(m_settings, n1, n2, n3, v1, v2, v3);      // 2 iterations ago
-  Image<T> div(m_settings, n1, n2, n3, v1, v2, v3);      // divergence
+  prepare_buffer(m_oC, empty, n1, n2, n3, v1, v2, v3);  // current iteration
+  prepare_buffer(m_o0, empty, n1, n2, n3, v1, v2, v3);  // previous iteration
+  prepare_buffer(m_om1, empty, n1, n2, n3, v1, v2, v3); // 2 iterations ago
+  if (m_regularize)
+    prepare_buffer(m_div, empty, n1, n2, n3, v1, v2, v3); // divergence
+  else
+    m_div.reset();
+  if (m_accelerate)
+    {
+      prepare_buffer(m_xprev, empty, n1, n2, n3, v1, v2, v3); // previous estimate
+      prepare_buffer(m_g, empty, n1, n2, n3, v1, v2, v3);     // change of the estimate
+      prepare_buffer(m_gprev, empty, n1, n2, n3, v1, v2, v3); // previous change
+    }
+  else
+    {
+      m_xprev.reset();
+      m_g.reset();
+      m_gprev.reset();
+    }
+  Image<T> &oC = *m_oC;
+  Image<T> &o0 = *m_o0;
+  Image<T> &om1 = *m_om1;
+
+  oC.copy_data(image);
+  o0.copy_data(image);
 
   // clear lambda stack
   m_lambda_evolution.clear();
@@ -136,13 +307,11 @@ void DeconvolvePrivate<T>::deconvolve(std::vector<T> &data, size_t n1, size_t n2
   if (snr < 0) // not specified, have to calcuate
     snr = oC.snr(1);
 
-  // first estimation is convolved original image
-  oC.convolve(otf);
-
   // iteration
   T lambda_factor = -1;
   T lambda = 0;
   T cmin = 0, cmax = 0, csum = 0, nrm2_prev = 0, nrm2_prevprev = 0;                   
+  bool accelerated_iterations = false;
   for (size_t iter = 0;
        (m_callback &&
         m_callback(iter, cmin, cmax, csum, nrm2_prev, nrm2_prevprev,
@@ -152,15 +321,14 @@ void DeconvolvePrivate<T>::deconvolve(std::vector<T> &data, size_t n1, size_t n2
                            lambda, lambda_factor, snr));
        ++iter)
     {
-      oC.convolve(otf);
-      oC.invdivide_image(image);
-      oC.convolve_conj(otf);
+      oC.rl_correction(otf, image);
 
       if ( !m_regularize )
         oC.prod_image(o0);
 
       else
         {
+          Image<T> &div = *m_div;
           div.div_unit_grad(o0);
           
           lambda = Image<T>::lambda_lsq(oC, div);
@@ -188,10 +356,40 @@ void DeconvolvePrivate<T>::deconvolve(std::vector<T> &data, size_t n1, size_t n2
         nrm2_prevprev = oC.nrm2(om1);
 
       om1.swap(o0);
+
+      if (m_accelerate)
+        {
+          // vector extrapolation by Biggs and Andrews (Applied Optics
+          // 36, 1766-1775, 1997): om1 holds the point the iteration
+          // was applied to and oC its result
+          Image<T> &g = *m_g;
+          Image<T> &gprev = *m_gprev;
+
+          g.difference(oC, om1);
+
+          T alpha = 0;
+          if (iter > 0)
+            {
+              T norm = gprev.dot(gprev);
+              if (norm > 0)
+                alpha = std::min(std::max(g.dot(gprev) / norm, T(0)), T(1));
+            }
+
+          g.swap(gprev);
+
+          // next point to apply the iteration to, m_xprev gets the
+          // current estimate
+          oC.extrapolate(*m_xprev, alpha);
+          accelerated_iterations = true;
+        }
+      
       o0.copy_data(oC);
     }
 
-  oC.get_image(data);
+  // with acceleration, oC holds the prediction and the result is the
+  // last estimate
+  if (accelerated_iterations)
+    oC.copy_data(*m_xprev);
 }
 
 
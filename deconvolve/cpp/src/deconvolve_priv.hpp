@@ -48,6 +48,12 @@ namespace deconvolve {
     /// \brief Set point spread function for convolution and deconvolution operations
     void set_psf(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
 
+    /// \brief Get OTF calculated from the current PSF for the given image dimensions
+    void otf(std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
+    /// \brief Set OTF calculated earlier for the current PSF
+    void set_otf(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
     void set_callback(callback_cpp_type callback); ///< Set callback function.
     void clear_callback(); ///< Drop the specified callback.
 
@@ -55,6 +61,10 @@ namespace deconvolve {
     void disable_regularization(); ///< Use deconvolution without regularization
     bool regularized() const { return m_regularize; } ///< Current state of regularization
 
+    void enable_acceleration();  ///< Use vector extrapolation to accelerate deconvolution
+    void disable_acceleration(); ///< Use deconvolution without acceleration
+    bool accelerated() const { return m_accelerate; } ///< Current state of acceleration
+
     void set_snr(T snr); ///< Set SNR for the image
     void clear_snr();    ///< Estimate SNR by the default algorithm
 
@@ -69,12 +79,34 @@ namespace deconvolve {
     /// \brief Use default FFTW plan handlers
     void clear_fftw_handlers();
 
+    /// \brief Set FFTW planner flags
+    void set_fftw_flags(unsigned flags);
+    /// \brief Current FFTW planner flags
+    unsigned fftw_flags() const { return m_settings->fftw_flags(); }
+
+    /// \brief Set number of threads, 0 for the OpenMP default
+    void set_threads(int threads);
+    /// \brief Current number of threads, 0 standing for the OpenMP default
+    int threads() const { return m_settings->threads(); }
+    /// \brief Number of threads actually used
+    int max_threads() const { return m_settings->max_threads(); }
+
     /// \brief Convolve image
     void convolve(std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
 
     /// \brief Deconvolve image
     void deconvolve(std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
 
+    /// \brief Deconvolve image stored in the backend format, in place
+    void deconvolve_inplace(T *data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
+    /// \brief Deconvolve camera counts into camera counts
+    void deconvolve_counts(const uint16_t *data, uint16_t *result, size_t n1, size_t n2, size_t n3,
+                           T v1, T v2, T v3, T offset, T gain);
+
+    /// \brief Release images kept between convolve and deconvolve calls
+    void release_buffers();
+
   protected:
 
     /// \brief Default callback for deconvolution
@@ -90,6 +122,21 @@ namespace deconvolve {
                          double nrm2_prev, double nrm2_prevprev,
                          double lambda, double lambda_factor, double snr);
 
+    /// \brief Deconvolution iterations
+    ///
+    /// Deconvolves the given image, the result is left in `m_oC`.
+    ///
+    void iterate(const Image<T> &image, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
+    /// \brief Set work image, reusing its memory and FFTW plans if possible
+    ///
+    /// The image is allocated on the first call. On the following
+    /// calls, memory and FFTW plans are kept if the dimensions and
+    /// settings did not change.
+    ///
+    void prepare_buffer(std::unique_ptr< Image<T> > &image, const std::vector<T> &data,
+                        size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
   protected:
 
     const size_t const_lambda_stack_size{3}; ///< Default number of last lambda values to compare to
@@ -98,6 +145,17 @@ namespace deconvolve {
     std::shared_ptr< ImageSettings<T> > m_settings; ///< Current image settings
 
     PSF<T> m_psf; ///< Current PSF
+
+    // images kept between the calls to avoid allocation of memory and
+    // FFTW plans for every processed image
+    std::unique_ptr< Image<T> > m_image; ///< Image to deconvolve
+    std::unique_ptr< Image<T> > m_oC;    ///< Current iteration
+    std::unique_ptr< Image<T> > m_o0;    ///< Previous iteration
+    std::unique_ptr< Image<T> > m_om1;   ///< 2 iterations ago
+    std::unique_ptr< Image<T> > m_div;   ///< Divergence
+    std::unique_ptr< Image<T> > m_xprev; ///< Previous estimate, used by acceleration
+    std::unique_ptr< Image<T> > m_g;     ///< Current change of the estimate, used by acceleration
+    std::unique_ptr< Image<T> > m_gprev; ///< Previous change of the estimate, used by acceleration
     
     std::deque<T> m_lambda_evolution; ///< Used to track lambda changes during deconvolution by default callback
 
@@ -105,6 +163,8 @@ namespace deconvolve {
 
     bool m_regularize{true}; ///< Whether to use regularization or not
 
+    bool m_accelerate{false}; ///< Whether to use vector extrapolation or not
+
     size_t m_max_iterations{const_max_iterations}; ///< Maximal number of iterations allowed by the default callback
 
     T m_snr{-1}; ///< Positive when specified by the user
@@ -32,8 +32,6 @@
  #include <omp.h>
 #endif
 
-#define FFTWFLAG FFTW_ESTIMATE
-
 using namespace deconvolve;
 
 template <typename T>
@@ -60,6 +60,16 @@ namespace deconvolve {
                                                               unsigned flags)> inverse{fftw_plan_dft_c2r_3d};
     /// \brief Default function for FFTW plan destruction.
     const std::function<void(fftw_implementation<double>::plan_type)> clear{fftw_destroy_plan};
+    /// \brief Default function for importing FFTW wisdom from file.
+    const std::function<int(const char *filename)> import_wisdom{fftw_import_wisdom_from_filename};
+    /// \brief Default function for exporting FFTW wisdom to file.
+    const std::function<int(const char *filename)> export_wisdom{fftw_export_wisdom_to_filename};
+#ifdef USE_FFTW_THREADS
+    /// \brief Default function for initialization of FFTW threads.
+    const std::function<int()> init_threads{fftw_init_threads};
+    /// \brief Default function setting the number of threads used by the plans created next.
+    const std::function<void(int nthreads)> plan_with_nthreads{fftw_plan_with_nthreads};
+#endif
   };
 
   template<>
@@ -74,6 +84,16 @@ namespace deconvolve {
                                                              unsigned flags)> inverse{fftwf_plan_dft_c2r_3d};
     /// \brief Default function for FFTW plan destruction.
     const std::function<void(fftw_implementation<float>::plan_type)> clear{fftwf_destroy_plan};
+    /// \brief Default function for importing FFTW wisdom from file.
+    const std::function<int(const char *filename)> import_wisdom{fftwf_import_wisdom_from_filename};
+    /// \brief Default function for exporting FFTW wisdom to file.
+    const std::function<int(const char *filename)> export_wisdom{fftwf_export_wisdom_to_filename};
+#ifdef USE_FFTW_THREADS
+    /// \brief Default function for initialization of FFTW threads.
+    const std::function<int()> init_threads{fftwf_init_threads};
+    /// \brief Default function setting the number of threads used by the plans created next.
+    const std::function<void(int nthreads)> plan_with_nthreads{fftwf_plan_with_nthreads};
+#endif
   };
 
   //////////////////////////////////////////////////////////////////////////////////////////////////////
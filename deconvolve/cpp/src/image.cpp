@@ -26,13 +26,15 @@
 #include <complex>
 #include <fftw3.h>
 
+#include <algorithm>
 #include <iostream>
 #include <cassert>
+#include <limits>
 #include <utility>
 #include <exception>
 
 #include <string.h> // memcpy
-#include <cmath>    // sqrt
+#include <cmath>    // sqrt, nearbyint
 
 using namespace deconvolve;
 
@@ -54,6 +56,26 @@ Image<T>::Image(std::shared_ptr< ImageSettings<T> > settings, size_t n1, size_t
   set(std::vector<T>(), n1, n2, n3, v1, v2, v3);
 }
 
+template <typename T>
+Image<T>::Image(std::shared_ptr< ImageSettings<T> > settings, T *data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3):
+  m_settings(settings),
+  m_data(data),
+  m_external(true),
+  m_plan_forward(settings),
+  m_plan_inverse(settings)
+{
+  if (data == nullptr)
+    throw std::runtime_error(EXCPT_INTERNAL "Cannot wrap NULL data pointer");
+
+  m_n[0] = n1;
+  m_n[1] = n2;
+  m_n[2] = n3;
+
+  m_voxel[0] = v1;
+  m_voxel[1] = v2;
+  m_voxel[2] = v3;
+}
+
 template <typename T>
 Image<T>::~Image()
 {
@@ -86,8 +108,10 @@ void Image<T>::release_data()
   m_plan_forward.clear();
   m_plan_inverse.clear();
 
-  fftw_free(m_data);
+  if (!m_external)
+    fftw_free(m_data);
   m_data = nullptr;
+  m_external = false;
   
   m_n.fill(0);
   m_voxel.fill(0);
@@ -144,18 +168,22 @@ void Image<T>::set(const std::vector<T> &data, size_t n1, size_t n2, size_t n3,
   if ( data.size()!=0 && data.size() != n1*n2*n3 )
     throw std::runtime_error(EXCPT_USER "Size of image data as represented by vector inconsistent with the given dimensions");
   
-  release_data();
+  // keep memory and FFTW plans if the dimensions are the same
+  if ( !(*this) || !same_dims(n1, n2, n3) )
+    {
+      release_data();
 
-  m_n[0] = n1;
-  m_n[1] = n2;
-  m_n[2] = n3;
+      m_n[0] = n1;
+      m_n[1] = n2;
+      m_n[2] = n3;
+
+      allocate_data();
+    }
 
   m_voxel[0] = v1;
   m_voxel[1] = v2;
   m_voxel[2] = v3;
 
-  allocate_data();
-
   if (data.size()!=0)
     {      
       // copy data over into FFTW format
@@ -198,12 +226,79 @@ void Image<T>::get_image(std::vector<T> &data)
     }
 }
 
+template <typename T>
+void Image<T>::set_counts(const uint16_t *data, T offset, T gain)
+{
+  if (!(*this))
+    throw std::runtime_error(EXCPT_INTERNAL "Trying to set counts of empty Image object");
+
+  size_t n12 = m_n[0]*m_n[1];
+  size_t n3_real = m_n[2];
+  size_t n3 = last_dim();
+  const T inv_gain = 1 / gain;
+
+#pragma omp parallel for
+  for (size_t i = 0; i < n12; ++i)
+    {
+      const uint16_t *src = data + i*n3_real;
+      T *d = m_data + i*n3;
+      // nearbyint rounds half to even, as numpy.round
+      for (size_t j=0; j < n3_real; ++j, ++src, ++d)
+        (*d) = std::max(std::nearbyint((T(*src) - offset) * inv_gain), T(0));
+    }
+}
+
+template <typename T>
+void Image<T>::get_counts(uint16_t *data, T offset, T gain) const
+{
+  if (!(*this))
+    throw std::runtime_error(EXCPT_INTERNAL "Trying to get counts from empty Image object");
+
+  size_t n12 = m_n[0]*m_n[1];
+  size_t n3_real = m_n[2];
+  size_t n3 = last_dim();
+  const T vmax = std::numeric_limits<uint16_t>::max();
+
+#pragma omp parallel for
+  for (size_t i = 0; i < n12; ++i)
+    {
+      const T *d = m_data + i*n3;
+      uint16_t *tgt = data + i*n3_real;
+      for (size_t j=0; j < n3_real; ++j, ++d, ++tgt)
+        {
+          const T v = std::nearbyint(std::max(*d, T(0)) * gain + offset);
+          (*tgt) = (uint16_t) std::min(std::max(v, T(0)), vmax);
+        }
+    }
+}
+
+template <typename T>
+void Image<T>::get_raw(std::vector<T> &data) const
+{
+  if (!(*this))
+    throw std::runtime_error(EXCPT_INTERNAL "Trying to get data from empty Image object");
+
+  data.assign(m_data, m_data + data_size());
+}
+
+template <typename T>
+void Image<T>::set_raw(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+{
+  set(std::vector<T>(), n1, n2, n3, v1, v2, v3);
+
+  if ( data.size() != data_size() )
+    throw std::runtime_error(EXCPT_USER "Size of raw image data inconsistent with the given dimensions");
+
+  memcpy( (void*)m_data, (void*)data.data(), data_size()*sizeof(T) );
+}
+
 template <typename T>
 void Image<T>::swap(Image &image)
 {
   using std::swap;
 
   swap(this->m_data, image.m_data);
+  swap(this->m_external, image.m_external);
   swap(this->m_n, image.m_n);
   swap(this->m_voxel, image.m_voxel);
   swap(this->m_plan_forward, image.m_plan_forward);
@@ -217,6 +312,9 @@ void Image<T>::fft()
   if (!(*this))
     throw std::runtime_error(EXCPT_INTERNAL "Trying to perform FFT on an empty Image object");
 
+  if (m_external)
+    throw std::runtime_error(EXCPT_INTERNAL "FFT is not supported on images wrapping user memory");
+
   if (!m_plan_forward)
     m_plan_forward.forward( m_data, m_n[0], m_n[1], m_n[2] );
 
@@ -229,6 +327,9 @@ void Image<T>::ifft()
   if (!(*this))
     throw std::runtime_error(EXCPT_INTERNAL "Trying to perform inverse FFT on an empty Image object");
 
+  if (m_external)
+    throw std::runtime_error(EXCPT_INTERNAL "Inverse FFT is not supported on images wrapping user memory");
+
   if (!m_plan_inverse)
       m_plan_inverse.inverse( m_data, m_n[0], m_n[1], m_n[2] );
 
@@ -236,46 +337,61 @@ void Image<T>::ifft()
 }
 
 template <typename T>
-static void prod(std::complex<T> *im, std::complex<T> *ker, T scale, size_t sz)
+void Image<T>::spectral_product(const Image<T> &kernel, bool conjugate, T scale)
 {
-  for (size_t i=0; i < sz; ++i, ++im, ++ker)
-    (*im) *= (*ker) / scale;
-}
+  if (!compatible(kernel))
+    throw std::runtime_error(EXCPT_INTERNAL "Convolution attempted with incompatible kernel");
 
-template <typename T>
-static void prod_conj(std::complex<T> *im, std::complex<T> *ker, T scale, size_t sz)
-{
-  for (size_t i=0; i < sz; ++i, ++im, ++ker)
-    (*im) *= std::conj((*ker)) / scale;
+  // complex numbers are multiplied explicitly on interleaved real and
+  // imaginary parts: std::complex multiplication checks for NaN and
+  // infinities and is not vectorized by the compiler
+  const size_t sz = m_n[0]*m_n[1]*(m_n[2]/2+1);
+  const T sign = conjugate ? -1 : 1;
+  T *im = m_data;
+  const T *ker = kernel.m_data;
+
+#pragma omp parallel for simd
+  for (size_t i=0; i < sz; ++i)
+    {
+      const T a = im[2*i], b = im[2*i+1];
+      const T c = scale*ker[2*i], d = sign*scale*ker[2*i+1];
+      im[2*i] = a*c - b*d;
+      im[2*i+1] = a*d + b*c;
+    }
 }
 
 template <typename T>
-void Image<T>::convolve_implementation( const Image<T> &kernel,
-                                        void (*p)(std::complex<T> *im, std::complex<T> *ker, T scale, size_t sz) )
+void Image<T>::convolve(const Image<T> &kernel)
 {
-  if (!compatible(kernel))
-    throw std::runtime_error(EXCPT_INTERNAL "Convolution attempted with incompatible kernel");
-
   fft();
-
-  T scale = m_n[0]*m_n[1]*m_n[2];
-  std::complex<T> *im = (std::complex<T> *)m_data;
-  std::complex<T> *ker = (std::complex<T> *)kernel.m_data;
-  p(im, ker, scale, m_n[0]*m_n[1]*(m_n[2]/2+1));
-
+  spectral_product(kernel, false, T(1) / (m_n[0]*m_n[1]*m_n[2]));
   ifft();
 }
 
 template <typename T>
-void Image<T>::convolve(const Image<T> &kernel)
+void Image<T>::convolve_conj(const Image<T> &kernel)
 {
-  convolve_implementation(kernel, prod);
+  fft();
+  spectral_product(kernel, true, T(1) / (m_n[0]*m_n[1]*m_n[2]));
+  ifft();
 }
 
 template <typename T>
-void Image<T>::convolve_conj(const Image<T> &kernel)
+void Image<T>::rl_correction(const Image<T> &kernel, const Image<T> &image)
 {
-  convolve_implementation(kernel, prod_conj);
+  // FFTW transforms are not normalized: the blurred estimate is
+  // obtained scaled by N, the number of voxels, and the ratio
+  // image/blurred by 1/N. The scaling of the second convolution
+  // cancels it, so that no pass over the data is needed for it
+  fft();
+  spectral_product(kernel, false, 1);
+  ifft();
+
+  invdivide_image(image);
+
+  fft();
+  spectral_product(kernel, true, 1);
+  ifft();
 }
 
 template <typename T>
@@ -575,6 +691,82 @@ T Image<T>::nrm2(const Image &image) const
 }
 
 
+template <typename T>
+void Image<T>::difference(const Image<T> &a, const Image<T> &b)
+{
+  if ( !compatible(a) || !compatible(b) )
+    throw std::runtime_error(EXCPT_INTERNAL "difference attempted between incompatible images");
+
+  size_t n12 = m_n[0]*m_n[1];
+  size_t n3_real = m_n[2];
+  size_t n3 = last_dim();
+  
+#pragma omp parallel for
+  for (size_t i = 0; i < n12; ++i)
+    {
+      T *d = m_data + i*n3;
+      const T *da = a.m_data + i*n3;
+      const T *db = b.m_data + i*n3;
+      for (size_t j=0; j < n3_real; ++j, ++d, ++da, ++db)
+        (*d) = (*da) - (*db);
+    }
+}
+
+template <typename T>
+T Image<T>::dot(const Image &image) const
+{
+  if ( !compatible(image) )
+    throw std::runtime_error(EXCPT_INTERNAL "Scalar product attempted between incompatible images");
+  
+  T s = 0.0;
+  
+  size_t n12 = m_n[0]*m_n[1];
+  size_t n3_real = m_n[2];
+  size_t n3 = last_dim();
+  
+#pragma omp parallel for reduction(+:s) 
+  for (size_t i = 0; i < n12; ++i)
+    {
+      const T *d = m_data + i*n3;
+      const T *d2 = image.m_data + i*n3;
+      for (size_t j=0; j < n3_real; ++j, ++d, ++d2)
+        s += (*d) * (*d2);
+    }
+
+  return s;
+}
+
+template <typename T>
+void Image<T>::extrapolate(Image<T> &prev, T alpha)
+{
+  if ( !compatible(prev) )
+    throw std::runtime_error(EXCPT_INTERNAL "extrapolate attempted between incompatible images");
+
+  if (alpha == 0)
+    {
+      prev.copy_data(*this);
+      return;
+    }
+  
+  size_t n12 = m_n[0]*m_n[1];
+  size_t n3_real = m_n[2];
+  size_t n3 = last_dim();
+  
+#pragma omp parallel for
+  for (size_t i = 0; i < n12; ++i)
+    {
+      T *d = m_data + i*n3;
+      T *p = prev.m_data + i*n3;
+      for (size_t j=0; j < n3_real; ++j, ++d, ++p)
+        {
+          const T x = *d;
+          const T y = x + alpha*(x - *p);
+          *p = x;
+          *d = std::max(y, T(0));
+        }
+    }
+}
+
 template <typename T>
 T Image<T>::lambda_lsq(const Image &cconv, const Image &div)
 {
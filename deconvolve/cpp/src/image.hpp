@@ -33,6 +33,7 @@
 #include <vector>
 
 #include <stddef.h>
+#include <stdint.h>
 
 namespace deconvolve {
 
@@ -92,6 +93,27 @@ namespace deconvolve {
     ///
     Image(std::shared_ptr< ImageSettings<T> > settings, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
 
+    /// \brief Constructor that wraps user-provided memory
+    ///
+    /// Use this constructor to operate on the data that is already
+    /// stored in the format used by the backend, without copying
+    /// it. For FFTW, the last dimension has to be padded to
+    /// 2*(n3/2+1) elements. The memory is not released by the image
+    /// and has to stay valid during the lifetime of the image. Note
+    /// that FFT is not supported on such images as the memory may be
+    /// not aligned as required by FFTW.
+    ///
+    /// \param settings image settings describing memory storage options and operations
+    /// \param data pointer to the image data in backend format
+    /// \param n1 the slowest changing dimension
+    /// \param n2 the medium changing dimension
+    /// \param n3 the fastest changing dimension
+    /// \param v1 voxel size along dimension 1, in meters
+    /// \param v2 voxel size along dimension 2, in meters
+    /// \param v3 voxel size along dimension 3, in meters
+    ///
+    Image(std::shared_ptr< ImageSettings<T> > settings, T *data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
     ~Image();
 
     // delete default and copy constructors and operator
@@ -107,7 +129,9 @@ namespace deconvolve {
 
     /// \brief Set image data
     ///
-    /// Makes a copy of the data in backend-supported internal format
+    /// Makes a copy of the data in backend-supported internal format.
+    /// If the image already has the same dimensions, its memory and
+    /// FFTW plans are reused.
     ///
     /// \param data image data vector of size n1*n2*n3 to be copied
     /// \param n1 the slowest changing dimension
@@ -139,6 +163,57 @@ namespace deconvolve {
     ///
     void get_image(std::vector<T> &data);
 
+    /// \brief Set image from camera counts
+    ///
+    /// Converts the camera counts into photon counts while copying
+    /// them into `this`: each voxel is set to
+    /// max(round((data - offset)/gain), 0). The image has to be
+    /// allocated with the dimensions of the data.
+    ///
+    /// \param data array of size n1*n2*n3 with the last dimension (n3) changing the fastest
+    /// \param offset camera offset
+    /// \param gain camera gain
+    ///
+    void set_counts(const uint16_t *data, T offset, T gain);
+
+    /// \brief Get image as camera counts
+    ///
+    /// Counterpart of \ref set_counts: converts the photon counts of
+    /// `this` into camera counts, max(x, 0)*gain + offset, rounded and
+    /// clipped to the range of uint16_t.
+    ///
+    /// \param data array of size n1*n2*n3 to fill
+    /// \param offset camera offset
+    /// \param gain camera gain
+    ///
+    void get_counts(uint16_t *data, T offset, T gain) const;
+
+    /// \brief Get image data in the backend-specific format
+    ///
+    /// Copies all stored values, including the padding used by the
+    /// backend, into the given vector. Use to keep images in Fourier
+    /// space, such as OTF, and restore them later with \ref set_raw.
+    ///
+    /// \param data vector to fill the data to
+    ///
+    void get_raw(std::vector<T> &data) const;
+
+    /// \brief Set image data in the backend-specific format
+    ///
+    /// Counterpart of \ref get_raw: copies the data as it was
+    /// returned by \ref get_raw for an image with the same
+    /// dimensions.
+    ///
+    /// \param data data vector in the format returned by \ref get_raw
+    /// \param n1 the slowest changing dimension
+    /// \param n2 the medium changing dimension
+    /// \param n3 the fastest changing dimension
+    /// \param v1 voxel size along dimension 1, in meters
+    /// \param v2 voxel size along dimension 2, in meters
+    /// \param v3 voxel size along dimension 3, in meters
+    ///
+    void set_raw(const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
     /// \brief Swaps images between this and provided image
     ///
     /// Swap image data and corresponding structures between this and
@@ -229,6 +304,17 @@ namespace deconvolve {
     /// convolved image.
     void convolve_conj(const Image &kernel);
 
+    /// \brief Operation used in deconvolution: this=conj(kernel) x (image/(this x kernel))
+    ///
+    /// Richardson-Lucy correction factor of the estimate held in
+    /// `this`, `x` denoting the convolution. It is equivalent to
+    /// calling \ref convolve, \ref invdivide_image and \ref
+    /// convolve_conj in sequence, but the normalization of the
+    /// Fourier transforms cancels out and is skipped. The kernel is
+    /// expected in Fourier space, `image` and `this` are expected to be
+    /// real and \ref compatible.
+    void rl_correction(const Image &kernel, const Image &image);
+
     /// \brief Operation used in deconvolution: this=image/this
     ///
     /// The operation takes value of each voxel in `image`, divides it
@@ -292,6 +378,26 @@ namespace deconvolve {
     /// \return Euclidean norm between this and provided image
     T nrm2(const Image &image) const;
 
+    /// \brief Difference of two images: this=a-b
+    ///
+    /// Images `a` and `b` are expected to be real and \ref compatible
+    /// with `this`.
+    void difference(const Image &a, const Image &b);
+
+    /// \brief Scalar product of `this` and provided image
+    ///
+    /// \return sum of the products of the voxel values of both images
+    T dot(const Image &image) const;
+
+    /// \brief Operation used in accelerated deconvolution: vector extrapolation
+    ///
+    /// Takes `this` as the current estimate x[k] and `prev` as the
+    /// previous estimate x[k-1], and calculates the prediction
+    /// this=max(x[k] + alpha*(x[k]-x[k-1]), 0). On return, `prev`
+    /// holds x[k]. For `alpha` equal to zero, `prev` is not read and
+    /// can be uninitialized.
+    void extrapolate(Image &prev, T alpha);
+
     /// \brief Lambda LSQ calculation
     ///
     /// Calculate Lambda LSQ (Equation 5 in [Laasmaa et
@@ -307,12 +413,12 @@ namespace deconvolve {
     void allocate_data(); ///< Allocate data in the format suitable for the backend
     void release_data();  ///< Release the allocated data
 
-    /// \brief Implementation of convolution
+    /// \brief Multiplication by the kernel in Fourier space: this=scale*this*kernel
     ///
-    /// Implementation of generalized convolution allowing to convolve
-    /// `this` with the kernel or its conjugated form.
-    void convolve_implementation( const Image<T> &kernel,
-                                  void (*p)(std::complex<T> *im, std::complex<T> *ker, T scale, size_t sz) );
+    /// Both `this` and `kernel` are expected to be in Fourier
+    /// space. If `conjugate` is true, `this` is multiplied by the
+    /// complex conjugate of the kernel.
+    void spectral_product(const Image<T> &kernel, bool conjugate, T scale);
     
     size_t last_dim() const;  ///< Returns the size of the last dimension in the format used by FFTW
 
@@ -325,6 +431,7 @@ namespace deconvolve {
     std::shared_ptr< ImageSettings<T> > m_settings;   ///< Settings used to allocate memory and keeping configuration of relevant parameters
     
     T *m_data = nullptr;                              ///< Pointer to the allocated data
+    bool m_external = false;                          ///< Data is provided by the user and is not released by `this`
     std::array<size_t, NDIMS> m_n{0,0,0};             ///< Image dimenstions
     std::array<T, NDIMS> m_voxel;                     ///< Image voxel sizes
 
@@ -27,13 +27,14 @@
 
 #include <iostream>
 #include <mutex>
+#include <vector>
 
-#ifdef USE_FFTW_THREADS
+#include <string.h> // memcpy
+
+#ifdef _OPENMP
 #include <omp.h>
 #endif
 
-#define FFTWFLAG FFTW_ESTIMATE
-
 
 using namespace deconvolve;
 
@@ -50,7 +51,9 @@ namespace deconvolve {
     if (fftw_initialized) return;
 
 #ifdef USE_FFTW_THREADS
-    if (fftw_init_threads() == 0)
+    // threads are initialized for both precisions at once
+    if (fftw_implementation_detail<double>().init_threads() == 0 ||
+        fftw_implementation_detail<float>().init_threads() == 0)
       throw std::runtime_error(EXCPT_MEMORY "Failed to init FFTW threads");
 #endif
 
@@ -82,17 +85,38 @@ ImageSettings<T>::ImageSettings(const ImageSettings<T> &old,
 }
 
 
+template <typename T>
+ImageSettings<T>::ImageSettings(const ImageSettings<T> &old, unsigned fftw_flags, int threads):
+  ImageSettings(old, true)
+{
+  m_fftw_flags = fftw_flags;
+  m_threads = threads;
+}
+
 template <typename T>
 ImageSettings<T>::ImageSettings(const ImageSettings<T> &old, bool increment_id)
 {
   m_fftw_forward_plan = old.m_fftw_forward_plan;
   m_fftw_inverse_plan = old.m_fftw_inverse_plan;
   m_fftw_clear_plan = old.m_fftw_clear_plan;
+  m_fftw_flags = old.m_fftw_flags;
+  m_threads = old.m_threads;
 
   if (increment_id) m_id = old.m_id + 1;
   else m_id = old.m_id;
 }
 
+template <typename T>
+int ImageSettings<T>::max_threads() const
+{
+#ifdef _OPENMP
+  if (m_threads > 0) return m_threads;
+  return omp_get_max_threads();
+#else
+  return 1;
+#endif
+}
+
 // template <typename T>
 // void ImageSettings<T>::fftw_reset()
 // {
@@ -103,6 +127,32 @@ ImageSettings<T>::ImageSettings(const ImageSettings<T> &old, bool increment_id)
 // }
 
 // FFTW handling
+
+/// \brief Keeps a copy of the data while FFTW plan is created
+///
+/// All FFTW planner flags, except FFTW_ESTIMATE, overwrite the data
+/// while searching for the best plan. The data is copied on
+/// construction and restored on destruction.
+template <typename T>
+class PlannerDataGuard {
+public:
+  PlannerDataGuard(T *data, int n0, int n1, int n2, unsigned flags): m_data(data)
+  {
+    if (flags & FFTW_ESTIMATE) return;
+    m_backup.assign(data, data + size_t(n0)*n1*2*(n2/2+1));
+  }
+
+  ~PlannerDataGuard()
+  {
+    if (!m_backup.empty())
+      memcpy( (void*)m_data, (void*)m_backup.data(), m_backup.size()*sizeof(T) );
+  }
+
+private:
+  T *m_data;
+  std::vector<T> m_backup;
+};
+
 template <typename T>
 typename fftw_implementation<T>::plan_type ImageSettings<T>::fftw_forward_plan(T *data, int n0, int n1, int n2)
 {
@@ -113,14 +163,15 @@ typename fftw_implementation<T>::plan_type ImageSettings<T>::fftw_forward_plan(T
       
       fftw_init();
       
+      fftw_implementation_detail<T> fi;
 #ifdef USE_FFTW_THREADS
-      fftw_plan_with_nthreads(omp_get_max_threads());
+      fi.plan_with_nthreads(max_threads());
 #endif
       
-      fftw_implementation_detail<T> fi;
+      PlannerDataGuard<T> _guard(data, n0, n1, n2, m_fftw_flags);
       typename fftw_implementation<T>::plan_type plan = fi.forward(n0, n1, n2,
                                                                   data, (typename fftw_implementation<T>::complex_type*) data,
-                                                                  FFTWFLAG);
+                                                                  m_fftw_flags);
       
       if (plan == NULL)
         throw std::runtime_error(EXCPT_MEMORY "Couldn't allocate forward FFT plan");
@@ -139,14 +190,15 @@ typename fftw_implementation<T>::plan_type ImageSettings<T>::fftw_inverse_plan(T
       
       fftw_init();
       
+      fftw_implementation_detail<T> fi;
 #ifdef USE_FFTW_THREADS
-      fftw_plan_with_nthreads(omp_get_max_threads());
+      fi.plan_with_nthreads(max_threads());
 #endif
       
-      fftw_implementation_detail<T> fi;
+      PlannerDataGuard<T> _guard(data, n0, n1, n2, m_fftw_flags);
       typename fftw_implementation<T>::plan_type plan = fi.inverse(n0, n1, n2,
                                                                   (typename fftw_implementation<T>::complex_type*)data, data,
-                                                                  FFTWFLAG);
+                                                                  m_fftw_flags);
       if (plan == NULL)
         throw std::runtime_error(EXCPT_MEMORY "Couldn't allocate forward FFT plan");
       
@@ -172,6 +224,24 @@ void ImageSettings<T>::fftw_clear_plan(typename fftw_implementation<T>::plan_typ
     }
 }
   
+template <typename T>
+bool ImageSettings<T>::fftw_import_wisdom(const std::string &filename)
+{
+  std::lock_guard<std::mutex> _lk(fftw_mutex);
+  fftw_init();
+  fftw_implementation_detail<T> fi;
+  return fi.import_wisdom(filename.c_str()) != 0;
+}
+
+template <typename T>
+bool ImageSettings<T>::fftw_export_wisdom(const std::string &filename)
+{
+  std::lock_guard<std::mutex> _lk(fftw_mutex);
+  fftw_init();
+  fftw_implementation_detail<T> fi;
+  return fi.export_wisdom(filename.c_str()) != 0;
+}
+
 
 ///////////////////////////////
 // instantiate
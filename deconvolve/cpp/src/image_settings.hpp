@@ -27,6 +27,7 @@
 
 #include <functional>
 #include <memory>
+#include <string>
 
 namespace deconvolve {
 
@@ -77,6 +78,21 @@ namespace deconvolve {
                   const typename fftw_implementation<T>::plan_function &inverse,
                   const typename fftw_implementation<T>::clear_function &clear ); 
 
+    /// \brief Constructor with new FFTW planner flags and number of threads
+    ///
+    /// Constructs the new settings with the given flags used by the
+    /// default FFTW plan handlers, such as `FFTW_ESTIMATE` (default),
+    /// `FFTW_MEASURE` or `FFTW_PATIENT`, and the number of threads
+    /// used by the FFTs and the image operations.
+    ///
+    /// \param old Settings to base the new settings on
+    /// \param fftw_flags FFTW planner flags
+    /// \param threads number of threads, 0 for the OpenMP default
+    ///
+    /// \sa Deconvolve::set_fftw_flags, Deconvolve::set_threads
+    ///
+    ImageSettings(const ImageSettings &old, unsigned fftw_flags, int threads);
+
     /// \brief Check if the settings are the same as the ones in the argument
     bool same(const ImageSettings &other) { return other.m_id == m_id; }
 
@@ -98,6 +114,28 @@ namespace deconvolve {
     /// \sa Deconvolve::set_fftw_handlers
     void fftw_clear_plan(typename fftw_implementation<T>::plan_type plan);
 
+    /// \brief FFTW planner flags used by the default plan handlers
+    unsigned fftw_flags() const { return m_fftw_flags; }
+
+    /// \brief Number of threads as set, 0 standing for the OpenMP default
+    int threads() const { return m_threads; }
+
+    /// \brief Number of threads actually used
+    ///
+    /// Resolves the OpenMP default, returns 1 if the library is
+    /// compiled without OpenMP.
+    int max_threads() const;
+
+    /// \brief Import FFTW wisdom from file
+    ///
+    /// \sa Deconvolve::import_fftw_wisdom
+    static bool fftw_import_wisdom(const std::string &filename);
+
+    /// \brief Export FFTW wisdom to file
+    ///
+    /// \sa Deconvolve::export_fftw_wisdom
+    static bool fftw_export_wisdom(const std::string &filename);
+
   protected:    
     ImageSettings(const ImageSettings &old, bool increment_id); ///< Copy old settings before changing them (used internally)
 
@@ -111,6 +149,9 @@ namespace deconvolve {
     typename fftw_implementation<T>::plan_function m_fftw_forward_plan; ///< Current handler for FFTW plan creation. If not specified, a default handler is used
     typename fftw_implementation<T>::plan_function m_fftw_inverse_plan; ///< Current handler for FFTW plan creation. If not specified, a default handler is used
     typename fftw_implementation<T>::clear_function m_fftw_clear_plan; ///< Current handler for FFTW plan destruction. If not specified, a default handler is used
+
+    unsigned m_fftw_flags{FFTW_ESTIMATE}; ///< Planner flags used by the default handlers for FFTW plan creation
+    int m_threads{0}; ///< Number of threads, 0 for the OpenMP default
   };
 
 }
@@ -162,6 +162,16 @@ Image<T>& PSF<T>::otf(std::shared_ptr< ImageSettings<T> > settings,  size_t n1,
 }
 
 
+template <typename T>
+void PSF<T>::set_otf(std::shared_ptr< ImageSettings<T> > settings, const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+{
+  if ( m_data.size() < 1 )
+    throw std::runtime_error(EXCPT_USER "Cannot set OTF without PSF. Please set PSF before setting its OTF");
+
+  m_otf.reset(new Image<T>(settings, n1, n2, n3, v1, v2, v3));
+  m_otf->set_raw(data, n1, n2, n3, v1, v2, v3);
+}
+
 
 // instantiate
 namespace deconvolve {
@@ -86,6 +86,25 @@ namespace deconvolve {
     ///    
     Image<T>& otf(std::shared_ptr< ImageSettings<T> > settings, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
 
+    /// \brief Set OTF calculated earlier
+    ///
+    /// Use to restore OTF that was calculated by \ref otf for the
+    /// current PSF, for example from a cache shared between several
+    /// deconvolution objects. The given OTF is returned by the
+    /// following calls to \ref otf with the same settings,
+    /// dimensions and voxel sizes.
+    ///
+    /// \param settings image settings describing memory storage options and operations
+    /// \param data OTF in the format returned by Image::get_raw
+    /// \param n1 the slowest changing dimension for OTF
+    /// \param n2 the medium changing dimension for OTF
+    /// \param n3 the fastest changing dimension for OTF
+    /// \param v1 voxel size along dimension 1, in meters (for OTF)
+    /// \param v2 voxel size along dimension 2, in meters (for OTF)
+    /// \param v3 voxel size along dimension 3, in meters (for OTF)
+    ///
+    void set_otf(std::shared_ptr< ImageSettings<T> > settings, const std::vector<T> &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3);
+
     /// \brief Test if PSF has been allocated
     ///
     /// \return `true` if `this` contains PSF data
@@ -29,8 +29,25 @@ ctypedef np.float64_t DTYPE_t
 
 FTYPE = np.float32
 ctypedef np.float32_t FTYPE_t
+ctypedef np.uint16_t UTYPE_t
 
 from libcpp.vector cimport vector
+from libcpp.string cimport string
+from libcpp cimport bool as cbool
+from libc.string cimport memcpy
+from libc.stdint cimport uint16_t
+
+
+cdef extern from "fftw3.h":
+    enum:
+        FFTW_ESTIMATE
+        FFTW_MEASURE
+        FFTW_PATIENT
+        FFTW_EXHAUSTIVE
+
+# FFTW planner flags accepted by set_fftw_flags
+FFTW_FLAGS = dict(estimate=FFTW_ESTIMATE, measure=FFTW_MEASURE,
+                  patient=FFTW_PATIENT, exhaustive=FFTW_EXHAUSTIVE)
 
 
 cdef extern from "deconvolve.hpp" namespace "deconvolve":
@@ -49,9 +66,28 @@ cdef extern from "deconvolve.hpp" namespace "deconvolve":
         void clear_snr()
         void set_max_iterations(size_t iters)
         void clear_max_iterations()
+        size_t max_iterations()
         int regularized()
+        void enable_acceleration()
+        void disable_acceleration()
+        int accelerated()
         vector[T] convolve(const vector[T] &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
         vector[T] deconvolve(const vector[T] &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3)
+        void deconvolve_inplace(T *data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3) except +
+        void deconvolve_counts(const uint16_t *data, uint16_t *result, size_t n1, size_t n2, size_t n3,
+                               T v1, T v2, T v3, T offset, T gain) except +
+        vector[T] otf(size_t n1, size_t n2, size_t n3, T v1, T v2, T v3) except +
+        void set_otf(const vector[T] &data, size_t n1, size_t n2, size_t n3, T v1, T v2, T v3) except +
+        void release_buffers()
+        void set_fftw_flags(unsigned flags)
+        unsigned fftw_flags()
+        void set_threads(int threads) except +
+        int threads()
+        int max_threads()
+        @staticmethod
+        cbool import_fftw_wisdom(const string &filename)
+        @staticmethod
+        cbool export_fftw_wisdom(const string &filename)
 
 cdef int callback_for_deconvolution(void *f, size_t iteration_number, 
                                     double cmin, double cmax, double csum, 
@@ -83,6 +119,15 @@ cdef class PyDeconvolve:
     def regularized(self):
         return self.thisptr.regularized()
 
+    def enable_acceleration(self):
+        self.thisptr.enable_acceleration()
+
+    def disable_acceleration(self):
+        self.thisptr.disable_acceleration()
+
+    def accelerated(self):
+        return self.thisptr.accelerated()
+
     def set_snr(self, v):
         self.thisptr.set_snr(v)
 
@@ -95,6 +140,47 @@ cdef class PyDeconvolve:
     def clear_max_iterations(self):
         self.thisptr.clear_max_iterations()
 
+    def max_iterations(self):
+        return self.thisptr.max_iterations()
+
+    def release_buffers(self):
+        self.thisptr.release_buffers()
+
+    def set_fftw_flags(self, unsigned flags):
+        self.thisptr.set_fftw_flags(flags)
+
+    def fftw_flags(self):
+        return self.thisptr.fftw_flags()
+
+    def set_threads(self, int n):
+        '''
+        Sets the number of threads, 0 for all the processors (OpenMP default)
+        '''
+        self.thisptr.set_threads(n)
+
+    def threads(self):
+        return self.thisptr.threads()
+
+    def max_threads(self):
+        '''
+        Returns the number of threads actually used
+        '''
+        return self.thisptr.max_threads()
+
+    @staticmethod
+    def import_fftw_wisdom(filename):
+        '''
+        Import FFTW wisdom for double precision. Returns True on success
+        '''
+        return Deconvolve[double].import_fftw_wisdom(filename.encode())
+
+    @staticmethod
+    def export_fftw_wisdom(filename):
+        '''
+        Export FFTW wisdom for double precision. Returns True on success
+        '''
+        return Deconvolve[double].export_fftw_wisdom(filename.encode())
+
     cpdef void set_psf(self, np.ndarray[DTYPE_t, ndim=1, mode="c"] data, size_t n1, size_t n2, size_t n3, double v1, double v2, double v3):
         '''
         Parameters:
@@ -103,6 +189,26 @@ cdef class PyDeconvolve:
         '''
         self.thisptr.set_psf(data, n1, n2, n3, v1, v2, v3)
 
+    def get_otf(self, size_t n1, size_t n2, size_t n3, double v1, double v2, double v3):
+        '''
+        Returns OTF of the current PSF for the given image dimensions
+        as complex array of shape (n1, n2, n3//2+1)
+        '''
+        cdef vector[double] v = self.thisptr.otf(n1, n2, n3, v1, v2, v3)
+        cdef np.ndarray[DTYPE_t, ndim=1, mode="c"] result = np.empty(v.size(), dtype=np.float64)
+        memcpy(&result[0], v.data(), v.size()*sizeof(double))
+        return result.view(np.complex128).reshape(n1, n2, n3//2+1)
+
+    def set_otf(self, data, size_t n1, size_t n2, size_t n3, double v1, double v2, double v3):
+        '''
+        Sets OTF, as returned by get_otf, for the current PSF
+        '''
+        cdef np.ndarray[DTYPE_t, ndim=1, mode="c"] flat = np.ascontiguousarray(data, dtype=np.complex128).view(np.float64).ravel()
+        cdef vector[double] v
+        v.resize(flat.shape[0])
+        memcpy(v.data(), &flat[0], v.size()*sizeof(double))
+        self.thisptr.set_otf(v, n1, n2, n3, v1, v2, v3)
+
     cpdef vector[double] convolve(self, np.ndarray[DTYPE_t, ndim=1, mode="c"] data, size_t n1, size_t n2, size_t n3, double v1, double v2, double v3):
         '''
         Parameters:
@@ -125,6 +231,43 @@ cdef class PyDeconvolve:
             
         return self.thisptr.deconvolve(data, n1, n2, n3, v1, v2, v3)
 
+    def deconvolve_inplace(self, DTYPE_t[:, :, ::1] data, size_t n3, double v1, double v2, double v3, callback=None):
+        '''
+        Deconvolves the image in place. The last dimension of data is
+        padded to 2*(n3//2+1), with the image in data[:, :, :n3]
+        '''
+        if data.shape[2] != 2*(n3//2+1):
+            raise ValueError(f"last dimension of data should be padded to {2*(n3//2+1)}, got {data.shape[2]}")
+
+        if callback is None:
+            self.thisptr.clear_callback()
+        else:
+            self.thisptr.set_callback(callback_for_deconvolution, <void*>callback)
+
+        self.thisptr.deconvolve_inplace(&data[0, 0, 0], data.shape[0], data.shape[1], n3, v1, v2, v3)
+
+    def deconvolve_counts(self, const UTYPE_t[:, :, ::1] data, double v1, double v2, double v3,
+                          double offset, double gain, UTYPE_t[:, :, ::1] out=None, callback=None):
+        '''
+        Deconvolves an image in camera counts (uint16), converting it to
+        photon counts with offset and gain, and returns the result in
+        camera counts. The result is written to out if given
+        '''
+        if out is None:
+            out = np.empty((data.shape[0], data.shape[1], data.shape[2]), dtype=np.uint16)
+        elif (out.shape[0], out.shape[1], out.shape[2]) != (data.shape[0], data.shape[1], data.shape[2]):
+            raise ValueError(f"output shape {(out.shape[0], out.shape[1], out.shape[2])} differs from "
+                             f"the input shape {(data.shape[0], data.shape[1], data.shape[2])}")
+
+        if callback is None:
+            self.thisptr.clear_callback()
+        else:
+            self.thisptr.set_callback(callback_for_deconvolution, <void*>callback)
+
+        self.thisptr.deconvolve_counts(&data[0, 0, 0], &out[0, 0, 0], data.shape[0], data.shape[1], data.shape[2],
+                                       v1, v2, v3, offset, gain)
+        return out.base
+
 
 # float
 cdef class PyDeconvolveFloat:
@@ -150,6 +293,15 @@ cdef class PyDeconvolveFloat:
     def regularized(self):
         return self.thisptr.regularized()
 
+    def enable_acceleration(self):
+        self.thisptr.enable_acceleration()
+
+    def disable_acceleration(self):
+        self.thisptr.disable_acceleration()
+
+    def accelerated(self):
+        return self.thisptr.accelerated()
+
     def set_snr(self, v):
         self.thisptr.set_snr(v)
 
@@ -162,6 +314,47 @@ cdef class PyDeconvolveFloat:
     def clear_max_iterations(self):
         self.thisptr.clear_max_iterations()
 
+    def max_iterations(self):
+        return self.thisptr.max_iterations()
+
+    def release_buffers(self):
+        self.thisptr.release_buffers()
+
+    def set_fftw_flags(self, unsigned flags):
+        self.thisptr.set_fftw_flags(flags)
+
+    def fftw_flags(self):
+        return self.thisptr.fftw_flags()
+
+    def set_threads(self, int n):
+        '''
+        Sets the number of threads, 0 for all the processors (OpenMP default)
+        '''
+        self.thisptr.set_threads(n)
+
+    def threads(self):
+        return self.thisptr.threads()
+
+    def max_threads(self):
+        '''
+        Returns the number of threads actually used
+        '''
+        return self.thisptr.max_threads()
+
+    @staticmethod
+    def import_fftw_wisdom(filename):
+        '''
+        Import FFTW wisdom for float precision. Returns True on success
+        '''
+        return Deconvolve[float].import_fftw_wisdom(filename.encode())
+
+    @staticmethod
+    def export_fftw_wisdom(filename):
+        '''
+        Export FFTW wisdom for float precision. Returns True on success
+        '''
+        return Deconvolve[float].export_fftw_wisdom(filename.encode())
+
     cpdef void set_psf(self, np.ndarray[FTYPE_t, ndim=1, mode="c"] data, size_t n1, size_t n2, size_t n3, double v1, double v2, double v3):
         '''
         Parameters:
@@ -170,6 +363,26 @@ cdef class PyDeconvolveFloat:
         '''
         self.thisptr.set_psf(data, n1, n2, n3, v1, v2, v3)
 
+    def get_otf(self, size_t n1, size_t n2, size_t n3, double v1, double v2, double v3):
+        '''
+        Returns OTF of the current PSF for the given image dimensions
+        as complex array of shape (n1, n2, n3//2+1)
+        '''
+        cdef vector[float] v = self.thisptr.otf(n1, n2, n3, v1, v2, v3)
+        cdef np.ndarray[FTYPE_t, ndim=1, mode="c"] result = np.empty(v.size(), dtype=np.float32)
+        memcpy(&result[0], v.data(), v.size()*sizeof(float))
+        return result.view(np.complex64).reshape(n1, n2, n3//2+1)
+
+    def set_otf(self, data, size_t n1, size_t n2, size_t n3, double v1, double v2, double v3):
+        '''
+        Sets OTF, as returned by get_otf, for the current PSF
+        '''
+        cdef np.ndarray[FTYPE_t, ndim=1, mode="c"] flat = np.ascontiguousarray(data, dtype=np.complex64).view(np.float32).ravel()
+        cdef vector[float] v
+        v.resize(flat.shape[0])
+        memcpy(v.data(), &flat[0], v.size()*sizeof(float))
+        self.thisptr.set_otf(v, n1, n2, n3, v1, v2, v3)
+
     cpdef vector[float] convolve(self, np.ndarray[FTYPE_t, ndim=1, mode="c"] data, size_t n1, size_t n2, size_t n3, double v1, double v2, double v3):
         '''
         Parameters:
@@ -190,3 +403,40 @@ cdef class PyDeconvolveFloat:
             self.thisptr.set_callback(callback_for_deconvolution, <void*>callback)
             
         return self.thisptr.deconvolve(data, n1, n2, n3, v1, v2, v3)
+
+    def deconvolve_inplace(self, FTYPE_t[:, :, ::1] data, size_t n3, double v1, double v2, double v3, callback=None):
+        '''
+        Deconvolves the image in place. The last dimension of data is
+        padded to 2*(n3//2+1), with the image in data[:, :, :n3]
+        '''
+        if data.shape[2] != 2*(n3//2+1):
+            raise ValueError(f"last dimension of data should be padded to {2*(n3//2+1)}, got {data.shape[2]}")
+
+        if callback is None:
+            self.thisptr.clear_callback()
+        else:
+            self.thisptr.set_callback(callback_for_deconvolution, <void*>callback)
+
+        self.thisptr.deconvolve_inplace(&data[0, 0, 0], data.shape[0], data.shape[1], n3, v1, v2, v3)
+
+    def deconvolve_counts(self, const UTYPE_t[:, :, ::1] data, double v1, double v2, double v3,
+                          double offset, double gain, UTYPE_t[:, :, ::1] out=None, callback=None):
+        '''
+        Deconvolves an image in camera counts (uint16), converting it to
+        photon counts with offset and gain, and returns the result in
+        camera counts. The result is written to out if given
+        '''
+        if out is None:
+            out = np.empty((data.shape[0], data.shape[1], data.shape[2]), dtype=np.uint16)
+        elif (out.shape[0], out.shape[1], out.shape[2]) != (data.shape[0], data.shape[1], data.shape[2]):
+            raise ValueError(f"output shape {(out.shape[0], out.shape[1], out.shape[2])} differs from "
+                             f"the input shape {(data.shape[0], data.shape[1], data.shape[2])}")
+
+        if callback is None:
+            self.thisptr.clear_callback()
+        else:
+            self.thisptr.set_callback(callback_for_deconvolution, <void*>callback)
+
+        self.thisptr.deconvolve_counts(&data[0, 0, 0], &out[0, 0, 0], data.shape[0], data.shape[1], data.shape[2],
+                                       v1, v2, v3, offset, gain)
+        return out.base
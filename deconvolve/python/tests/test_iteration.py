@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#  
+#   Copyright (C) 2018-2020
+#    Laboratory of Systems Biology, Department of Cybernetics,
+#    School of Science, Tallinn University of Technology
+#   This file is part of project: IOCBIO Deconvolve
+
+
+
+# Richardson-Lucy iterations of the engine compared with a reference
+# implementation made of separate convolutions, as the iteration was
+# written before Image::rl_correction.
+#
+# Run from the deconvolve/python folder:
+#   python -m pytest tests/test_iteration.py
+
+import numpy as np
+
+from python.calc import cpp_calc as D
+
+
+SHAPE = (16, 24, 20)
+VOXEL = (0.2, 0.1, 0.1)
+
+
+def gaussian_psf(shape=(9, 9, 9), sigma=(1.5, 1., 1.)):
+    Z, Y, X = np.meshgrid(*[np.arange(n) - n//2 for n in shape], indexing='ij')
+    psf = np.exp(-((Z/sigma[0])**2 + (Y/sigma[1])**2 + (X/sigma[2])**2))
+    return psf/psf.sum()
+
+
+def beads_image(seed=0):
+    rng = np.random.default_rng(seed)
+    img = rng.uniform(10, 20, SHAPE)
+    for z, y, x in zip(*[rng.integers(0, n, 12) for n in SHAPE]):
+        img[z, y, x] += rng.uniform(500, 1000)
+    return img
+
+
+def deconvolver(iterations):
+    psf = gaussian_psf()
+    a = D.PyDeconvolve()
+    a.set_psf(psf.ravel(), *psf.shape, *VOXEL)
+    a.disable_regularization()
+    a.disable_acceleration()
+    a.set_max_iterations(iterations)
+    return a
+
+
+def convolve(img, otf, conjugate=False):
+    if conjugate:
+        otf = otf.conj()
+    return np.fft.irfftn(np.fft.rfftn(img)*otf, s=img.shape)
+
+
+def rl_reference(img, otf, iterations, blur_first=False):
+    """Plain Richardson-Lucy, each convolution done separately.
+
+    With blur_first, the estimate is convolved before the first iteration,
+    as the engine did before the fused correction (Image::rl_correction).
+    """
+    estimate = img.copy()
+    current = convolve(img, otf) if blur_first else img.copy()
+    for _ in range(iterations):
+        blurred = convolve(current, otf)
+        ratio = np.divide(img, blurred, out=np.zeros_like(blurred), where=blurred > 0)
+        current = convolve(ratio, otf, conjugate=True)*estimate
+        estimate = current
+    return current
+
+
+def test_convolve():
+    a = deconvolver(1)
+    img = beads_image()
+    otf = a.get_otf(*SHAPE, *VOXEL)
+    result = np.array(a.convolve(img.ravel(), *SHAPE, *VOXEL)).reshape(SHAPE)
+    np.testing.assert_allclose(result, convolve(img, otf), rtol=1e-10, atol=1e-10)
+
+
+def test_rl_correction():
+    # one iteration: conj(otf) x (image / (image x otf)) x image
+    for iterations in (1, 3):
+        a = deconvolver(iterations)
+        img = beads_image()
+        otf = a.get_otf(*SHAPE, *VOXEL)
+        result = np.array(a.deconvolve(img.ravel(), *SHAPE, *VOXEL)).reshape(SHAPE)
+        np.testing.assert_allclose(result, rl_reference(img, otf, iterations),
+                                   rtol=1e-9, atol=1e-9*img.max())
+
+
+def test_difference_with_blurred_first_estimate():
+    # the first estimate is not convolved anymore before the first
+    # iteration: the results differ slightly from the former iteration
+    a = deconvolver(3)
+    img = beads_image()
+    otf = a.get_otf(*SHAPE, *VOXEL)
+    result = np.array(a.deconvolve(img.ravel(), *SHAPE, *VOXEL)).reshape(SHAPE)
+    former = rl_reference(img, otf, 3, blur_first=True)
+    assert not np.allclose(result, former)
+    assert np.median(np.abs(result - former)) < 1e-2*former.max()
+
+
+def test_deconvolve_inplace():
+    a = deconvolver(3)
+    img = beads_image()
+    expected = np.array(a.deconvolve(img.ravel(), *SHAPE, *VOXEL)).reshape(SHAPE)
+
+    n3 = SHAPE[2]
+    data = np.zeros(SHAPE[:2] + (2*(n3//2+1),))
+    data[:, :, :n3] = img
+    a.deconvolve_inplace(data, n3, *VOXEL)
+    np.testing.assert_allclose(data[:, :, :n3], expected, rtol=1e-12, atol=1e-12*img.max())
+
+    # with the float engine
+    f = D.PyDeconvolveFloat()
+    psf = gaussian_psf().astype(np.float32)
+    f.set_psf(psf.ravel(), *psf.shape, *VOXEL)
+    f.disable_regularization()
+    f.disable_acceleration()
+    f.set_max_iterations(3)
+    data = np.zeros(SHAPE[:2] + (2*(n3//2+1),), dtype=np.float32)
+    data[:, :, :n3] = img
+    f.deconvolve_inplace(data, n3, *VOXEL)
+    np.testing.assert_allclose(data[:, :, :n3], expected, rtol=1e-3, atol=1e-4*img.max())
+
+
+if __name__ == '__main__':
+    test_convolve()
+    test_rl_correction()
+    test_difference_with_blurred_first_estimate()
+    test_deconvolve_inplace()
+    print('ok')
@@ -2,7 +2,6 @@
 import pycroscopy3D as pycro
 import os
 from glob import glob
-from tqdm import tqdm
 import pipeline_tools as pt
 
 # %% folders preparation
@@ -62,13 +61,12 @@ uncorrected_volume_paths = glob(relative_in(
 # load PSF
 psf = pycro.read_stack(PATHS_IN["psf"])
 
-# deconvolve
-for path in tqdm(uncorrected_volume_paths):
-    break
-    stack = pycro.read_stack(path)
-    deconvolved = pycro.deconvolve(stack, psf)
-    pycro.write_stack(deconvolved, os.path.join(
-        PATHS_OUT["deconvolved"], os.path.basename(path)))
+# deconvolve, in parallel, skipping the volumes already deconvolved
+# (disabled: set DECONVOLVE and the camera offset and gain of the acquisition)
+DECONVOLVE = False
+if DECONVOLVE:
+    done, failed = pycro.deconvolve_many(uncorrected_volume_paths, psf, PATHS_OUT["deconvolved"],
+                                         offset=0, gain=1, dtype_out="uint16")
 
 # %% Skew corection
 
@@ -82,13 +80,13 @@ for path in tqdm(uncorrected_volume_paths):
 # PROCEDURE:
 # - apply affine transformation to every stack
 
-# USES: matlab script called from pycroscopy
+# USES: pycroscopy shear (same result as the matlab script)
 # =========================================
 
 in_path = relative_in(f"{run}/220127_F4_run2_subset_for_volumeavg")
 info_fname = '220119_F1_run4_info.mat'
 
-pt.skew_correct(PATHS_OUT["deconvolved"], PATHS_OUT["corrected"], info_fname)
+pycro.skew_correction.skew_correct_folder(PATHS_OUT["deconvolved"], PATHS_OUT["corrected"], os.path.join(in_path, info_fname))
 
 # stack_fnames = [os.path.basename(path) for path in glob(PATHS_OUT["deconvolved"]+ "/*.tif?")]
 # pt.skew_correct_one(PATHS_OUT["deconvolved"], PATHS_OUT["corrected"], stack_fnames[0], info_fname)
@@ -126,8 +124,7 @@ pass
 # USES: Suite2P
 
 # generate the time-dependent planes (T,Y,X)
-pt.generate_planes_vs_time(
-    PATHS_OUT["corrected"], PATHS_OUT["unpad"], PATHS_OUT["planes"])
+pt.generate_planes_vs_time(PATHS_OUT["corrected"], PATHS_OUT["planes"])
 
 # %% Data processing
 
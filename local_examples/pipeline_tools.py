@@ -45,20 +45,16 @@ def stack_images_with_same_name(path, path_out):
         imwrite(os.path.join(path_out, fname), np.array(planes))
 
 
-def generate_planes_vs_time(path_corrected, path_out_unpad, path_out_planes):
+def generate_planes_vs_time(path_corrected, path_out_planes):
     """Generate the single planes over time stacks (T,Y,X).
 
-    1. extract the planes from each stack in path_corrected
-    2. unpad the planes and save them into path_out_unpad
-    3. stack the planes with identical time and save them into path_out_planes
+    Every corrected stack is read once, its planes are unpadded (with the
+    padding of the first stack) and written into the plane stacks saved
+    into path_out_planes.
     """
-    # extract planes from stacks
-    corrected_paths = glob(path_corrected+"/*.tiff")
-    for path in tqdm(corrected_paths, desc="extracting planes and unpadding"):
-        extract_and_save_planes_from_one_stack(path, path_out_unpad)
-
-    # save (T,Y,X) stacks
-    stack_images_with_same_name(path_out_unpad, path_out_planes)
+    corrected_paths = sorted(glob(path_corrected+"/*.tiff"), key=parse_time_from_stack_name)
+    crops = pycro.transformation.unpad_crops(imread(corrected_paths[0]))
+    pycro.transformation.scatter_planes(corrected_paths, path_out_planes, crops=crops, name_format="{plane:05d}")
 
 
 def skew_correct_one(in_path, out_path, stack_fname, info_fname):
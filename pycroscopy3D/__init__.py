@@ -9,4 +9,5 @@ from multipagetiff.stack import Stack
 from . import transformation
 from . import skew_correction
 from . import registration
+from . import storage
 from .deconvolution import *
@@ -13,6 +13,8 @@ def main(*args, **kwargs):
     parser.add_argument("input_path", help="The path of the volume to register", type=str)
     parser.add_argument('-o', "--output_folder", help="The folder where the output file will be saved", type=str, required=True)
     parser.add_argument('-d', "--dtype", help="Output data dype (default uint16)", type=str, default='uint16')
+    parser.add_argument("--store", help="Save the output as a chunk store (.chunks folder of compressed chunks) instead of a tiff file",
+                        action='store_true')
     parser.add_argument('-q', "--quiet", help="Reduce verbosity", type=bool, default=False)
 
     args = parser.parse_args()
@@ -35,6 +37,8 @@ def main(*args, **kwargs):
     stack.dtype_out = args.dtype
     
     out_path = os.path.join(output_folder, os.path.basename(input_path).split('.')[0] + ".tif")
-    mtif.write_stack(stack, out_path)
+    if args.store:
+        out_path = utils.store_path(out_path)
+    utils.write_stack(stack, out_path)
     
     print(f"Conversion done, stack saved as {out_path}")
\ No newline at end of file
@@ -3,9 +3,8 @@ import argparse
 import logging
 import os
 from . import utils
-import numpy as np
 
-from ..deconvolution import deconvolve
+from ..deconvolution import deconvolve, OTFCache, ConvergenceMonitor
 
 # =========================================
    
@@ -13,14 +12,14 @@ def main(*args, **kwargs):
     parser = argparse.ArgumentParser(description="Deconvolve one stack.\
         Example: pycro_deconvolve --p mean_psf.tiff -g 2.6 -o test -i 20 image.tiff")
     parser.add_argument("input_path", help="The path of the volume to register", type=str)
-    parser.add_argument('-p', "--psf_path", help="The path of the PSF", type=str, required=True)
-    parser.add_argument('-g', "--gain", help="Acquisition gain", type=float, required=True)
-    parser.add_argument('-f', "--offset", help="Image offset level (defaults to 100)", type=int, default=100)
-    parser.add_argument('-d', "--dtype", help="Output data dype (default uint16)", type=str, default='uint16')
     parser.add_argument('-u', "--unpad", help="Auto-unpad image", type=bool, default=False)
-    parser.add_argument('-i', "--max_iterations", help="Maximum iteration number (default 10)", type=int, default=2)
     parser.add_argument('-o', "--output_folder", help="The folder where the output file will be saved", type=str, required=True)
-    parser.add_argument('-q', "--quiet", help="Reduce verbosity", type=bool, default=False)
+    parser.add_argument('-t', "--tile_shape", help="Deconvolve by overlapping tiles of this shape (z y x), to bound memory use",
+                        type=int, nargs=3, default=None)
+    parser.add_argument('-w', "--workers", help="Number of processes deconvolving tiles in parallel (default 1)", type=int, default=1)
+    parser.add_argument("--threads", help="Number of threads of the deconvolution (default: all the processors)", type=int, default=None)
+
+    utils.add_deconvolution_arguments(parser)
 
     args = parser.parse_args()
 
@@ -36,16 +35,28 @@ def main(*args, **kwargs):
 
     utils.create_folders(output_folder)
 
-    psf = mtif.read_stack(psf_path)
-    img = mtif.read_stack(input_path)
+    psf = utils.read_stack(psf_path)
+    if args.tile_shape is not None and not args.unpad:
+        # only the tiles are read
+        img = utils.open_stack(input_path)
+    else:
+        img = utils.read_stack(input_path)
 
     if args.unpad:
         mtif.unpad_stack(img)
        
-    deconvolved = deconvolve(img_stack=img, psf_stack=psf, offset=args.offset, gain=args.gain, max_iter=args.max_iterations)
-    deconvolved.dtype_out = np.dtype(args.dtype)
+    deconvolved = deconvolve(img_stack=img, psf_stack=psf, offset=args.offset, gain=args.gain, max_iter=args.max_iterations,
+                              accelerate=args.accelerate, otf_cache=OTFCache(cache_dir=args.otf_cache) if args.otf_cache else None,
+                              planner=args.fftw_planner, wisdom=not args.no_wisdom,
+                              tile_shape=args.tile_shape, n_workers=args.workers, pad=args.pad,
+                              n_threads=args.threads,
+                              monitor=ConvergenceMonitor(rtol=args.rtol, time_budget=args.time_budget,
+                                                         lambda_plateau=args.lambda_plateau),
+                              dtype_out=args.dtype)
   
     out_path = os.path.join(output_folder, os.path.basename(input_path))
-    mtif.write_stack(deconvolved, out_path)
+    if args.store:
+        out_path = utils.store_path(out_path)
+    utils.write_stack(deconvolved, out_path)
 
     print("done.")
\ No newline at end of file
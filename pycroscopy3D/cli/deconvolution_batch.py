@@ -0,0 +1,66 @@
+import multipagetiff as mtif
+import argparse
+import logging
+import os
+import sys
+from glob import glob
+from . import utils
+
+from ..deconvolution import deconvolve_many, OTFCache, ConvergenceMonitor
+from ..storage import is_store, STORE_SUFFIX
+
+# =========================================
+
+def main(*args, **kwargs):
+    parser = argparse.ArgumentParser(description="Deconvolve many stacks in parallel.\
+        Stacks already deconvolved in the output folder are skipped, so that an interrupted run can be resumed.\
+        Example: pycro_deconvolve_batch -p mean_psf.tiff -g 2.6 -o deconvolved -i 20 volumes/")
+    parser.add_argument("input_paths", help="The stacks to deconvolve (.tif or .chunks), or folders containing them", type=str, nargs='+')
+    parser.add_argument('-o', "--output_folder", help="The folder where the output files will be saved", type=str, required=True)
+    parser.add_argument('-w', "--workers", help="Number of stacks deconvolved in parallel (default: as many as fit in RAM)",
+                        type=int, default=None)
+    parser.add_argument("--threads", help="Number of threads of each worker (default: processors shared among the workers)",
+                        type=int, default=None)
+    parser.add_argument("--overwrite", help="Deconvolve also the stacks already present in the output folder", action='store_true')
+
+    utils.add_deconvolution_arguments(parser)
+
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.input_paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path) and not is_store(path):
+            paths += sorted(glob(os.path.join(path, "*.tif")) + glob(os.path.join(path, "*.tiff"))
+                            + glob(os.path.join(path, "*" + STORE_SUFFIX)))
+        else:
+            paths.append(path)
+    psf_path = os.path.abspath(args.psf_path)
+    output_folder = os.path.abspath(args.output_folder)
+
+    if not args.quiet:
+        # change verbosity
+        mtif.stack.log.setLevel(logging.INFO)
+
+    print(f"Starting deconvolution of {len(paths)} stacks")
+
+    utils.create_folders(output_folder)
+
+    psf = utils.read_stack(psf_path)
+
+    done, failed = deconvolve_many(paths, psf, output_folder, offset=args.offset, gain=args.gain,
+                                   n_workers=args.workers, dtype_out=args.dtype, overwrite=args.overwrite,
+                                   pad=args.pad, store=args.store, max_iter=args.max_iterations, accelerate=args.accelerate,
+                                   otf_cache=OTFCache(cache_dir=args.otf_cache) if args.otf_cache else None, planner=args.fftw_planner,
+                                   wisdom=not args.no_wisdom, n_threads=args.threads,
+                                   monitor=ConvergenceMonitor(rtol=args.rtol, time_budget=args.time_budget,
+                                                              lambda_plateau=args.lambda_plateau))
+
+    print(f"{len(done)} stacks deconvolved, saved in {output_folder}")
+    if failed:
+        print(f"{len(failed)} stacks failed:")
+        for path, error in failed:
+            print(f"  {path}: {error}")
+        sys.exit(1)
+
+    print("done.")
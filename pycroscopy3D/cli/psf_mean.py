@@ -13,7 +13,8 @@ def main(*args, **kwargs):
         a stack containing several point-like objects imaged with an optical system.\
         Example: ants_to_tif -o output_path image_path")
     parser.add_argument("input_path", help="Path to a stack containing several copies of the PSF.", type=str)
-    parser.add_argument('-o', "--output_path", help="The file where the average psf file will be saved", type=str, required=True)
+    parser.add_argument('-o', "--output_path", help="The file where the average psf file will be saved (.tif, or .chunks for a chunk store)",
+                        type=str, required=True)
     parser.add_argument('-d', "--dtype", help="Output data dype (default uint16)", type=str, default='uint16')
     parser.add_argument('-s', "--size-expected", help=f"exp_size (list of 3 int): \
         expected psf size in pixel (z,x,y). A detected objects is discarded if \
@@ -26,6 +27,11 @@ def main(*args, **kwargs):
         A value of 0 means to reject all objects which size is not identical to the expected size \
         (default={defaults['size_tolerance']}).",
         type=float, default=defaults['size_tolerance'])
+    parser.add_argument('-z', "--slab-size", help="Detect the PSFs processing the stack in slabs of this \
+        number of pages. Only the pages of a slab are read, instead of loading the whole stack \
+        in memory.", type=int, default=None)
+    parser.add_argument("--subpixel", help="Align the PSFs on their centroid with sub-voxel \
+        precision before averaging.", action='store_true')
     parser.add_argument('-q', "--quiet", help="Reduce verbosity", type=bool, default=False)
 
     args = parser.parse_args()
@@ -48,9 +54,12 @@ def main(*args, **kwargs):
     utils.create_folders(output_path)  
    
     # === MAKE MEAN PSF ====
-    s = pycro.read_stack(args.input_path)
-    pycro.plot_flatten(s)
-    psf = pycro.PSF(s, size_tolerance=args.tolerance, exp_size=exp_size)
+    if args.slab_size is None:
+        s = utils.read_stack(args.input_path)
+        pycro.plot_flatten(s)
+    else:
+        s = utils.open_stack(args.input_path)
+    psf = pycro.PSF(s, size_tolerance=args.tolerance, exp_size=exp_size, slab_size=args.slab_size)
     
     print(psf)
 
@@ -59,10 +68,10 @@ def main(*args, **kwargs):
         sys.stderr.write("An error occurred. Try changing the tolerance and size parameters.")
         exit(1)
 
-    psf.calc_mean_psf() 
+    psf.calc_mean_psf(subpixel=args.subpixel)
     mean_psf = psf.mean_PSF
     mean_psf.dtype_out = args.dtype
-    mtif.write_stack(mean_psf, args.output_path)
+    utils.write_stack(mean_psf, args.output_path)
     print("done")
         
 
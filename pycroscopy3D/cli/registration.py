@@ -18,6 +18,8 @@ def main(*args, **kwargs):
     parser.add_argument('-o', "--output_folder", help="The folder where the output file will be saved", type=str, required=True)
     parser.add_argument("-r", "--regitration_type", help="The ANTs registration type. Defaults to SyN.", type=str, default="SyN")
     parser.add_argument('-d', "--dtype", help="Output data dype (default uint16)", type=str, default='uint16')
+    parser.add_argument("--store", help="Save the output as a chunk store (.chunks folder of compressed chunks) instead of a tiff file",
+                        action='store_true')
     parser.add_argument('-q', "--quiet", help="Reduce verbosity", type=bool, default=False)
 
     args = parser.parse_args()
@@ -39,11 +41,11 @@ def main(*args, **kwargs):
 
     utils.create_folders(output_folder)
 
-    template = mtif.read_stack(template_path).pages
-    to_register = mtif.read_stack(input_path).pages
+    template = utils.read_array(template_path)
+    to_register = utils.read_array(input_path)
     
     if mask_path is not None:
-        mask = mtif.read_stack(mask_path).pages
+        mask = utils.read_array(mask_path)
     else:
         mask = None
 
@@ -52,5 +54,7 @@ def main(*args, **kwargs):
     reg_stack.dtype_out = numpy.dtype(args.dtype)
     
     out_path = os.path.join(output_folder, os.path.basename(input_path))
-    mtif.write_stack(reg_stack, out_path)
+    if args.store:
+        out_path = utils.store_path(out_path)
+    utils.write_stack(reg_stack, out_path)
     print(f"Registration done, stack saved as {out_path}")
\ No newline at end of file
@@ -2,20 +2,35 @@ import multipagetiff as mtif
 import argparse
 import logging
 import os
-from glob import glob
+import sys
 from . import utils
-from ..skew_correction import skew_correct_matlab
+from ..skew_correction import skew_correct_matlab, skew_correct_many, list_stacks
   
 def main(*args, **kwargs):
-    parser = argparse.ArgumentParser(description="Run skew-correction.")
-    parser.add_argument("input_folder", help="The folder containgin the images to skew correct (.tif)", type=str)
+    parser = argparse.ArgumentParser(description="Run skew-correction.\
+        Stacks already corrected in the output folder are skipped, so that an interrupted run can be resumed.")
+    parser.add_argument("input_paths", help="The folders containing the images to skew correct (.tif or .tiff), or the images", type=str, nargs='+')
     parser.add_argument('-o', "--output_folder", help="The folder where the output files will be saved", type=str, required=True)
     parser.add_argument('-i', "--info_file_path", help="Path of the info_file (.mat) produced by the SCAPE acquisition software", type=str, required=True)
+    parser.add_argument('-e', "--engine", help="python (default) or matlab (needs a MATLAB installation)",
+                        type=str, choices=['python', 'matlab'], default='python')
+    parser.add_argument('-w', "--workers", help="Number of stacks corrected in parallel (default: as many as fit in RAM)",
+                        type=int, default=None)
+    parser.add_argument("--overwrite", help="Correct also the stacks already present in the output folder", action='store_true')
+    parser.add_argument("--crop", help="valid: save only the box without the padding created by the correction,\
+                        planes: save every plane without its padding in a folder (python engine only)",
+                        type=str, choices=['valid', 'planes'], default=None)
+    parser.add_argument("--store", help="Save the outputs as chunk stores (.chunks folders of compressed chunks) instead of tiff files\
+                        (python engine only)", action='store_true')
     parser.add_argument('-q', "--quiet", help="Reduce verbosity", type=bool, default=False)
 
     args = parser.parse_args()
+    if args.engine == 'matlab' and args.crop is not None:
+        parser.error("--crop needs the python engine")
+    if args.engine == 'matlab' and args.store:
+        parser.error("--store needs the python engine")
 
-    input_folder=os.path.abspath(args.input_folder)
+    input_paths=[os.path.abspath(path) for path in args.input_paths]
     output_folder=os.path.abspath(args.output_folder)
     info_file_path=os.path.abspath(args.info_file_path)
 
@@ -24,13 +39,25 @@ def main(*args, **kwargs):
         # change verbosity
         mtif.stack.log.setLevel(logging.INFO)
 
-    nfiles = len(glob(args.input_folder+"/*.tif"))
+    nfiles = len(list_stacks(input_paths))
 
-    print(f"Starting skew-correction {nfiles} files in folder: {input_folder}")
+    print(f"Starting skew-correction of {nfiles} files in: {', '.join(input_paths)}")
     print(f"Working directory: {os.getcwd()}")
 
     utils.create_folders(output_folder)
-  
-    skew_correct_matlab(input_folder, output_folder, info_file_path)
 
-    print(f"Skew correction done, corrected stacks saved in {output_folder}")
\ No newline at end of file
+    if args.engine == 'matlab':
+        # the matlab script corrects all the .tif files of a folder
+        for input_folder in input_paths:
+            skew_correct_matlab(input_folder, output_folder, info_file_path)
+    else:
+        done, failed = skew_correct_many(input_paths, output_folder, info_file_path,
+                                         n_workers=args.workers, overwrite=args.overwrite, crop=args.crop, store=args.store)
+        print(f"{len(done)} stacks corrected")
+        if failed:
+            print(f"{len(failed)} stacks failed:")
+            for path, error in failed:
+                print(f"  {path}: {error}")
+            sys.exit(1)
+
+    print(f"Skew correction done, corrected stacks saved in {output_folder}")
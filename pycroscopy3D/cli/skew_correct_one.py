@@ -5,16 +5,27 @@ import os
 from . import utils
 
 
-from ..skew_correction import skew_correct_matlab_one
+from ..skew_correction import skew_correct_matlab_one, skew_correct_one
   
 def main(*args, **kwargs):
     parser = argparse.ArgumentParser(description="Run skew-correction.")
     parser.add_argument("input_path", help="The path of the stack to skew correct (.tif)", type=str)
     parser.add_argument('-o', "--output_folder", help="The folder where the output files will be saved", type=str, required=True)
     parser.add_argument('-i', "--info_file_path", help="Path of the info_file (.mat) produced by the SCAPE acquisition software", type=str, required=True)
+    parser.add_argument('-e', "--engine", help="python (default) or matlab (needs a MATLAB installation)",
+                        type=str, choices=['python', 'matlab'], default='python')
+    parser.add_argument("--crop", help="valid: save only the box without the padding created by the correction,\
+                        planes: save every plane without its padding in a folder (python engine only)",
+                        type=str, choices=['valid', 'planes'], default=None)
+    parser.add_argument("--store", help="Save the output as a chunk store (.chunks folder of compressed chunks) instead of a tiff file\
+                        (python engine only)", action='store_true')
     parser.add_argument('-q', "--quiet", help="Reduce verbosity", type=bool, default=False)
 
     args = parser.parse_args()
+    if args.engine == 'matlab' and args.crop is not None:
+        parser.error("--crop needs the python engine")
+    if args.engine == 'matlab' and args.store:
+        parser.error("--store needs the python engine")
 
     input_path=os.path.abspath(args.input_path)
     info_file_path=os.path.abspath(args.info_file_path)
@@ -31,6 +42,9 @@ def main(*args, **kwargs):
 
     utils.create_folders(output_folder)
   
-    skew_correct_matlab_one(input_path, output_folder, input_fname, info_file_path)
+    if args.engine == 'matlab':
+        skew_correct_matlab_one(input_path, output_folder, input_fname, info_file_path)
+    else:
+        skew_correct_one(input_path, output_folder, input_fname, info_file_path, crop=args.crop, store=args.store)
 
     print(f"Skew correction done, corrected stack saved in {output_folder}")
\ No newline at end of file
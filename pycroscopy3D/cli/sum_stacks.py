@@ -2,15 +2,20 @@ import multipagetiff as mtif
 import argparse
 import logging
 import os
-import numpy as np
 from . import utils
 
+from ..transformation.reduction import reduce_stacks, STATISTICS
+
 def main(*args, **kwargs):
-    parser = argparse.ArgumentParser(description="Calculate the mean of a set stacks.")
+    parser = argparse.ArgumentParser(description="Calculate the sum (or another voxel-wise statistic) of a set stacks.\
+        The stacks are read in parallel and accumulated one at a time, so any number of stacks can be reduced.")
     parser.add_argument("-s", "--stack_paths", help="The paths to the stacks to average", nargs='*', required=True)
-    parser.add_argument('-o', "--output_path", help="The output filename", type=str, required=True)
+    parser.add_argument('-o', "--output_path", help="The output filename (.tif, or .chunks for a chunk store)", type=str, required=True)
     parser.add_argument('-d', "--dtype", help="Output data dype (default uint16)", type=str, default='uint16')
-    parser.add_argument('-n', "--divisor", help="Divide the sum by this number (for average calculation)", type=float, default=1)
+    parser.add_argument('-n', "--divisor", help="Divide the result by this number (for average calculation)", type=float, default=1)
+    parser.add_argument('-t', "--statistic", help="The statistic to calculate (default sum). The median is approximated",
+                        type=str, choices=STATISTICS, default='sum')
+    parser.add_argument('-w', "--workers", help="Number of stacks read in parallel (default: 4)", type=int, default=None)
     parser.add_argument('-q', "--quiet", help="Reduce verbosity", type=bool, default=False)
 
     args = parser.parse_args()
@@ -19,27 +24,23 @@ def main(*args, **kwargs):
         # change verbosity
         mtif.stack.log.setLevel(logging.INFO)
 
-    print(f"Start sum calculation on {len(args.stack_paths)} files.")
+    print(f"Start {args.statistic} calculation on {len(args.stack_paths)} files.")
 
     out_dir = os.path.dirname(args.output_path)
 
     # create output dir
     utils.create_folders(out_dir)
-    
-    # create an empty stack to hold the mean
-    s = np.empty_like(mtif.read_stack(args.stack_paths[0]).pages, dtype=float)
-
-    for path in args.stack_paths:
-        # sum the files
-        s += mtif.read_stack(path).pages.astype(float)
-    
+
+    s = reduce_stacks(args.stack_paths, (args.statistic,), n_workers=args.workers, reader=utils.read_array,
+                      progress=not args.quiet)[args.statistic].astype(float)
+
     # Divide by the amount specified as divisor parameter.
     # (useful for mean calculation)
     s /= args.divisor
 
-    # write the sum
+    # write the result
     s = mtif.Stack(s)    
     s.dtype_out = args.dtype
-    mtif.write_stack(s, args.output_path)
+    utils.write_stack(s, args.output_path)
 
     print("done.")
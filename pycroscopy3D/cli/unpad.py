@@ -8,6 +8,8 @@ def main(*args, **kwargs):
     parser = argparse.ArgumentParser(description="Unpad one stack by removing zero-valued lines and columns from every page.")
     parser.add_argument("input_path", help="The path of the volume to register", type=str)
     parser.add_argument('-o', "--output_folder", help="The folder where the output file will be saved", type=str, required=True)
+    parser.add_argument("--store", help="Save the output as a chunk store (.chunks folder of compressed chunks) instead of a tiff file",
+                        action='store_true')
     parser.add_argument('-q', "--quiet", help="Reduce verbosity", type=bool, default=False)
 
     args = parser.parse_args()
@@ -19,11 +21,13 @@ def main(*args, **kwargs):
 
     print('unpadding')
 
-    stack = mtif.read_stack(args.input_path)
+    stack = utils.read_stack(args.input_path)
 
     mtif.stacktools.unpad_stack(stack)
 
-    out_path = os.path.join(args.output_folder, os.path.basename(args.input_path))
-    mtif.write_stack(stack, out_path)
+    out_path = os.path.join(args.output_folder, os.path.basename(args.input_path.rstrip(os.sep)))
+    if args.store:
+        out_path = utils.store_path(out_path)
+    utils.write_stack(stack, out_path)
 
     print('done')
\ No newline at end of file
@@ -1,7 +1,32 @@
 import os
 
+from ..storage import read_stack, read_array, write_stack, store_path, open_stack
+
 def create_folders(path):
     # create output folder if it does not exist
     if (path != '') and (not os.path.isdir(path)):
         print(f'directory "{path}" does not exist and will be created.')
-        os.makedirs(path, exist_ok=True)
\ No newline at end of file
+        os.makedirs(path, exist_ok=True)
+
+def add_deconvolution_arguments(parser):
+    """Add the options shared by the deconvolution commands to an argparse parser"""
+    parser.add_argument('-p', "--psf_path", help="The path of the PSF", type=str, required=True)
+    parser.add_argument('-g', "--gain", help="Acquisition gain", type=float, required=True)
+    parser.add_argument('-f', "--offset", help="Image offset level (defaults to 100)", type=int, default=100)
+    parser.add_argument('-d', "--dtype", help="Output data dype (default uint16)", type=str, default='uint16')
+    parser.add_argument('-i', "--max_iterations", help="Maximum iteration number (default 2)", type=int, default=2)
+    parser.add_argument('-a', "--accelerate", help="Use accelerated Richardson-Lucy (fewer iterations needed)", action='store_true')
+    parser.add_argument("--rtol", help="Stop when the change of the estimate is below this fraction of the first change",
+                        type=float, default=None)
+    parser.add_argument("--time_budget", help="Stop the iterations of a stack after this time, in seconds", type=float, default=None)
+    parser.add_argument("--lambda_plateau", help="Stop when the regularization factor changes by less than this fraction",
+                        type=float, default=None)
+    parser.add_argument('-c', "--otf_cache", help="Folder where the OTF of the PSF is cached between runs", type=str, default=None)
+    parser.add_argument("--fftw_planner", help="FFTW planner effort (default estimate). Slower planning, faster iterations",
+                        type=str, choices=['estimate', 'measure', 'patient', 'exhaustive'], default='estimate')
+    parser.add_argument("--no_wisdom", help="Do not load and save FFTW wisdom in the user cache folder", action='store_true')
+    parser.add_argument("--pad", help="Pad the stacks to a fast FFT shape (reflect or mean), the result is cropped back",
+                        type=str, choices=['reflect', 'mean'], default=None)
+    parser.add_argument("--store", help="Save the outputs as chunk stores (.chunks folder of compressed chunks) instead of tiff files",
+                        action='store_true')
+    parser.add_argument('-q', "--quiet", help="Reduce verbosity", type=bool, default=False)
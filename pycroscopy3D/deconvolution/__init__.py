@@ -1,9 +1,12 @@
-from .noise import plot_gain_fit, estimate_gain
+from .noise import plot_gain_fit, estimate_gain, NoiseHistogram
+from .convergence import ConvergenceMonitor, HISTORY_DTYPE
+from .otf import OTFCache, otf_cache
+from .padding import next_fast_len, fast_shape, padding_report
 import logging
 
 log = logging.getLogger(__name__)
 
 try:
-    from .deconvolution import deconvolve
+    from .deconvolution import deconvolve, deconvolve_tiled, deconvolve_many, batch_workers, Deconvolver, fftw_wisdom_path, padded_empty
 except ModuleNotFoundError:
     log.warn("deconvolution module not available")
@@ -0,0 +1,149 @@
+"""Convergence control of the deconvolution iterations.
+
+The deconvolution library calls a callback before every iteration with
+the statistics of the current estimate, and stops when the callback
+returns False. ConvergenceMonitor is such a callback: it records the
+statistics and stops the iterations when the estimate does not change
+anymore, instead of always running up to the maximum number of
+iterations.
+"""
+
+import time
+from collections import deque
+
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+# statistics of the estimate after each iteration
+HISTORY_DTYPE = np.dtype([
+    ('iteration', np.uint32),
+    ('min', np.float64),
+    ('max', np.float64),
+    ('sum', np.float64),
+    ('nrm2_prev', np.float64),      # Euclidean norm of the change since the previous iteration
+    ('nrm2_prevprev', np.float64),  # same, since two iterations before
+    ('lambda', np.float64),         # regularization factor
+    ('lambda_factor', np.float64),
+    ('snr', np.float64),
+    ('time', np.float64),           # seconds since the start of the deconvolution
+])
+
+
+class ConvergenceMonitor:
+    """Stop the deconvolution iterations on convergence.
+
+    The iterations stop on the first of the following criteria:
+
+    - max_iter iterations are done;
+    - the regularization factor lambda decreased for 3 iterations (the
+      criterion of the deconvolution library);
+    - rtol: the change of the estimate, nrm2_prev, is smaller than rtol
+      times the change at the first iteration;
+    - time_budget: the next iteration would end after time_budget seconds;
+    - lambda_plateau: the regularization factor changed by less than this
+      fraction over the last lambda_window iterations.
+
+    Args:
+        max_iter (int): maximum number of iterations. If None, the max_iter of
+            the Deconvolver running the iterations (see start).
+        rtol (float): relative tolerance on the change of the estimate.
+        time_budget (float): maximum duration of the iterations, in seconds.
+        lambda_plateau (float): relative tolerance on the regularization factor.
+        lambda_window (int): number of iterations of the lambda plateau.
+        verbose (bool): log the statistics of every iteration (at INFO
+            level, DEBUG otherwise).
+
+    After a deconvolution, history holds the statistics of the iterations
+    and reason the criterion that stopped them.
+    """
+
+    # number of decreasing lambda values stopping the iterations, as in
+    # the deconvolution library
+    LAMBDA_STACK_SIZE = 3
+
+    def __init__(self, max_iter=None, rtol=None, time_budget=None, lambda_plateau=None,
+                 lambda_window=5, verbose=False):
+        self.max_iter = max_iter
+        self.rtol = rtol
+        self.time_budget = time_budget
+        self.lambda_plateau = lambda_plateau
+        self.lambda_window = lambda_window
+        self.verbose = verbose
+        # limit of the current run
+        self._max_iter = max_iter
+        self.reset()
+
+    def start(self, max_iter=None):
+        """Prepare a run with max_iter iterations, unless the monitor has its own max_iter.
+
+        Called by the Deconvolver before every deconvolution, so that the
+        same monitor can be used by Deconvolvers with different limits.
+        """
+        self._max_iter = self.max_iter if self.max_iter is not None else max_iter
+        self.reset()
+
+    def reset(self):
+        """Forget the previous deconvolution."""
+        self._rows = []
+        self._lambdas = deque(maxlen=self.LAMBDA_STACK_SIZE)
+        self._start = None
+        self.reason = None
+
+    @property
+    def history(self):
+        """Statistics of the iterations, as a structured array (see HISTORY_DTYPE)."""
+        return np.array(self._rows, dtype=HISTORY_DTYPE)
+
+    @property
+    def n_iterations(self):
+        return len(self._rows)
+
+    def _stop(self, iteration_number, lmbda, nrm2_prev, elapsed):
+        if self._max_iter is not None and iteration_number >= self._max_iter:
+            return "maximum number of iterations"
+
+        if len(self._lambdas) == self.LAMBDA_STACK_SIZE and all(l > lmbda for l in self._lambdas):
+            return "regularization factor decreasing"
+
+        if iteration_number == 0:
+            return None
+
+        if self.rtol is not None and nrm2_prev < self.rtol*self._rows[0][4]:
+            return f"relative change below {self.rtol}"
+
+        if self.time_budget is not None and elapsed*(iteration_number + 1)/iteration_number > self.time_budget:
+            return f"time budget of {self.time_budget} s"
+
+        if self.lambda_plateau is not None and len(self._rows) >= self.lambda_window:
+            lambdas = [row[6] for row in self._rows[-self.lambda_window:]]
+            if lmbda > 0 and max(lambdas) - min(lambdas) < self.lambda_plateau*lmbda:
+                return f"regularization factor plateau within {self.lambda_plateau}"
+
+        return None
+
+    def __call__(self, iteration_number, cmin, cmax, csum, nrm2_prev, nrm2_prevprev,
+                 lmbda, lmbda_factor, snr):
+        """Callback of the deconvolution library, returns False to stop."""
+        now = time.perf_counter()
+        if iteration_number == 0:
+            self.reset()
+            self._start = now
+        elapsed = now - self._start
+
+        if iteration_number > 0:
+            # in the order of HISTORY_DTYPE
+            self._rows.append((iteration_number, cmin, cmax, csum, nrm2_prev, nrm2_prevprev,
+                               lmbda, lmbda_factor, snr, elapsed))
+            log.log(logging.INFO if self.verbose else logging.DEBUG,
+                    f"iteration {iteration_number}: min/max/sum {cmin:g} {cmax:g} {csum:g}, "
+                    f"nrm2 {nrm2_prev:g} {nrm2_prevprev:g}, lambda {lmbda:g}, snr {snr:g}")
+
+        self.reason = self._stop(iteration_number, lmbda, nrm2_prev, elapsed)
+        self._lambdas.append(lmbda)
+
+        if self.reason is not None:
+            log.info(f"deconvolution stopped after {iteration_number} iterations: {self.reason}")
+            return False
+        return True
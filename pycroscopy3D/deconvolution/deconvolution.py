@@ -1,5 +1,16 @@
 import multipagetiff as mtif
 import numpy as np
+import multiprocessing as mp
+import os
+import shutil
+from collections import deque
+from itertools import product
+from tqdm import tqdm
+
+from .convergence import ConvergenceMonitor
+from .padding import fast_shape, pad_stack, padding_report
+from ..transformation.transformation import get_number_of_array_fitting_ram
+from ..storage import read_array, read_stack, write_stack, store_path
 
 import logging
 log = logging.getLogger(__name__)
@@ -32,35 +43,620 @@ def _preprocess_stack(stack, dtype='float32'):
     return imgs.astype(dtype)
 
 
-def deconvolve(img_stack, psf_stack, offset=0, gain=1, dtype="float32",
-               psf_px_size=(1, 1, 1), img_px_size=(1, 1, 1), regularization=True,
-               max_iter=None):
-    psf = _preprocess_stack(psf_stack, dtype=dtype)
-    img = _preprocess_stack(img_stack, dtype=dtype)
+def fftw_wisdom_path(dtype="float32"):
+    """Return the path of the file where the FFTW wisdom is kept between runs.
+
+    The file is in the user cache folder ($XDG_CACHE_HOME or ~/.cache).
+    """
+    cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_dir, 'pycroscopy3D', f'fftw_wisdom_{np.dtype(dtype).name}')
+
+
+def padded_empty(shape, dtype="float32"):
+    """Allocate a stack in the memory layout of the deconvolution library.
+
+    The last axis is padded to 2*(n//2+1) elements, as needed by the FFTW
+    in-place real transforms. Fill the returned stack and pass it to
+    Deconvolver.deconvolve_inplace to deconvolve it without copies.
+
+    Args:
+        shape (tuple): shape of the stack (z, y, x).
+        dtype (str): float32 or float64.
+
+    Returns:
+        ndarray: a view of the padded array with the requested shape.
+    """
+    nz, ny, nx = shape
+    padded = np.empty((nz, ny, 2*(nx//2+1)), dtype=dtype)
+    return padded[:, :, :nx]
+
+
+def _padded_base(img):
+    """Return the padded array behind a stack allocated by padded_empty"""
+    nz, ny, nx = img.shape
+    n = 2*(nx//2+1)
+    if img.strides != (ny*n*img.itemsize, n*img.itemsize, img.itemsize):
+        raise ValueError("the stack is not in the padded layout, use padded_empty to allocate it")
+    return np.lib.stride_tricks.as_strided(img, shape=(nz, ny, n))
+
+
+class Deconvolver:
+    """Deconvolve many stacks of the same shape with the same PSF.
+
+    The deconvolution library object is kept between the calls, together
+    with the OTF of the PSF, the work buffers and their FFTW plans. When
+    the stacks have the same shape (e.g. the volumes of a time series),
+    only the iterations are computed for each stack.
+
+    Args:
+        psf_stack (mtif.Stack): the PSF.
+        psf_px_size (tuple): PSF pixel size (z, y, x).
+        img_px_size (tuple): image pixel size (z, y, x).
+        regularization (bool): use regularized Richardson-Lucy.
+        max_iter (int): maximum number of iterations.
+        accelerate (bool): use the Biggs-Andrews vector extrapolation, which
+            reaches the same result in fewer iterations.
+        dtype (str): float32 or float64, precision of the computation.
+        otf_cache (OTFCache): cache of the OTFs, shared with other Deconvolvers
+            or runs. None (the default) for no cache: the OTF is computed
+            for every new stack shape and freed with the Deconvolver. The
+            OTFs in a cache stay in memory, see OTFCache.
+        planner (str): FFTW planner effort: estimate, measure, patient or
+            exhaustive. Other than estimate, FFTW measures the fastest FFT
+            algorithm the first time a stack shape is seen.
+        wisdom (bool): load and save the FFTW wisdom (the measured plans)
+            in the user cache folder, so that the planning is done once.
+        n_threads (int): number of threads used by the FFTs and the image
+            operations. None uses all the processors, unless limited by the
+            OMP_NUM_THREADS environment variable.
+        monitor (ConvergenceMonitor): decides when to stop the iterations and
+            records their statistics (monitor.history). By default, the
+            iterations stop after max_iter iterations or when the
+            regularization factor decreases.
+    """
+
+    def __init__(self, psf_stack, psf_px_size=(1, 1, 1), img_px_size=(1, 1, 1),
+                 regularization=True, max_iter=None, accelerate=False, dtype="float32",
+                 otf_cache=None, planner="estimate", wisdom=True, n_threads=None,
+                 monitor=None):
+        if planner not in iocbio.FFTW_FLAGS:
+            raise ValueError(f"unknown FFTW planner '{planner}', use one of {list(iocbio.FFTW_FLAGS)}")
+
+        self.dtype = np.dtype(dtype)
+        self.psf = _preprocess_stack(psf_stack, dtype=self.dtype)
+        self.psf_px_size = psf_px_size
+        self.img_px_size = img_px_size
+        self.otf_cache = otf_cache
+        # shape of the image for which the OTF is set
+        self._otf_shape = None
+        # shapes for which FFTW plans were made
+        self._planned_shapes = set()
+
+        if self.dtype == np.float64:
+            self._dec = iocbio.PyDeconvolve()
+        else:
+            self._dec = iocbio.PyDeconvolveFloat()
+
+        # sizes in pixel
+        nz, ny, nx = self.psf.shape
+        # pixel-size in meters
+        pz, py, px = psf_px_size
+        self._dec.set_psf(self.psf.ravel(), nz, ny, nx, px, py, pz)
+
+        if not regularization:
+            self._dec.disable_regularization()
+
+        if max_iter is not None:
+            self._dec.set_max_iterations(max_iter)
+
+        # the monitor gets this limit at every run, unless it has its own
+        self.max_iter = self._dec.max_iterations()
+        if monitor is None:
+            monitor = ConvergenceMonitor()
+        self.monitor = monitor
+
+        if accelerate:
+            self._dec.enable_acceleration()
+
+        if n_threads is not None:
+            self._dec.set_threads(n_threads)
+
+        self._dec.set_fftw_flags(iocbio.FFTW_FLAGS[planner])
+        # wisdom is useless with the estimate planner
+        self._wisdom_path = fftw_wisdom_path(self.dtype) if wisdom and planner != "estimate" else None
+        if self._wisdom_path is not None and os.path.isfile(self._wisdom_path):
+            if not self._dec.import_fftw_wisdom(self._wisdom_path):
+                log.warning(f"could not import FFTW wisdom from {self._wisdom_path}")
+
+    def _export_wisdom(self):
+        os.makedirs(os.path.dirname(self._wisdom_path), exist_ok=True)
+        # write to a temporary file, other processes may be reading it
+        tmp_path = f"{self._wisdom_path}.{os.getpid()}.tmp"
+        if self._dec.export_fftw_wisdom(tmp_path):
+            os.replace(tmp_path, self._wisdom_path)
+        else:
+            log.warning(f"could not export FFTW wisdom to {self._wisdom_path}")
+
+    def _set_otf(self, shape):
+        """Take the OTF for images of the given shape from the cache"""
+        if self.otf_cache is None or shape == self._otf_shape:
+            return
+
+        mz, my, mx = shape
+        vz, vy, vx = self.img_px_size
+        pz, py, px = self.psf_px_size
+
+        key = self.otf_cache.key(self.psf, (px, py, pz), shape, (vz, vy, vx))
+        otf = self.otf_cache.get(key)
+        if otf is None:
+            otf = self._dec.get_otf(mz, my, mx, vz, vy, vx)
+            self.otf_cache.put(key, otf)
+        else:
+            self._dec.set_otf(otf, mz, my, mx, vz, vy, vx)
+        self._otf_shape = shape
+
+    def deconvolve(self, img_stack, offset=0, gain=1, pad=None, dtype_out=None):
+        """Deconvolve one stack.
+
+        Args:
+            img_stack (mtif.Stack): the stack to deconvolve.
+            offset (float): camera offset, subtracted before deconvolution.
+            gain (float): camera gain, images are converted to photon counts.
+            pad (str): if 'reflect' or 'mean', the stack is padded by at least
+                the PSF extent, to a shape for which the FFTs are fast (see
+                padding.fast_shape), and the result is cropped back. This
+                avoids the wrap-around at the borders. None to disable.
+            dtype_out (str): data type of the result, None for the dtype of
+                the Deconvolver. For uint16 stacks deconvolved into uint16,
+                the conversions are done by the deconvolution library (see
+                deconvolve_counts).
+
+        Returns:
+            mtif.Stack: the deconvolved stack.
+        """
+        pages = img_stack.pages
+        if pad is None and pages.dtype == np.uint16 and np.dtype(dtype_out or self.dtype) == np.uint16:
+            return mtif.Stack(self.deconvolve_counts(pages, offset=offset, gain=gain))
+
+        crop = tuple(slice(None) for _ in pages.shape)
+        if pad is not None:
+            margin = psf_margin(self.psf.shape, self.psf_px_size, self.img_px_size)
+            shape, _ = fast_shape(pages.shape, margin)
+            log.info(padding_report(pages.shape, margin))
+            pages, crop = pad_stack(pages, shape, mode=pad)
+
+        img = padded_empty(pages.shape, dtype=self.dtype)
+        img[...] = pages
+        self.deconvolve_inplace(img, offset=offset, gain=gain)
+        deconvolved = mtif.Stack(np.ascontiguousarray(img[crop]))
+        if dtype_out is not None:
+            deconvolved.dtype_out = np.dtype(dtype_out)
+        return deconvolved
+
+    def deconvolve_inplace(self, img, offset=0, gain=1):
+        """Deconvolve a stack in place, without copies.
+
+        The stack is passed to the deconvolution library as it is, and
+        the library writes the result back into it. This is the path with
+        the lowest memory use for large stacks.
+
+        Peak memory is about 6 times the padded stack: img, the 4 work
+        images of the library (current estimate, previous estimate, the one
+        of 2 iterations ago, and the divergence of the regularization) and
+        the OTF. The divergence is not allocated without regularization,
+        the accelerated mode adds 3 work images. The work images are kept
+        for the next stacks of the same shape, see release_buffers.
+
+        Args:
+            img (ndarray): the stack, as returned by padded_empty. Its dtype
+                must be the one of the Deconvolver.
+            offset (float): camera offset, subtracted before deconvolution.
+            gain (float): camera gain, images are converted to photon counts.
+
+        Returns:
+            ndarray: img, holding the deconvolved stack.
+        """
+        if img.dtype != self.dtype:
+            raise ValueError(f"stack dtype is {img.dtype}, expected {self.dtype}")
+        padded = _padded_base(img)
+
+        # convert to photon counts, without temporary arrays
+        np.maximum(img, 0, out=img)
+        np.subtract(img, offset, out=img)
+        np.divide(img, gain, out=img)
+        np.round(img, out=img)
+        np.maximum(img, 0, out=img)
+
+        mx = img.shape[2]
+        vz, vy, vx = self.img_px_size
+
+        self._set_otf(img.shape)
+        self.monitor.start(self.max_iter)
+        self._dec.deconvolve_inplace(padded, mx, vz, vy, vx, callback=self.monitor)
+        self._planned(img.shape)
+
+        np.maximum(img, 0, out=img)
+        np.multiply(img, gain, out=img)
+        np.add(img, offset, out=img)
+
+        return img
+
+    def deconvolve_counts(self, img, offset=0, gain=1, out=None):
+        """Deconvolve a uint16 stack into a uint16 stack.
+
+        The conversion into photon counts, with offset and gain, is done by
+        the deconvolution library while loading the stack, and the result
+        is converted back into camera counts, rounded and clipped to the
+        uint16 range while it is written out. No intermediate arrays are
+        made, and only the uint16 input and output are held in Python.
+
+        Args:
+            img (ndarray): the stack, uint16.
+            offset (float): camera offset.
+            gain (float): camera gain.
+            out (ndarray): uint16 C-contiguous array of the same shape for the
+                result. Allocated if None.
+
+        Returns:
+            ndarray: the deconvolved stack, uint16.
+        """
+        img = np.ascontiguousarray(img, dtype=np.uint16)
+        vz, vy, vx = self.img_px_size
+
+        self._set_otf(img.shape)
+        self.monitor.start(self.max_iter)
+        out = self._dec.deconvolve_counts(img, vz, vy, vx, offset, gain, out=out, callback=self.monitor)
+        self._planned(img.shape)
+
+        return out
+
+    def _planned(self, shape):
+        """Save the FFTW wisdom after the first deconvolution of a shape"""
+        if shape not in self._planned_shapes:
+            self._planned_shapes.add(shape)
+            if self._wisdom_path is not None:
+                self._export_wisdom()
+
+    def release_buffers(self):
+        """Free the memory of the work buffers (allocated again when needed)."""
+        self._dec.release_buffers()
+
+
+def psf_margin(psf_shape, psf_px_size=(1, 1, 1), img_px_size=(1, 1, 1)):
+    """Return the extent of the PSF in image pixels, along each axis (z, y, x).
+
+    This is the margin needed around a tile so that its core is deconvolved
+    as in the whole stack.
+    """
+    return tuple(int(np.ceil(n*p/v)) for n, p, v in zip(psf_shape, psf_px_size, img_px_size))
 
-    img = np.round((img-offset)/gain).astype(dtype)
-    img = np.where(img < 0, 0, img)
 
-    # sizes in pixel
-    nz, ny, nx = psf.shape
-    mz, my, mx = img.shape
-    # pixel-size in meters
-    pz, py, px = psf_px_size
-    vz, vy, vx = img_px_size
+def _tile_windows(n, tile, margin):
+    """Split an axis of length n in tiles of size tile, overlapping by margin.
+
+    All the tiles have the same size, the last one is shifted inwards.
+    The cores of the tiles partition the axis.
+
+    Returns:
+        list: (start, core_start, core_stop) of each tile.
+    """
+    if tile >= n:
+        return [(0, 0, n)]
+
+    core = tile - 2*margin
+    if core <= 0:
+        raise ValueError(f"tile size {tile} must be larger than twice the margin {margin}")
+
+    windows = []
+    for c0 in range(0, n, core):
+        c1 = min(c0 + core, n)
+        start = min(max(c0 - margin, 0), n - tile)
+        windows.append((start, c0, c1))
+    return windows
+
+
+def iter_tiles(shape, tile_shape, margin):
+    """Iterate over the overlapping tiles of a stack.
+
+    Yields:
+        tuple: (tile, core, core_in_tile) tuples of slices, the tile in the
+        stack, the part of the stack given by the tile and the same part in
+        the tile coordinates.
+    """
+    windows = [_tile_windows(n, t, m) for n, t, m in zip(shape, tile_shape, margin)]
+    sizes = [min(t, n) for n, t in zip(shape, tile_shape)]
+    for w in product(*windows):
+        tile = tuple(slice(s, s + size) for (s, _, _), size in zip(w, sizes))
+        core = tuple(slice(c0, c1) for _, c0, c1 in w)
+        core_in_tile = tuple(slice(c0 - s, c1 - s) for s, c0, c1 in w)
+        yield tile, core, core_in_tile
+
+
+# Deconvolver of a worker process of deconvolve_tiled
+_worker_deconvolver = None
+
+
+def _init_worker(psf_stack, kwargs):
+    global _worker_deconvolver
+    _worker_deconvolver = Deconvolver(psf_stack, **kwargs)
+
+
+def _deconvolve_tile(deconvolver, data, core_in_tile, offset, gain, counts, pad=None, pad_shape=None):
+    if pad_shape is not None:
+        data, crop = pad_stack(data, pad_shape, mode=pad)
+        core_in_tile = tuple(slice(c.start + s.start, c.stop + s.start) for c, s in zip(core_in_tile, crop))
+    if counts:
+        return deconvolver.deconvolve_counts(data, offset=offset, gain=gain)[core_in_tile].copy()
+    img = padded_empty(data.shape, dtype=deconvolver.dtype)
+    img[...] = data
+    deconvolver.deconvolve_inplace(img, offset=offset, gain=gain)
+    return img[core_in_tile].copy()
+
+
+def _deconvolve_tile_in_worker(data, core_in_tile, offset, gain, counts, pad, pad_shape):
+    return _deconvolve_tile(_worker_deconvolver, data, core_in_tile, offset, gain, counts, pad, pad_shape)
+
+
+def deconvolve_tiled(img, psf_stack, tile_shape, out=None, n_workers=1, margin=None,
+                     offset=0, gain=1, pad=None, **kwargs):
+    """Deconvolve a stack by overlapping tiles (overlap-save).
+
+    The stack is split into tiles of tile_shape, overlapping by a margin
+    of the size of the PSF. Each tile is deconvolved and only its core,
+    away from the tile borders, is written into the output. The memory
+    used by the deconvolution is bounded by the tile size, so that stacks
+    larger than memory can be processed when img and out are memory-mapped
+    arrays (e.g. tifffile.memmap).
+
+    Note that the SNR and the regularization factor are estimated for each
+    tile.
+
+    Args:
+        img (ndarray): the stack to deconvolve (z, y, x).
+        psf_stack (mtif.Stack): the PSF.
+        tile_shape (tuple): shape of the tiles, including the margins.
+        out (ndarray): output array, of the same shape as img. Allocated if None.
+            If img and out are uint16, the tiles are deconvolved from and into
+            camera counts by the library (see Deconvolver.deconvolve_counts).
+        n_workers (int): number of processes deconvolving tiles in parallel.
+        margin (tuple): overlap margin (z, y, x) in pixels. Defaults to the
+            PSF extent.
+        offset (float): camera offset.
+        gain (float): camera gain.
+        pad (str): 'reflect' or 'mean' to pad the tiles to a fast FFT shape
+            (see padding.fast_shape) when they are not, e.g. along the axes
+            where the stack is smaller than tile_shape. The result is cropped back.
+        **kwargs: passed to Deconvolver (psf_px_size, img_px_size, max_iter...).
+            Unless n_threads is given, the processors are shared among the
+            workers.
+
+    Returns:
+        ndarray: the deconvolved stack (out).
+    """
+    dtype = np.dtype(kwargs.get('dtype', 'float32'))
+    if n_workers > 1 and kwargs.get('n_threads') is None:
+        # do not oversubscribe the processors
+        kwargs['n_threads'] = max(1, mp.cpu_count() // n_workers)
+    if out is None:
+        out = np.empty(img.shape, dtype=dtype)
+    counts = img.dtype == np.uint16 and out.dtype == np.uint16
+
+    if margin is None:
+        margin = psf_margin(psf_stack.pages.shape, kwargs.get('psf_px_size', (1, 1, 1)),
+                            kwargs.get('img_px_size', (1, 1, 1)))
+
+    tiles = list(iter_tiles(img.shape, tile_shape, margin))
+    log.info(f"deconvolving {len(tiles)} tiles of shape {tile_shape} with margin {margin}")
+
+    # the tiles are clipped to the stack where it is smaller than tile_shape
+    pad_shape = None
+    if pad is not None:
+        tile_size = tuple(min(t, n) for t, n in zip(tile_shape, img.shape))
+        pad_shape, _ = fast_shape(tile_size)
+        log.info(padding_report(tile_size))
+        if pad_shape == tile_size:
+            pad_shape = None
+
+    if n_workers == 1:
+        deconvolver = Deconvolver(psf_stack, **kwargs)
+        for tile, core, core_in_tile in tqdm(tiles, desc="Deconvolve tiles"):
+            out[core] = _deconvolve_tile(deconvolver, np.asarray(img[tile]), core_in_tile, offset, gain, counts,
+                                         pad, pad_shape)
+        return out
+
+    with mp.Pool(n_workers, initializer=_init_worker, initargs=(psf_stack, kwargs)) as pool:
+        # keep a bounded number of tiles in flight, to bound the memory
+        pending = deque()
+        with tqdm(total=len(tiles), desc="Deconvolve tiles") as pbar:
+            for tile, core, core_in_tile in tiles:
+                pending.append((core, pool.apply_async(
+                    _deconvolve_tile_in_worker, (np.asarray(img[tile]), core_in_tile, offset, gain, counts,
+                                                 pad, pad_shape))))
+                if len(pending) >= 2*n_workers:
+                    core, result = pending.popleft()
+                    out[core] = result.get()
+                    pbar.update()
+            while pending:
+                core, result = pending.popleft()
+                out[core] = result.get()
+                pbar.update()
+
+    return out
+
+
+# number of volumes, in the computation dtype, held in memory by a worker of
+# deconvolve_many: input, work buffers of the library, OTF and output
+_WORKER_VOLUMES = 8
+# additional volumes of the accelerated mode
+_ACCELERATION_VOLUMES = 3
+
+
+def _output_path(path, out_folder, store=False):
+    out_path = os.path.join(out_folder, os.path.basename(path.rstrip(os.sep)))
+    return store_path(out_path) if store else out_path
+
+
+def _deconvolve_file(deconvolver, path, out_folder, offset, gain, dtype_out, pad, store=False):
+    out_path = _output_path(path, out_folder, store)
+    stack = read_stack(path)
+    deconvolved = deconvolver.deconvolve(stack, offset=offset, gain=gain, pad=pad, dtype_out=dtype_out)
+
+    # write to a hidden temporary file first, so that an interrupted run
+    # never leaves a partial output that would be skipped when resuming
+    root, ext = os.path.splitext(os.path.basename(out_path))
+    tmp_path = os.path.join(out_folder, f".{root}.{os.getpid()}.tmp{ext}")
+    write_stack(deconvolved, tmp_path)
+    if os.path.isdir(out_path):
+        # overwrite a chunk store
+        shutil.rmtree(out_path)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def _deconvolve_file_in_worker(args):
+    path, out_folder, offset, gain, dtype_out, pad, store = args
+    try:
+        return path, _deconvolve_file(_worker_deconvolver, path, out_folder, offset, gain, dtype_out, pad, store), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def batch_workers(shape, dtype="float32", accelerate=False):
+    """Number of stacks of the given shape that can be deconvolved in parallel.
+
+    The number is limited by the available RAM and by the number of
+    processors.
+    """
+    # only the size of the array is used, its memory is never touched
+    volume = np.empty(shape, dtype=dtype)
+    volumes = _WORKER_VOLUMES + (_ACCELERATION_VOLUMES if accelerate else 0)
+    n_fit = get_number_of_array_fitting_ram(volume) // volumes
+    return int(max(1, min(mp.cpu_count(), n_fit)))
+
+
+def deconvolve_many(paths, psf_stack, out_folder, offset=0, gain=1, n_workers=None,
+                    dtype_out="uint16", overwrite=False, pad=None, store=False, **kwargs):
+    """Deconvolve many stacks, saving each to out_folder with the same file name.
+
+    The stacks are distributed over a pool of processes. Each process
+    keeps one Deconvolver, so that the OTF and the work buffers are made
+    once per process when the stacks have the same shape (e.g. the
+    volumes of a time series).
+
+    Stacks whose output file already exists are skipped, so an interrupted
+    run can be resumed by calling deconvolve_many again. Outputs are
+    written to a temporary file and renamed when complete.
+
+    Args:
+        paths (list): paths of the stacks (TIFF files or chunk stores).
+        psf_stack (mtif.Stack): the PSF.
+        out_folder (str): folder of the deconvolved stacks.
+        offset (float): camera offset.
+        gain (float): camera gain.
+        n_workers (int): number of processes. If None, as many as the
+            processors, limited by the number of stacks fitting in the
+            available RAM (see batch_workers).
+        dtype_out (str): data type of the saved stacks.
+        overwrite (bool): deconvolve also the stacks whose output exists.
+        pad (str): padding mode, see Deconvolver.deconvolve.
+        store (bool): save the stacks as chunk stores (<name>.chunks, see
+            pycroscopy3D.storage) instead of TIFF files.
+        **kwargs: passed to Deconvolver (psf_px_size, img_px_size, max_iter...).
+            Unless n_threads is given, the processors are shared among the
+            workers.
+
+    Returns:
+        tuple: (done, failed), the list of the written output paths and the
+        list of (path, error message) of the stacks that failed.
+    """
+    os.makedirs(out_folder, exist_ok=True)
+
+    todo = [p for p in paths if overwrite or not os.path.exists(_output_path(p, out_folder, store))]
+    if len(todo) < len(paths):
+        log.info(f"skipping {len(paths) - len(todo)} stacks already deconvolved")
+    if not todo:
+        return [], []
+
+    if n_workers is None:
+        shape = read_array(todo[0]).shape
+        n_workers = batch_workers(shape, kwargs.get('dtype', 'float32'), kwargs.get('accelerate', False))
+    n_workers = min(n_workers, len(todo))
+    if kwargs.get('n_threads') is None:
+        # do not oversubscribe the processors
+        kwargs['n_threads'] = max(1, mp.cpu_count() // n_workers)
+    log.info(f"deconvolving {len(todo)} stacks with {n_workers} workers")
+
+    done, failed = [], []
+    if n_workers == 1:
+        deconvolver = Deconvolver(psf_stack, **kwargs)
+        for path in tqdm(todo, desc="Deconvolve stacks"):
+            try:
+                done.append(_deconvolve_file(deconvolver, path, out_folder, offset, gain, dtype_out, pad, store))
+            except Exception as e:
+                log.error(f"deconvolution of {path} failed: {e}")
+                failed.append((path, f"{type(e).__name__}: {e}"))
+        return done, failed
+
+    args = [(path, out_folder, offset, gain, dtype_out, pad, store) for path in todo]
+    with mp.Pool(n_workers, initializer=_init_worker, initargs=(psf_stack, kwargs)) as pool:
+        for path, out_path, error in tqdm(pool.imap_unordered(_deconvolve_file_in_worker, args),
+                                          total=len(todo), desc="Deconvolve stacks"):
+            if error is None:
+                done.append(out_path)
+            else:
+                log.error(f"deconvolution of {path} failed: {error}")
+                failed.append((path, error))
+
+    return done, failed
+
+
+def deconvolve(img_stack, psf_stack, offset=0, gain=1, dtype="float32",
+               psf_px_size=(1, 1, 1), img_px_size=(1, 1, 1), regularization=True,
+               max_iter=None, accelerate=False, otf_cache=None, planner="estimate",
+               wisdom=True, tile_shape=None, n_workers=1, pad=None, n_threads=None, monitor=None,
+               dtype_out=None):
+    """Deconvolve a stack with the IOCBIO Richardson-Lucy algorithm.
 
-    a = iocbio.PyDeconvolveFloat()
-    a.set_psf(psf.ravel(), nz, ny, nx, px, py, pz)
+    If an OTFCache is given, the OTF of the PSF is taken from it when
+    available, so that it is computed only once for all the stacks of the
+    same shape (the cached OTFs stay in memory, see OTFCache). By default
+    no OTF is cached. To deconvolve many stacks, use a
+    Deconvolver, which also keeps the work buffers between the calls.
+    See Deconvolver for the FFTW planner, wisdom, n_threads and monitor
+    options.
 
-    if not regularization:
-        a.disable_regularization()
+    If tile_shape is given, the stack is deconvolved by overlapping tiles,
+    using n_workers processes (see deconvolve_tiled). img_stack can then
+    be a storage.LazyStack, only the tiles are read.
 
-    if max_iter is not None:
-        a.set_max_iterations(max_iter)
+    With pad='reflect' or 'mean', the stack is padded to the next shape for
+    which the FFTs are fast, leaving room for the PSF at the borders, and
+    cropped back (see Deconvolver.deconvolve).
+    With tiles, the tile shape is enlarged to a fast shape instead.
 
-    dec = np.array(a.deconvolve(img.ravel(), mz,
-                   my, mx, vz, vy, vx), dtype=dtype)
-    dec = dec.reshape(*img.shape)
+    dtype_out is the data type of the result, the computation dtype by
+    default. A uint16 stack is deconvolved into uint16 with the offset and
+    gain conversions, rounding and clipping done by the library, without
+    intermediate arrays.
+    """
+    kwargs = dict(psf_px_size=psf_px_size, img_px_size=img_px_size,
+                  regularization=regularization, max_iter=max_iter,
+                  accelerate=accelerate, dtype=dtype, otf_cache=otf_cache, planner=planner,
+                  wisdom=wisdom, n_threads=n_threads, monitor=monitor)
 
-    dec = np.where(dec < 0, 0, dec)*gain + offset
+    if tile_shape is not None:
+        if pad is not None:
+            tile_shape, _ = fast_shape(tile_shape)
+            log.info(padding_report(tile_shape))
+        pages = img_stack.pages
+        out = None
+        if pages.dtype == np.uint16 and dtype_out is not None and np.dtype(dtype_out) == np.uint16:
+            out = np.empty(pages.shape, dtype=np.uint16)
+        dec = mtif.Stack(deconvolve_tiled(pages, psf_stack, tile_shape, out=out, n_workers=n_workers,
+                                          offset=offset, gain=gain, pad=pad, **kwargs))
+        if out is None and dtype_out is not None:
+            dec.dtype_out = np.dtype(dtype_out)
+        return dec
 
-    return mtif.Stack(dec)
+    deconvolver = Deconvolver(psf_stack, **kwargs)
+    return deconvolver.deconvolve(img_stack, offset=offset, gain=gain, pad=pad, dtype_out=dtype_out)
@@ -3,30 +3,131 @@ from scipy.stats import poisson, norm
 
 import numpy as np
 import matplotlib.pyplot as plt
+from tqdm import tqdm
+
+from ..storage import LazyStack
 
 
 def photon_count(img, gain, offset=100):
     """remove the offset and divide by gain.
     The output image is rounded to int values"""
-    norm_img = np.round((img.astype(float)-100)/gain).astype(int)
+    norm_img = np.round((img.astype(float)-offset)/gain).astype(int)
     norm_img[norm_img < 0] = 0
     return norm_img
 
 
+class NoiseHistogram:
+    """Histogram of the integer values of noise data (e.g. dark frames).
+
+    The histogram is accumulated chunk by chunk with np.bincount, so that
+    the gain can be estimated from more data than fits in memory, e.g. the
+    dark frames of a whole run:
+
+        h = NoiseHistogram.from_files(dark_paths)
+        estimate_gain(h, offset=100)
+
+    Float data is rounded to the closest integer. Negative values (e.g. noise
+    after the offset subtraction) are binned as the others.
+    """
+
+    # number of values binned at once, bounds the temporary arrays
+    CHUNK_SIZE = 2**24
+
+    def __init__(self):
+        self.start = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_files(cls, paths, progress=True):
+        """Accumulate the histogram of tiff files"""
+        h = cls()
+        for path in tqdm(paths, disable=not progress):
+            h.update_file(path)
+        return h
+
+    @property
+    def n(self):
+        """number of values in the histogram"""
+        return int(self.counts.sum())
+
+    @property
+    def bins(self):
+        """the integer values"""
+        return np.arange(self.start, self.start + len(self.counts))
+
+    @property
+    def bars(self):
+        """the density of the values"""
+        return self.counts/self.n
+
+    def update(self, data):
+        """Add the values of an array (or memmap) to the histogram."""
+        data = np.asarray(data).reshape(-1)
+        for i in range(0, data.size, self.CHUNK_SIZE):
+            self._add(data[i:i + self.CHUNK_SIZE])
+        return self
+
+    def update_file(self, path):
+        """Add the values of a tiff file (or chunk store) to the histogram, page by page."""
+        with LazyStack(path) as stack:
+            for page in stack:
+                self.update(page)
+        return self
+
+    def _add(self, values):
+        if values.size == 0:
+            return
+        if values.dtype.kind not in 'iu':
+            values = np.round(values)
+        lo, hi = values.min(), values.max()
+        if not (np.isfinite(lo) and np.isfinite(hi)):
+            raise ValueError("cannot bin NaN or infinite values")
+        lo, hi = int(lo), int(hi)
+        int64 = np.iinfo(np.int64)
+        if lo < int64.min or hi > int64.max or hi - lo > int64.max:
+            raise ValueError(f"values from {lo} to {hi} exceed the int64 range of the histogram")
+        # bincount takes int64 (not uint64), and in int64 the difference
+        # does not overflow the input dtype
+        self._merge(lo, np.bincount(values.astype(np.int64) - lo))
+
+    def _merge(self, start, counts):
+        nonzero = np.flatnonzero(counts)
+        if nonzero.size == 0:
+            return
+        start += nonzero[0]
+        counts = counts[nonzero[0]:nonzero[-1] + 1]
+        if self.counts.size == 0:
+            self.start, self.counts = start, counts.astype(np.int64)
+            return
+        lo = min(self.start, start)
+        hi = max(self.start + len(self.counts), start + len(counts))
+        merged = np.zeros(hi - lo, dtype=np.int64)
+        merged[self.start - lo:self.start - lo + len(self.counts)] += self.counts
+        merged[start - lo:start - lo + len(counts)] += counts
+        self.start, self.counts = lo, merged
+
+    def photon_count(self, gain=1, offset=100):
+        """The histogram of photon_count(data, gain, offset), as (bins, bars)"""
+        values = np.round((self.bins - offset)/gain).astype(np.int64)
+        values[values < 0] = 0
+        lo = values.min()
+        counts = np.bincount(values - lo, weights=self.counts)
+        return np.arange(lo, lo + len(counts)), counts/self.n
+
+
 def hist(img):
     """Calculate the density histogram of the given image with integer bins.
     THe ouptut bins values correspond to the bins' start and are int.
+
+    Every integer value from the minimum to the maximum has its own bin
+    (np.histogram merged the maximum into the previous bin).
     """
-    start = img.min()
-    end = img.max()
-    bins = np.arange(start, end)
-    bars, _ = np.histogram(
-        img, bins=np.array([*bins, end+1]), density=True)
-    return bins, bars
+    h = NoiseHistogram().update(img)
+    return h.bins, h.bars
 
 
 def loss_poisson(gain, bins, bars, offset):
-    assert type(gain) == int, "can only be used with int gain"
+    assert int(gain) == gain, "can only be used with int gain"
     # poisson distribution is not defined for non int values
     # The fit with non int gain values is therefore complicated
     # by the needs of rebinning the histogram. This results in
@@ -34,11 +135,10 @@ def loss_poisson(gain, bins, bars, offset):
 
     m = (bars*bins).sum()/bars.sum()
 
-    temp = (bins/gain).astype(int)
+    temp = bins//int(gain)
     # sum bars with the same bin value
-    re_bins = np.array(list(set(temp)))
-    re_bars = np.zeros_like(re_bins)
-    re_bars = [np.sum(bars[temp == b]) for b in re_bins]
+    re_bins, index = np.unique(temp, return_inverse=True)
+    re_bars = np.bincount(index, weights=bars)
 
     fit = poisson.pmf(re_bins, m/gain)
 
@@ -63,7 +163,8 @@ def loss_gaussian_approx(gain, bins, bars, offset):
 def estimate_gain(noise_data, offset=100, distribution='gp', lims=(1, 6)):
     """Estimate gain by fitting a poisson distribution on data.
 
-    noise_data: an array containing only image noise.
+    noise_data: an array containing only image noise, or the NoiseHistogram
+        of such data (e.g. accumulated over many dark frames).
 
     if distribution is 'p' :
         - the noise, divided by the gain, is supposed to be poissonian
@@ -73,8 +174,9 @@ def estimate_gain(noise_data, offset=100, distribution='gp', lims=(1, 6)):
         - the gain is float
     """
 
-    norm_img = photon_count(noise_data, gain=1, offset=100)
-    bins, bars = hist(norm_img)
+    if not isinstance(noise_data, NoiseHistogram):
+        noise_data = NoiseHistogram().update(noise_data)
+    bins, bars = noise_data.photon_count(gain=1, offset=offset)
 
     if distribution == 'gp':
         loss_f = loss_gaussian_approx
@@ -84,10 +186,12 @@ def estimate_gain(noise_data, offset=100, distribution='gp', lims=(1, 6)):
         loss = fit.fun
     elif distribution == 'p':
         loss_f = loss_poisson
-        lims = list(np.range(*lims).astype(int))
+        lims = list(range(*lims))
         losses = [loss_f(g, bins, bars, offset) for g in lims]
         gain = lims[np.argmin(losses)]
-        loss = losses[gain]
+        loss = min(losses)
+    else:
+        raise ValueError(f"unknown distribution {distribution}, use 'p' or 'gp'")
 
     rmse = np.sqrt(loss)
 
@@ -0,0 +1,121 @@
+"""Cache of optical transfer functions (OTF).
+
+The OTF of a PSF depends only on the PSF data, its pixel size and on
+the shape and pixel size of the image it is applied to. It is therefore
+computed once and reused by all the deconvolutions of same-shaped volumes.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class OTFCache:
+    """LRU cache of OTFs, optionally backed by .npy files on disk.
+
+    An OTF is a complex array of about the size of the image (e.g. 16
+    bytes per voxel in float64): the OTFs kept in memory stay allocated as
+    long as the cache exists, so the cache is bounded both in number of
+    OTFs and in bytes. OTFs loaded from cache_dir are memory-mapped and
+    do not count in max_bytes.
+
+    Args:
+        maxsize (int): maximum number of OTFs kept in memory.
+        max_bytes (int): maximum total size of the OTFs kept in memory, None for
+            no limit. An OTF larger than max_bytes is not kept (but is still
+            saved in cache_dir).
+        cache_dir (str): if given, OTFs are also saved in this folder and
+            loaded from it (memory-mapped) by other processes or later runs.
+    """
+
+    def __init__(self, maxsize=4, max_bytes=2**31, cache_dir=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._otfs = OrderedDict()
+
+    @staticmethod
+    def key(psf, psf_px_size, shape, img_px_size):
+        """Return the cache key of the OTF of a PSF.
+
+        Args:
+            psf (ndarray): the PSF data, as passed to the deconvolution library.
+            psf_px_size (tuple): PSF pixel size.
+            shape (tuple): shape of the image the OTF is applied to.
+            img_px_size (tuple): pixel size of the image.
+        """
+        psf = np.ascontiguousarray(psf)
+        h = hashlib.sha1(psf.tobytes())
+        h.update(repr((psf.dtype.str, psf.shape, tuple(map(float, psf_px_size)),
+                       tuple(map(int, shape)), tuple(map(float, img_px_size)))).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def get(self, key):
+        """Return the cached OTF or None."""
+        if key in self._otfs:
+            self._otfs.move_to_end(key)
+            return self._otfs[key]
+
+        if self.cache_dir is not None and os.path.isfile(self._path(key)):
+            log.info(f"loading OTF {key} from disk")
+            otf = np.load(self._path(key), mmap_mode='r')
+            self._store(key, otf)
+            return otf
+
+        return None
+
+    def put(self, key, otf):
+        """Add an OTF to the cache."""
+        if self.cache_dir is not None and not os.path.isfile(self._path(key)):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write to a temporary file first, so that concurrent
+            # processes never load a partially written OTF
+            tmp_path = self._path(key) + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, otf)
+            os.replace(tmp_path, self._path(key))
+        self._store(key, otf)
+
+    @staticmethod
+    def _in_memory(otf):
+        return 0 if isinstance(otf, np.memmap) else otf.nbytes
+
+    @property
+    def nbytes(self):
+        """Size of the OTFs held in memory"""
+        return sum(self._in_memory(otf) for otf in self._otfs.values())
+
+    def _store(self, key, otf):
+        if self.max_bytes is not None and self._in_memory(otf) > self.max_bytes:
+            log.info(f"OTF {key} of {otf.nbytes} bytes is larger than the cache, not kept in memory")
+            self._otfs.pop(key, None)
+            return
+        self._otfs[key] = otf
+        self._otfs.move_to_end(key)
+        while len(self._otfs) > self.maxsize or \
+                (self.max_bytes is not None and self.nbytes > self.max_bytes):
+            self._otfs.popitem(last=False)
+
+    def clear(self):
+        """Empty the in-memory cache (files on disk are kept)."""
+        self._otfs.clear()
+
+    def __contains__(self, key):
+        return key in self._otfs or \
+            (self.cache_dir is not None and os.path.isfile(self._path(key)))
+
+    def __len__(self):
+        return len(self._otfs)
+
+
+# a cache shared by the deconvolutions that pass it explicitly
+# (deconvolve(..., otf_cache=otf_cache)), no cache is used by default
+otf_cache = OTFCache()
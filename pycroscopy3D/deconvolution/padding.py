@@ -0,0 +1,123 @@
+"""Padding of stacks to sizes for which the FFTs are fast.
+
+FFTW is fastest for sizes with small prime factors. Sizes with large
+prime factors are transformed by much slower algorithms, so a volume of
+e.g. 2500x470x317 (317 is prime) is worth padding to 2500x480x320.
+"""
+
+import numpy as np
+from itertools import product
+
+import logging
+log = logging.getLogger(__name__)
+
+FAST_PRIMES = (2, 3, 5, 7)
+
+
+def _prime_factors(n):
+    factors = []
+    p = 2
+    while p*p <= n:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+
+def _is_fast(n):
+    for p in FAST_PRIMES:
+        while n % p == 0:
+            n //= p
+    return n == 1
+
+
+def next_fast_len(n, parity=None):
+    """Return the smallest size >= n of the form 2^a*3^b*5^c*7^d.
+
+    Args:
+        n (int): minimum size.
+        parity (int): if 0 or 1, only sizes with this parity are considered.
+    """
+    m = n
+    while not (_is_fast(m) and (parity is None or m % 2 == parity)):
+        m += 1
+    return m
+
+
+def fft_cost(shape):
+    """Model of the cost of a 3D FFT of the given shape.
+
+    The mixed-radix FFT along an axis of size n costs about n*sum(p) operations,
+    p being the prime factors of n.
+    """
+    size = np.prod(shape, dtype=float)
+    return size*sum(sum(_prime_factors(n)) for n in shape if n > 1)
+
+
+def fast_shape(shape, margin=None, keep_parity=False):
+    """Return the fast FFT shape for a stack and the expected FFT speedup.
+
+    Along each axis, the next fast size of the same parity as the stack and
+    the next fast size of any parity are compared, and the shape with the
+    lowest modeled FFT cost (see fft_cost) is returned. The odd fast sizes
+    have no factor 2 and are often much larger.
+
+    The deconvolution library centers the PSF on a voxel for odd sizes and
+    between two voxels for even sizes: along an axis padded from an odd to
+    an even size, the result is shifted by half a voxel. Use keep_parity to
+    avoid it.
+
+    Args:
+        shape (tuple): shape of the stack.
+        margin (tuple): minimum padding along each axis, e.g. the PSF extent
+            to avoid the wrap-around of the circular convolution at the borders.
+        keep_parity (bool): only consider the sizes of the same parity as the stack.
+
+    Returns:
+        tuple: (padded shape, speedup), the speedup being the ratio of the
+        modeled FFT costs of the original and padded shapes.
+    """
+    if margin is None:
+        margin = (0,)*len(shape)
+    candidates = []
+    for n, m in zip(shape, margin):
+        sizes = {next_fast_len(n + m, parity=n % 2)}
+        if not keep_parity:
+            sizes.add(next_fast_len(n + m))
+        candidates.append(sorted(sizes))
+    padded = min(product(*candidates), key=fft_cost)
+    return padded, fft_cost(shape)/fft_cost(padded)
+
+
+def padding_report(shape, margin=None):
+    """Return a one-line report of the padding of a stack to a fast shape."""
+    padded, speedup = fast_shape(shape, margin)
+    return f"FFT shape {tuple(shape)} -> {padded}, expected FFT speedup x{speedup:.2f}"
+
+
+def pad_stack(pages, shape, mode='reflect'):
+    """Pad a stack to shape, centering the data.
+
+    Args:
+        pages (ndarray): the stack.
+        shape (tuple): shape of the padded stack.
+        mode (str): 'reflect' to mirror the borders, 'mean' to pad with the
+            mean value of the stack.
+
+    Returns:
+        tuple: the padded stack and the slices to crop it back.
+    """
+    widths = [((m - n)//2, m - n - (m - n)//2) for n, m in zip(pages.shape, shape)]
+    crop = tuple(slice(before, before + n) for (before, _), n in zip(widths, pages.shape))
+
+    if mode == 'reflect':
+        padded = np.pad(pages, widths, mode='reflect')
+    elif mode == 'mean':
+        padded = np.pad(pages, widths, mode='constant', constant_values=pages.mean())
+    else:
+        raise ValueError(f"unknown padding mode '{mode}', use 'reflect' or 'mean'")
+
+    return padded, crop
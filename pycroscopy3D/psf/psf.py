@@ -20,7 +20,8 @@ def plot_zmaxproj(ndarray, **kwargs):
 
 
 class PSF:
-    def __init__(self, stack, gblur_std=1, th_min=0.2, value_tolerance=0, exp_size='auto', size_tolerance=0.9):
+    def __init__(self, stack, gblur_std=1, th_min=0.2, value_tolerance=0, exp_size='auto', size_tolerance=0.9,
+                 slab_size=None):
         """Generate a mean psf image from a volumetric image of many point-size objects.
 
         Args:
@@ -37,6 +38,11 @@ class PSF:
                 The value must be within 0 (min tolerance) and 1 (max tolerance).
                 A value of 0 means to reject all objects which size is not identical to exp_size
                 Ignored if exp_size is None
+            slab_size (int, optional): if given, the objects are detected by processing
+                the stack in slabs of slab_size pages (plus a halo for the gaussian blur),
+                so that only one slab of intermediate images is kept in memory.
+                The stack can then be any array-like sliceable along Z (e.g. a numpy.memmap).
+                In this mode the gblur, thresh and cc volumes are not stored.
 
         Returns:
             Stack: a multipagetiff Stack containing the average PSF
@@ -48,6 +54,33 @@ class PSF:
         self._PSFs = None
         self._mean_PSF = None
 
+        self._slab_centroids = None
+
+        if slab_size is not None:
+            log.info(f"Detect objects in slabs of {slab_size} pages")
+            self.gblur = self.thresh = self.cc = None
+            bboxes, self._slab_centroids = find_objects_in_slabs(
+                self.stack, slab_size, gblur_std, th_min, value_tolerance)
+            self.total_found_objects = len(bboxes)
+            log.info(f"Detected components:{self.total_found_objects}")
+        else:
+            bboxes = self._find_objects(gblur_std, th_min, value_tolerance)
+
+        self.bboxes = bboxes
+
+        if exp_size == 'auto':
+            exp_size = calc_av_bbox_size(bboxes)
+
+        bboxes_filt, labels = filter_bboxes(bboxes, exp_size, size_tolerance)
+        self.labels = labels
+
+        log.info(
+            f"found {self.total_found_objects} objects, {len(labels)} rejected (wrong size).")
+
+        self.bbox_size = get_largest_bbox(bboxes_filt)
+
+    def _find_objects(self, gblur_std, th_min, value_tolerance):
+        """Detect the objects on the whole stack at once and return their bounding boxes."""
         # Gaussian Blur =============================
         log.info("Gaussian blur")
         self.gblur = gaussian_blur(self.stack, gblur_std)
@@ -71,32 +104,46 @@ class PSF:
 
         # Bounding box =============================
         log.info("Bounding box")
-        bboxes = ndimage.find_objects(self.cc)
-
-        if exp_size == 'auto':
-            exp_size = calc_av_bbox_size(bboxes)
-
-        bboxes_filt, labels = filter_bboxes(bboxes, exp_size, size_tolerance)
-        self.labels = labels
-
-        log.info(
-            f"found {self.total_found_objects} objects, {len(labels)} rejected (wrong size).")
-
-        self.bbox_size = get_largest_bbox(bboxes_filt)
+        return ndimage.find_objects(self.cc)
 
     def __repr__(self):
         return f"PSF generator: found {self.total_found_objects} objects, {self.total_found_objects - self.number_of_valid_psfs} rejected (because of size tolerance)."
 
-    def calc_mean_psf(self):
-        """Calculate the average PSF"""
+    def calc_mean_psf(self, subpixel=False, batch_size=64, keep_PSFs=False):
+        """Calculate the average PSF
+
+        Args:
+            subpixel (bool, optional): align every PSF on its centroid with
+                sub-voxel precision (FFT phase shift) before averaging.
+                Otherwise the PSFs are cropped around their centroid truncated to int.
+            batch_size (int, optional): number of PSFs aligned at once (only if subpixel)
+            keep_PSFs (bool, optional): keep the aligned PSFs (only if subpixel),
+                otherwise only their sum is kept in memory and PSFs is not available.
+        """
         # Centroids =============================
         log.info("Centroids")
-        self._centroids = get_centroids(self.gblur, self.cc, self.labels)
+        if self._slab_centroids is not None:
+            self._centroids = [self._slab_centroids[label-1]
+                               for label in self.labels]
+        else:
+            self._centroids = get_centroids(
+                self.gblur, self.cc, self.labels, bboxes=self.bboxes)
 
         # Mean PSF =============================
         log.info("Mean PSF")
-        self._PSFs = crop_PSFs(self.stack, self._centroids, self.bbox_size)
-        self._mean_PSF = mtif.Stack(np.mean(self._PSFs, axis=0))
+        if subpixel:
+            self._PSFs = [] if keep_PSFs else None
+            psf_sum = np.zeros(self.bbox_size)
+            n_PSFs = 0
+            for batch in register_PSFs(self.stack, self._centroids, self.bbox_size, batch_size):
+                psf_sum += batch.sum(axis=0)
+                n_PSFs += len(batch)
+                if keep_PSFs:
+                    self._PSFs.extend(batch)
+            self._mean_PSF = mtif.Stack(psf_sum/n_PSFs)
+        else:
+            self._PSFs = crop_PSFs(self.stack, self._centroids, self.bbox_size)
+            self._mean_PSF = mtif.Stack(np.mean(self._PSFs, axis=0))
 
     @property
     def mean_PSF(self):
@@ -113,6 +160,8 @@ class PSF:
     @property
     def PSFs(self):
         if self._PSFs is None:
+            if self._mean_PSF is not None:
+                raise ValueError("the aligned PSFs are not kept, use calc_mean_psf(subpixel=True, keep_PSFs=True)")
             self.calc_mean_psf()
         return self._PSFs
 
@@ -132,13 +181,20 @@ class PSF:
                  [1], '+r', label="centroid")
         plt.legend()
 
+    def _check_volumes(self):
+        if self.cc is None:
+            raise ValueError("the gblur, thresh and cc volumes are not stored in slab mode (slab_size)")
+
     def plot_gaussian_blur_img(self):
+        self._check_volumes()
         self._plot_zmaxproj(self.gblur)
 
     def plot_threshold_img(self):
+        self._check_volumes()
         self._plot_zmaxproj(self.gblur)
 
     def plot_connected_components(self):
+        self._check_volumes()
         n_labels = self.cc.max()
 
         my_colors = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)]
@@ -156,26 +212,40 @@ class PSF:
         mtif.write_stack(self.mean_psf, path)
 
 
-def crop_PSF(img, centroid, bbox):
+def crop_bounds(centroid, bbox):
+    """First and last (excluded) voxels of the crop of size bbox around centroid.
+    Used by crop_PSF and register_PSFs, so that they crop the same PSFs."""
+    d = np.array(bbox)//2
+    centroid = np.asarray(centroid, dtype=float)
+    return np.floor(centroid - d).astype(int), np.floor(centroid + d).astype(int)+1
 
-    dz, dx, dy = bbox
 
-    d = np.array((dz, dx, dy))//2
+def crop_PSF(img, centroid, bbox):
 
-    cmin = (centroid - d).astype(int)
-    cmax = (centroid + d).astype(int)+1
+    cmin, cmax = crop_bounds(centroid, bbox)
+    cmin = np.maximum(cmin, 0)
 
     return img[cmin[0]:cmax[0], cmin[1]:cmax[1], cmin[2]:cmax[2]]
 
 
-def find_centroid(label, *, img, cc):
-    crop = img*(cc == label)
-    return ndimage.measurements.center_of_mass(crop)
+def find_centroid(label, *, img, cc, bbox=None):
+    """Intensity-weighted centroid of the connected component `label`.
 
+    If bbox (a tuple of slices, as returned by ndimage.find_objects) is given,
+    only the voxels inside the bounding box of the component are visited.
+    """
+    if bbox is None:
+        bbox = tuple(slice(0, n) for n in cc.shape)
+    crop = img[bbox]*(cc[bbox] == label)
+    centroid = ndimage.center_of_mass(crop)
+    return tuple(c + s.start for c, s in zip(centroid, bbox))
 
-def threshold(ndarray, min_rel_val, binary):
+
+def threshold(ndarray, min_rel_val, binary, max_value=None):
     thresh = ndarray.copy()
-    min_th = thresh.max()*min_rel_val
+    if max_value is None:
+        max_value = thresh.max()
+    min_th = max_value*min_rel_val
     thresh[thresh < min_th] = 0
     if binary:
         thresh[thresh > 0] = 1
@@ -189,11 +259,21 @@ def gaussian_blur(stack, gblur_std):
     return gblur
 
 
-def get_centroids(img, cc, labels):
+def get_centroids(img, cc, labels, bboxes=None):
+    """Intensity-weighted centroids of the given labels of cc.
+
+    Every centroid is computed in the bounding box of its component, so that
+    the whole volume is visited only once (by ndimage.find_objects) instead of
+    once per label. bboxes can be passed if already computed.
+    """
+    if bboxes is None:
+        bboxes = ndimage.find_objects(cc)
+
     centroids = []
 
     for label in tqdm(labels, desc="Find centroids"):
-        centroids.append(find_centroid(label, img=img, cc=cc))
+        centroids.append(find_centroid(
+            label, img=img, cc=cc, bbox=bboxes[label-1]))
 
     # WARNING multiprocessing does not work
     # f = partial(find_centroid, img=img, cc=cc)
@@ -203,6 +283,148 @@ def get_centroids(img, cc, labels):
     return centroids
 
 
+def _blur_halo(gblur_std):
+    """Number of pages on each side of a slab needed by the gaussian blur.
+    This is the radius of the kernel used by ndimage.gaussian_filter."""
+    if gblur_std is None:
+        return 0
+    return int(4.0*float(np.max(gblur_std)) + 0.5)
+
+
+def _iter_blurred_slabs(stack, slab_size, gblur_std):
+    """Yield (z0, blurred slab) for consecutive slabs of the stack.
+
+    Each slab is read with a halo of pages on both sides, so that the blurred
+    pages are identical to the ones obtained by blurring the whole stack.
+    """
+    halo = _blur_halo(gblur_std)
+    n_pages = len(stack)
+    for z0 in range(0, n_pages, slab_size):
+        z1 = min(z0 + slab_size, n_pages)
+        h0 = max(z0 - halo, 0)
+        h1 = min(z1 + halo, n_pages)
+        gblur = gaussian_blur(np.asarray(stack[h0:h1]), gblur_std)
+        yield z0, gblur[z0-h0:z1-h0]
+
+
+def _touching_labels(cc_a, cc_b, val_a, val_b, delta):
+    """Pairs of labels that touch (26-connectivity) across two consecutive planes."""
+    ny, nx = cc_a.shape
+    pairs = []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            sa = (slice(max(0, -dy), ny - max(0, dy)),
+                  slice(max(0, -dx), nx - max(0, dx)))
+            sb = (slice(max(0, dy), ny - max(0, -dy)),
+                  slice(max(0, dx), nx - max(0, -dx)))
+            la, lb = cc_a[sa], cc_b[sb]
+            connected = (la > 0) & (lb > 0)
+            if delta > 0:
+                connected &= np.abs(val_a[sa].astype(float) -
+                                    val_b[sb].astype(float)) <= delta
+            pairs.append(np.stack([la[connected], lb[connected]], axis=1))
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def find_objects_in_slabs(stack, slab_size, gblur_std=1, th_min=0.2, value_tolerance=0):
+    """Detect point-like objects processing the stack one slab of pages at a time.
+
+    The detection is equivalent to the one of PSF (gaussian blur, threshold
+    relative to the blurred maximum, 26-connected components), but only
+    one slab of slab_size pages (plus the blur halo) is in memory at a time.
+    The components cut by a slab boundary are merged.
+
+    The stack is read twice: a first pass finds the maximum of the blurred
+    stack (needed by the relative threshold), a second one labels the objects.
+
+    Returns:
+        bboxes: list of bounding boxes (tuples of slices, as ndimage.find_objects)
+        centroids: list of the intensity-weighted centroids (on the blurred image)
+    """
+    value_tolerance = abs(value_tolerance)
+
+    max_value = max(gblur.max() for _, gblur in tqdm(
+        _iter_blurred_slabs(stack, slab_size, gblur_std),
+        total=-(-len(stack)//slab_size), desc="Find maximum"))
+
+    bbox_start, bbox_stop, mass, centroid = [], [], [], []
+    parent = []
+
+    def find_root(label):
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    prev_plane = prev_thresh = None
+    for z0, gblur in tqdm(_iter_blurred_slabs(stack, slab_size, gblur_std),
+                          total=-(-len(stack)//slab_size), desc="Detect objects"):
+        thresh = threshold(gblur, th_min, binary=value_tolerance == 0,
+                           max_value=max_value)
+        cc = cc3d.connected_components(
+            thresh, connectivity=26, delta=value_tolerance)
+
+        # global label = local label + offset
+        offset = len(parent)
+        for label, bbox in enumerate(ndimage.find_objects(cc), start=1):
+            if bbox is None:
+                parent.append(None)
+                continue
+            weights = gblur[bbox]*(cc[bbox] == label)
+            m = weights.sum()
+            local = np.array(ndimage.center_of_mass(weights))
+            start = np.array([sl.start for sl in bbox]) + [z0, 0, 0]
+            bbox_start.append(start)
+            bbox_stop.append(np.array([sl.stop for sl in bbox]) + [z0, 0, 0])
+            mass.append(m)
+            # as find_centroid, so that the objects within a slab are bit-identical
+            centroid.append(local + start)
+            parent.append(offset + label - 1)
+
+        # merge the objects crossing the boundary with the previous slab
+        # (planes store global label + 1, 0 is background)
+        first_plane = np.where(cc[0] > 0, cc[0].astype(np.int64) + offset, 0)
+        if prev_plane is not None:
+            pairs = _touching_labels(prev_plane, first_plane,
+                                     prev_thresh, thresh[0], value_tolerance)
+            for a, b in pairs - 1:
+                ra, rb = find_root(a), find_root(b)
+                if ra != rb:
+                    parent[max(ra, rb)] = min(ra, rb)
+        prev_plane = np.where(cc[-1] > 0, cc[-1].astype(np.int64) + offset, 0)
+        prev_thresh = thresh[-1]
+
+    valid = [i for i, p in enumerate(parent) if p is not None]
+    if not valid:
+        return [], []
+
+    roots = np.array([find_root(i) for i in valid])
+    objects, index = np.unique(roots, return_inverse=True)
+
+    start = np.full((len(objects), 3), np.iinfo(np.int64).max)
+    stop = np.zeros((len(objects), 3), dtype=np.int64)
+    total_mass = np.zeros(len(objects))
+    total_moment = np.zeros((len(objects), 3))
+    centroid = np.array(centroid)
+    mass = np.array(mass)
+    np.minimum.at(start, index, np.array(bbox_start))
+    np.maximum.at(stop, index, np.array(bbox_stop))
+    np.add.at(total_mass, index, mass)
+    np.add.at(total_moment, index, mass[:, None]*centroid)
+
+    # the pieces of the merged objects are weighted by their mass,
+    # the centroid of an object in one piece is kept as is
+    centroids = total_moment/total_mass[:, None]
+    single = np.bincount(index) == 1
+    centroids[index[single[index]]] = centroid[single[index]]
+
+    bboxes = [tuple(slice(int(a), int(b)) for a, b in zip(s0, s1))
+              for s0, s1 in zip(start, stop)]
+    centroids = [tuple(c) for c in centroids]
+
+    return bboxes, centroids
+
+
 def filter_bboxes(bboxes, exp_size, size_tolerance):
     """filter the bboxes on size"""
     filtered = []
@@ -244,7 +466,8 @@ def get_largest_bbox(bboxes, scale=1.5) -> int:
 
 def crop_PSFs(stack, centroids, bbox_size):
     PSFs = []
-    ndarray = stack[:]
+    # only the crops are read from lazy stacks (memmap, storage.LazyStack)
+    ndarray = getattr(stack, 'pages', stack)
     for centroid in tqdm(centroids, desc="Crop PSFs"):
         crop = crop_PSF(ndarray, centroid, bbox_size)
 
@@ -255,6 +478,58 @@ def crop_PSFs(stack, centroids, bbox_size):
     return PSFs
 
 
+def fourier_shift_batch(crops, shifts):
+    """Shift a batch of 3D images by (sub-voxel) amounts with a FFT phase ramp.
+
+    Args:
+        crops (ndarray): array of shape (N, z, y, x)
+        shifts (ndarray): array of shape (N, 3), the shift of each image along (z, y, x)
+
+    Returns:
+        ndarray of shape (N, z, y, x): the shifted images (with circular boundaries)
+    """
+    shape = crops.shape[1:]
+    shifts = np.asarray(shifts, dtype=float)
+    fz = np.fft.fftfreq(shape[0])[None, :, None, None]
+    fy = np.fft.fftfreq(shape[1])[None, None, :, None]
+    fx = np.fft.rfftfreq(shape[2])[None, None, None, :]
+    sz, sy, sx = (shifts[:, i, None, None, None] for i in range(3))
+    phase = np.exp(-2j*np.pi*(fz*sz + fy*sy + fx*sx))
+    spectrum = np.fft.rfftn(crops, axes=(1, 2, 3))*phase
+    return np.fft.irfftn(spectrum, s=shape, axes=(1, 2, 3))
+
+
+def register_PSFs(stack, centroids, bbox_size, batch_size=64):
+    """Crop the PSFs and align them on their centroid with sub-voxel precision.
+
+    Each PSF is cropped as in crop_PSF (see crop_bounds), then the residual
+    (sub-voxel) offset is compensated by a FFT phase shift applied to a
+    whole batch of crops at once.
+    The PSFs which are too close to the stack borders are discarded.
+
+    Yields:
+        ndarray of shape (N, z, y, x): batches of at most batch_size aligned PSFs
+    """
+    # only the crops are read from lazy stacks (memmap, storage.LazyStack)
+    ndarray = getattr(stack, 'pages', stack)
+    d = np.array(bbox_size)//2
+
+    for i in tqdm(range(0, len(centroids), batch_size), desc="Register PSFs"):
+        crops, shifts = [], []
+        for centroid in centroids[i:i+batch_size]:
+            centroid = np.asarray(centroid, dtype=float)
+            cmin, cmax = crop_bounds(centroid, bbox_size)
+            center = cmin + d
+            # Remove PSFs which are too close to borders
+            if any(cmin < 0) or any(cmax > ndarray.shape):
+                continue
+            crops.append(ndarray[cmin[0]:cmax[0], cmin[1]:cmax[1], cmin[2]:cmax[2]])
+            # move the centroid from center + residual to center
+            shifts.append(center - centroid)
+        if crops:
+            yield fourier_shift_batch(np.array(crops, dtype=float), shifts)
+
+
 # @dataclass
 # class PSF_data:
 #     """Result object of average PSF calculation"""
@@ -1,13 +1,10 @@
-from numpy import float64, mean
 import numpy as np
 import multipagetiff as mtif
-import multiprocessing as mp
 from tqdm import tqdm
 import ants
 import os
 
-def identity(x):
-    return x
+from ..transformation.reduction import reduce_stacks
 
 def stack_average(paths, chunk_size=None):
     """Calculate the average over the TIFF stacks specified in paths.
@@ -15,32 +12,10 @@ def stack_average(paths, chunk_size=None):
     This function assumes that all stacks have the same shape.
 
     Args:
-        chunk_size (int) : specifies the number of stacks to open in menory at the same time.
-        Defaults to 2x(number of available CPUs - 3)
+        chunk_size (int) : the number of stacks read in parallel (see
+        transformation.reduce_stacks). Defaults to the number of available CPUs.
     """
-
-    max_cpus = mp.cpu_count() - 3
-
-    if chunk_size is None:
-        # default value of chunk size
-        chunk_size = (max_cpus*2)
-
-    # Use as many cpus as possible
-    n_cpus = min(max_cpus, chunk_size)
-    
-    # initialize outputy shape equal to the shape of the shape of the first stack
-    volumes_sum = np.zeros(mtif.read_stack(paths[0]).shape, dtype=float64)
-
-    for i in tqdm(range(0,len(paths), chunk_size), desc=f"Calculating average stack (chunksize={chunk_size})"):
-        # calculate sum of stacks in chunk
-        paths_batch = paths[i:i+chunk_size]
-        volumes = mtif.load_and_apply_batch(paths_batch, identity, ncpu=n_cpus)
-        volumes_sum += np.array(volumes).sum(axis=0)
-
-    # calculate average
-    stack_mean = volumes_sum/len(paths)
-
-    return stack_mean
+    return reduce_stacks(paths, ('mean',), n_workers=chunk_size)['mean']
 
 def load_stack_for_ants(img_path):
     """Load an ANTs image with the right axis order"""
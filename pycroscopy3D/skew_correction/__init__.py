@@ -1 +1,2 @@
-from .skew_correction import skew_correct_matlab_one, skew_correct_matlab
\ No newline at end of file
+from .skew_correction import skew_correct_matlab_one, skew_correct_matlab
+from .skew_correction import skew_correct, skew_correct_planes, skew_correct_one, skew_correct_folder, skew_correct_many, skew_workers, list_stacks, read_conversion_factors, SCAPE_SKEW_ANGLE
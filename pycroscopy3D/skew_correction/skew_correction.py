@@ -4,6 +4,14 @@ import pkg_resources
 import logging
 import numpy as np
 import multipagetiff as mtif
+import multiprocessing as mp
+import psutil
+import shutil
+from glob import glob
+from tifffile import TiffFile, imwrite
+from tqdm import tqdm
+
+from ..storage import ChunkStore, is_store, read_array, write_stack, STORE_SUFFIX
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
@@ -13,6 +21,14 @@ log.setLevel(logging.WARNING)
 matlab_script_path = pkg_resources.resource_filename(
     "pycroscopy3D", 'Matlab/skew_correct.m')
 
+# skew angle of the SCAPE light sheet, as in Matlab/skew_correct_one.m
+SCAPE_SKEW_ANGLE = -47
+
+# number of output planes computed from one contiguous copy of the input
+_BLOCK_PLANES = 16
+# distance from an integer below which an interpolation position is integer
+_SNAP_TOLERANCE = 1e-9
+
 
 def skew_correct_matlab_one(in_path, out_path, stack_fname, info_file_path):
     """Correct one the SCAPE 3D image.
@@ -96,4 +112,360 @@ def skew_correct_python(stack, skew_angle_deg, scale):
     temp = np.flip(temp, 0)
     stack = mtif.Stack(temp)
 
-    return mtif.affine_transform(stack, m)
\ No newline at end of file
+    return mtif.affine_transform(stack, m)
+
+
+def read_conversion_factors(info_file_path):
+    """Read the voxel size of the uncorrected stacks from a SCAPE info file.
+
+    Both the MATLAB v5 and the v7.3 (HDF5, needs h5py) .mat files are supported.
+
+    Args:
+        info_file_path (str): the path of the info_file (.mat) produced by the SCAPE acquisition software
+
+    Returns:
+        tuple: (ylat, zdep, xwid), the pixel size along the lines, the depth and the scan, in um
+    """
+    from scipy.io import loadmat
+
+    try:
+        info = loadmat(info_file_path, squeeze_me=True, struct_as_record=False)['info']
+        ylat = info.GUIcalFactors.y_umPerPix
+        zdep = info.GUIcalFactors.z_umPerPix
+        xfact = info.GUIcalFactors.xK_umPerVolt
+        scan_angle = info.daq.scanAngle
+        pixels_per_line = info.daq.pixelsPerLine
+    except NotImplementedError:
+        # MATLAB v7.3 files are HDF5
+        import h5py
+        with h5py.File(info_file_path, 'r') as f:
+            def value(group, name):
+                return float(np.squeeze(f['info'][group][name][()]))
+            ylat = value('GUIcalFactors', 'y_umPerPix')
+            zdep = value('GUIcalFactors', 'z_umPerPix')
+            xfact = value('GUIcalFactors', 'xK_umPerVolt')
+            scan_angle = value('daq', 'scanAngle')
+            pixels_per_line = value('daq', 'pixelsPerLine')
+
+    xwid = xfact*scan_angle/pixels_per_line
+    return float(ylat), float(zdep), float(xwid)
+
+
+def _shear_geometry(n_scan, n_depth, conversion_factors, skew_angle_deg):
+    """Number of output rows along the scan axis, and the input row of the
+    first output row for every output plane."""
+    ylat, zdep, xwid = conversion_factors
+    cot = 1/np.tan(np.deg2rad(skew_angle_deg))
+
+    # output limits along the scan axis (world coordinates, as imwarp):
+    # bounding box of the sheared input, with the input pixel size
+    y_lims = np.array([0.5, n_scan + 0.5])*xwid
+    z_lims = np.array([0.5, n_depth + 0.5])*zdep
+    corners = y_lims[:, None] + cot*z_lims[None, :]
+    lo, hi = corners.min(), corners.max()
+    n_out = int(np.ceil((hi - lo)/xwid))
+    lo -= (n_out*xwid - (hi - lo))/2
+
+    depth = np.arange(1, n_depth + 1)*zdep
+    starts = (lo - cot*depth)/xwid - 0.5
+    # snap the starts within roundoff of an integer, so that the valid rows
+    # and the interpolation (shift and fraction) agree
+    integer = np.round(starts)
+    starts = np.where(np.abs(starts - integer) < _SNAP_TOLERANCE, integer, starts)
+    return n_out, starts
+
+
+def _valid_rows(starts, n_scan, n_out):
+    """First and last output row interpolated inside the input, for every output plane.
+    The other rows are 0 (padding)."""
+    first = np.maximum(np.ceil(-starts).astype(int), 0)
+    last = np.minimum(np.floor(n_scan - 1 - starts).astype(int), n_out - 1)
+    return first, last
+
+
+def _sheared_planes(pages, n_out, starts):
+    """Yield the output planes, as (first row, valid rows in float32).
+
+    Only the valid rows are computed, the padding is never allocated."""
+    n_scan, n_lines, n_depth = pages.shape
+    firsts, lasts = _valid_rows(starts, n_scan, n_out)
+    for b in range(0, n_depth, _BLOCK_PLANES):
+        # the input is flipped along the scan axis and the depth axis
+        depth = slice(max(n_depth - b - _BLOCK_PLANES, 0), n_depth - b)
+        block = np.ascontiguousarray(
+            pages[::-1, :, depth][:, :, ::-1].transpose(2, 0, 1), dtype=np.float32)
+        for k, plane in enumerate(block):
+            t, first, last = starts[b + k], firsts[b + k], lasts[b + k]
+            if last < first:
+                yield first, np.zeros((0, n_lines), dtype=np.float32)
+                continue
+            shift = int(np.floor(t))
+            f = t - shift
+            rows = plane[first + shift:last + shift + 1]
+            if f > 0:
+                rows = (1 - f)*rows + f*plane[first + shift + 1:last + shift + 2]
+            yield first, rows
+
+
+def _cast(rows, dtype):
+    """Round integer outputs as in MATLAB (the values are positive)."""
+    if np.issubdtype(dtype, np.integer):
+        return (rows + 0.5).astype(dtype)
+    return rows.astype(dtype, copy=False)
+
+
+def skew_correct(stack, conversion_factors, skew_angle_deg=SCAPE_SKEW_ANGLE, dtype=np.uint16, crop=None):
+    """Apply skew correction to a SCAPE uncorrected image, without MATLAB.
+
+    Gives the result of Matlab/skew_correct_one.m (imwarp with linear
+    interpolation). The skew correction is a shear along the scan axis,
+    proportional to the depth: every output plane is a copy of one depth
+    plane of the input, shifted along the scan axis with a 1D linear
+    interpolation.
+
+    The sheared volume is a parallelogram, padded with zeros to its
+    bounding box. With crop='valid' only the scan positions inside the
+    input in all the planes are computed, i.e. the largest box without
+    padding. See skew_correct_planes to get every plane without its padding.
+
+    Args:
+        stack (array or mtif.Stack): the uncorrected stack, as read from the tif file
+            (scan position, line, depth)
+        conversion_factors (tuple): (ylat, zdep, xwid) pixel sizes, see read_conversion_factors
+        skew_angle_deg (float): skew angle in degrees
+        dtype: output dtype. Integer outputs are rounded as in MATLAB.
+        crop (str): None for the whole bounding box (as MATLAB), or 'valid'.
+
+    Returns:
+        numpy.ndarray: The corrected image (depth, scan position, line)
+    """
+    pages = getattr(stack, 'pages', stack)
+    n_scan, n_lines, n_depth = pages.shape
+    n_out, starts = _shear_geometry(n_scan, n_depth, conversion_factors, skew_angle_deg)
+
+    if crop is None:
+        row_start, row_end = 0, n_out
+    elif crop == 'valid':
+        firsts, lasts = _valid_rows(starts, n_scan, n_out)
+        row_start, row_end = firsts.max(), lasts.min() + 1
+        if row_end <= row_start:
+            raise ValueError("the skew corrected planes have no scan position in common, "
+                             "use skew_correct_planes")
+    else:
+        raise ValueError(f"unknown crop {crop}, use None or 'valid'")
+
+    out = np.zeros((n_depth, row_end - row_start, n_lines), dtype=dtype)
+    for k, (first, rows) in enumerate(_sheared_planes(pages, n_out, starts)):
+        # clip the valid rows to the output rows
+        lo = max(first, row_start)
+        hi = min(first + len(rows), row_end)
+        if hi > lo:
+            out[k, lo - row_start:hi - row_start] = _cast(rows[lo - first:hi - first], out.dtype)
+
+    return out
+
+
+def skew_correct_planes(stack, conversion_factors, skew_angle_deg=SCAPE_SKEW_ANGLE, dtype=np.uint16):
+    """Apply skew correction plane by plane, removing the padding of each plane.
+
+    Same planes as skew_correct, with only their rows inside the input,
+    as transformation.get_unpad_planes on the output of skew_correct. The
+    corrected volume is never allocated: a plane is computed when the
+    iteration reaches it.
+
+    Args:
+        see skew_correct
+
+    Yields:
+        numpy.ndarray: the corrected planes (scan position, line), from the first depth
+    """
+    pages = getattr(stack, 'pages', stack)
+    n_scan, n_lines, n_depth = pages.shape
+    n_out, starts = _shear_geometry(n_scan, n_depth, conversion_factors, skew_angle_deg)
+
+    for _, rows in _sheared_planes(pages, n_out, starts):
+        yield _cast(rows, np.dtype(dtype))
+
+
+def _output_path(path, out_path, crop=None, store=False):
+    root, _ = os.path.splitext(os.path.basename(path.rstrip(os.sep)))
+    if crop == 'planes':
+        # one folder of planes per stack
+        return os.path.join(out_path, root + '_skewCorrected')
+    return os.path.join(out_path, root + '_skewCorrected' + (STORE_SUFFIX if store else '.tif'))
+
+
+def _skew_correct_file(path, out_path, conversion_factors, crop=None, store=False):
+    out_file = _output_path(path, out_path, crop, store)
+
+    # write to a hidden temporary file first, so that an interrupted run
+    # never leaves a partial output that would be skipped when resuming
+    root, ext = os.path.splitext(os.path.basename(out_file))
+    tmp_path = os.path.join(out_path, f".{root}.{os.getpid()}.tmp{ext}")
+    if crop == 'planes':
+        # the planes are named as in transformation.load_unpad_save
+        os.makedirs(tmp_path, exist_ok=True)
+        for i, plane in enumerate(skew_correct_planes(read_array(path), conversion_factors)):
+            imwrite(os.path.join(tmp_path, f"{str(i).zfill(5)}.tiff"), plane)
+    else:
+        write_stack(skew_correct(read_array(path), conversion_factors, crop=crop), tmp_path)
+    if os.path.isdir(out_file):
+        # overwrite
+        shutil.rmtree(out_file)
+    os.replace(tmp_path, out_file)
+    return out_file
+
+
+def _skew_correct_file_in_worker(args):
+    path, out_path, conversion_factors, crop, store = args
+    try:
+        return path, _skew_correct_file(path, out_path, conversion_factors, crop, store), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def list_stacks(paths):
+    """The .tif and .tiff files (and chunk stores) of folders, glob patterns or file paths, sorted by folder."""
+    if isinstance(paths, str):
+        paths = [paths]
+    stacks = []
+    for path in paths:
+        if os.path.isdir(path) and not is_store(path):
+            stacks += sorted(glob(os.path.join(path, '*.tif')) + glob(os.path.join(path, '*.tiff'))
+                             + glob(os.path.join(path, '*' + STORE_SUFFIX)))
+        elif any(c in path for c in '*?['):
+            stacks += sorted(glob(path))
+        else:
+            stacks.append(path)
+    return stacks
+
+
+def skew_workers(path, conversion_factors):
+    """Number of stacks like path that can be skew corrected in parallel.
+
+    The number is limited by the available RAM (each worker holds one
+    input and one output volume) and by the number of processors.
+    """
+    if is_store(path):
+        series = ChunkStore.open(path)
+    else:
+        with TiffFile(path) as tif:
+            series = tif.series[0]
+    n_scan, n_lines, n_depth = series.shape
+    in_bytes = np.prod(series.shape)*series.dtype.itemsize
+    n_out, _ = _shear_geometry(n_scan, n_depth, conversion_factors, SCAPE_SKEW_ANGLE)
+    volume_bytes = in_bytes + n_depth*n_out*n_lines*np.dtype(np.uint16).itemsize
+    n_fit = psutil.virtual_memory().available // volume_bytes
+    return int(max(1, min(mp.cpu_count(), n_fit)))
+
+
+def _collect(results, total):
+    done, failed = [], []
+    for path, out_file, error in tqdm(results, total=total, desc="Skew correct stacks"):
+        if error is None:
+            done.append(out_file)
+        else:
+            log.error(f"skew correction of {path} failed: {error}")
+            failed.append((path, error))
+    return done, failed
+
+
+def skew_correct_many(paths, out_path, info_file_path=None, conversion_factors=None,
+                      n_workers=None, overwrite=False, crop=None, store=False):
+    """Skew correct many SCAPE stacks in parallel, without MATLAB.
+
+    Each stack is saved to out_path as <name>_skewCorrected.tif, like
+    skew_correct_matlab. The stacks are distributed over a pool of
+    processes, each correcting one stack at a time, so that at most
+    n_workers volumes are in memory. Stacks whose output file already
+    exists are skipped, so an interrupted run can be resumed by calling
+    skew_correct_many again.
+
+    Args:
+        paths (str or list): folders (all their .tif and .tiff files), glob patterns or file paths.
+        out_path (str): the folder where the corrected stacks will be saved.
+        info_file_path (str): the info_file (.mat) produced by the SCAPE acquisition software.
+        conversion_factors (tuple): (ylat, zdep, xwid), read from info_file_path if None.
+        n_workers (int): number of processes. If None, as many as the processors,
+            limited by the number of stacks fitting in the available RAM.
+        overwrite (bool): correct also the stacks whose output exists.
+        crop (str): None to save the whole bounding box (as MATLAB), 'valid' to
+            save only the box without padding (see skew_correct), or 'planes'
+            to save every plane without its padding in a folder
+            <name>_skewCorrected, as 00000.tiff, 00001.tiff... (see skew_correct_planes).
+        store (bool): save the stacks as chunk stores <name>_skewCorrected.chunks
+            (see pycroscopy3D.storage) instead of TIFF files.
+
+    Returns:
+        tuple: (done, failed), the list of the written output paths and the
+        list of (path, error message) of the stacks that failed.
+    """
+    if conversion_factors is None:
+        conversion_factors = read_conversion_factors(info_file_path)
+    log.info(f"conversion factors (ylat, zdep, xwid): {conversion_factors}")
+
+    paths = list_stacks(paths)
+    os.makedirs(out_path, exist_ok=True)
+
+    todo = [p for p in paths if overwrite or not os.path.exists(_output_path(p, out_path, crop, store))]
+    if len(todo) < len(paths):
+        log.info(f"skipping {len(paths) - len(todo)} stacks already corrected")
+    if not todo:
+        return [], []
+
+    if n_workers is None:
+        # estimated on the first readable stack, the others fail in the workers
+        n_workers = 1
+        for path in todo:
+            try:
+                n_workers = skew_workers(path, conversion_factors)
+                break
+            except Exception:
+                continue
+    n_workers = min(n_workers, len(todo))
+    log.info(f"skew correcting {len(todo)} stacks with {n_workers} workers")
+
+    args = [(path, out_path, conversion_factors, crop, store) for path in todo]
+    if n_workers == 1:
+        return _collect(map(_skew_correct_file_in_worker, args), len(todo))
+
+    with mp.Pool(n_workers) as pool:
+        return _collect(pool.imap_unordered(_skew_correct_file_in_worker, args), len(todo))
+
+
+def skew_correct_one(in_path, out_path, stack_fname, info_file_path, conversion_factors=None, crop=None,
+                     store=False):
+    """Correct one the SCAPE 3D image, without MATLAB.
+
+    Same arguments and output file as skew_correct_matlab_one.
+
+    Params:
+        in_path: the folder containing the 3D images and the info_file
+        out_path: the folder where the converted image will be saved
+        stack_fname: the file name of the image to convert
+        info_file_path: the path of the info_file (.mat) produced by the SCAPE acquisition software
+        conversion_factors: (ylat, zdep, xwid), read from the info_file if None
+        crop: None, 'valid' or 'planes', see skew_correct_many
+        store: save a chunk store instead of a TIFF file, see skew_correct_many
+
+    Returns:
+        str: the path of the corrected stack (or of the folder of its planes)
+    """
+    if conversion_factors is None:
+        conversion_factors = read_conversion_factors(info_file_path)
+
+    os.makedirs(out_path, exist_ok=True)
+    return _skew_correct_file(os.path.join(in_path, stack_fname), out_path, conversion_factors, crop, store)
+
+
+def skew_correct_folder(in_path, out_path, info_file_path, n_workers=None, overwrite=False, crop=None, store=False):
+    """Correct the SCAPE 3D images (.tif and .tiff) in one folder, without MATLAB.
+
+    Same arguments and output files as skew_correct_matlab, see
+    skew_correct_many for the parallel processing.
+
+    Returns:
+        tuple: (done, failed), see skew_correct_many
+    """
+    return skew_correct_many(in_path, out_path, info_file_path, n_workers=n_workers, overwrite=overwrite, crop=crop,
+                             store=store)
@@ -0,0 +1,3 @@
+from .storage import ChunkStore, open_store, is_store, store_path, read_array, read_stack, write_stack, available_codecs, default_chunks, CODECS, STORE_SUFFIX
+from .lazy import LazyStack, open_stack
+from .pages import read_page, read_pages, extract_plane, ifd_offsets, clear_ifd_cache
@@ -0,0 +1,136 @@
+"""Stacks read on demand, one Z-range or crop at a time.
+
+mtif.read_stack decodes the whole TIFF file in memory. A LazyStack only
+reads the pages (and the region of the pages) that are indexed, e.g. one
+plane to inspect a volume, or the tiles of a volume larger than memory.
+"""
+
+import numpy as np
+import multipagetiff as mtif
+import tifffile
+
+from .storage import open_store, _is_store_path
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class LazyStack:
+    """A stack (z, y, x) read from a file only when it is indexed.
+
+    Contiguous uncompressed TIFF files (e.g. written by tifffile) are
+    memory-mapped. The other TIFF files (compressed, or with the pages
+    interleaved with their headers as written by mtif.write_stack) are
+    read page by page: only the indexed pages are decoded. Chunk stores
+    (*.chunks) read only the chunks overlapping the indexed region.
+
+    The stack is indexed like a numpy array, the result is a numpy array:
+
+        stack = LazyStack("volume.tif")
+        plane = stack[10]
+        roi = stack[20:40, 100:200, :]
+
+    It can replace stack.pages of a mtif.Stack where only slices are
+    needed (see the pages property).
+
+    Args:
+        path (str): a TIFF file or a chunk store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tif = None
+        if _is_store_path(path):
+            self._data = open_store(path)
+            self.mode = 'chunks'
+            return
+        try:
+            self._data = tifffile.memmap(path, mode='r')
+            self.mode = 'memmap'
+        except ValueError:
+            # compressed, or not contiguous
+            self._data = None
+            self.mode = 'pages'
+            self._tif = tifffile.TiffFile(path)
+            page = self._tif.pages[0]
+            self._page_shape = page.shape
+            self._dtype = page.dtype
+            self._n_pages = len(self._tif.pages)
+        log.info(f"{path} opened as {self.mode}")
+
+    @property
+    def shape(self):
+        if self._data is not None:
+            return self._data.shape
+        if self._n_pages == 1:
+            return self._page_shape
+        return (self._n_pages,) + self._page_shape
+
+    @property
+    def dtype(self):
+        if self._data is not None:
+            return self._data.dtype
+        return self._dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def pages(self):
+        """The stack itself, for the functions slicing stack.pages"""
+        return self
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"LazyStack({self.path!r}, shape={self.shape}, dtype={self.dtype}, mode={self.mode})"
+
+    def __getitem__(self, key):
+        if self._data is not None:
+            return np.array(self._data[key])
+
+        if self.ndim == 2:
+            return self._tif.pages[0].asarray()[key]
+        if not isinstance(key, tuple):
+            key = (key,)
+        z, crop = (key[0], key[1:]) if key and key[0] is not Ellipsis else (slice(None), key)
+        if isinstance(z, slice):
+            pages = [self._tif.pages[i].asarray()[crop] for i in range(*z.indices(self._n_pages))]
+            if not pages:
+                return np.empty((0,) + np.empty(self._page_shape)[crop].shape, dtype=self.dtype)
+            return np.stack(pages)
+        # a single page, or a list of pages
+        z = np.asarray(z)
+        if z.ndim == 0:
+            return self._tif.pages[int(z) % self._n_pages].asarray()[crop]
+        return np.stack([self._tif.pages[int(i) % self._n_pages].asarray()[crop] for i in z])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def to_stack(self):
+        """Read the whole stack as a mtif.Stack"""
+        return mtif.Stack(np.asarray(self))
+
+    def close(self):
+        if self._tif is not None:
+            self._tif.close()
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_stack(path):
+    """Open a TIFF file or a chunk store as a LazyStack"""
+    return LazyStack(path)
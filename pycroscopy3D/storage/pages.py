@@ -0,0 +1,151 @@
+"""Reading single pages of multipage TIFF files.
+
+To get one plane of every volume of a run, the page is read directly at
+its IFD (the header of the page in the file) instead of decoding the
+whole volume: only ~1/Z of the bytes are read. The IFD offsets of each
+file are found by following the chain of IFDs, reading only their tag
+counts and next offsets, and can be cached to read other pages of the
+same file later.
+"""
+
+import os
+import struct
+import numpy as np
+import tifffile
+from functools import partial
+from tqdm import tqdm
+
+from .storage import open_store, _is_store_path
+
+import logging
+log = logging.getLogger(__name__)
+
+# path: (modification time, size, IFD offsets)
+_IFD_CACHE = {}
+
+
+def clear_ifd_cache():
+    """Forget the IFD offsets of all files"""
+    _IFD_CACHE.clear()
+
+
+def _walk_ifds(tif):
+    """The offsets of the IFDs of an open TiffFile"""
+    tiff = tif.tiff
+    offsets, seen = [], set()
+    offset = tif.pages[0].offset
+    # unbuffered, only the tag count and the next offset of each IFD are read
+    with open(tif.filehandle.path, 'rb', buffering=0) as fh:
+        while offset:
+            if offset in seen:
+                raise tifffile.TiffFileError(f"{fh.name}: the IFD chain loops at {offset}")
+            offsets.append(offset)
+            seen.add(offset)
+            fh.seek(offset)
+            n_tags = struct.unpack(tiff.tagnoformat, fh.read(tiff.tagnosize))[0]
+            fh.seek(offset + tiff.tagnosize + n_tags*tiff.tagsize)
+            offset = struct.unpack(tiff.offsetformat, fh.read(tiff.offsetsize))[0]
+    return offsets
+
+
+def ifd_offsets(path, cache=True, tif=None):
+    """The offsets of the pages (IFDs) of a TIFF file.
+
+    Args:
+        path (str): the TIFF file.
+        cache (bool): keep the offsets in memory, they are read again only if
+            the file is modified.
+        tif (tifffile.TiffFile): the file, if already open.
+
+    Returns:
+        tuple: the offset of each page
+    """
+    stat = os.stat(path)
+    if cache:
+        cached = _IFD_CACHE.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+    if tif is None:
+        with tifffile.TiffFile(path) as tif:
+            offsets = tuple(_walk_ifds(tif))
+    else:
+        offsets = tuple(_walk_ifds(tif))
+    if cache:
+        _IFD_CACHE[path] = (stat.st_mtime_ns, stat.st_size, offsets)
+    return offsets
+
+
+def _page_at(tif, index, offset):
+    tif.filehandle.seek(offset)
+    return tifffile.TiffPage(tif, index=index)
+
+
+def read_pages(path, indices, crop=None, cache=True):
+    """Read some pages of a multipage TIFF file (or planes of a chunk store).
+
+    Only the IFDs and the data of the requested pages are read.
+
+    Args:
+        path (str): a TIFF file or a chunk store.
+        indices (list): the indices of the pages, negative indices count from the end.
+        crop (tuple): (rows slice, columns slice) of the pages, None for the whole pages.
+        cache (bool): cache the IFD offsets of the file, see ifd_offsets.
+
+    Returns:
+        numpy.ndarray: the pages, of shape (len(indices), rows, columns)
+    """
+    crop = tuple(crop) if crop is not None else ()
+    if _is_store_path(path):
+        store = open_store(path, n_threads=1)
+        return np.stack([store[(i,) + crop] for i in indices])
+
+    with tifffile.TiffFile(path) as tif:
+        offsets = ifd_offsets(path, cache=cache, tif=tif)
+        pages = []
+        for i in indices:
+            if not -len(offsets) <= i < len(offsets):
+                raise IndexError(f"{path}: page {i} out of {len(offsets)} pages")
+            i %= len(offsets)
+            pages.append(_page_at(tif, i, offsets[i]).asarray()[crop])
+    return np.stack(pages)
+
+
+def read_page(path, index, crop=None, cache=True):
+    """Read one page of a multipage TIFF file (or plane of a chunk store), see read_pages."""
+    return read_pages(path, [index], crop, cache)[0]
+
+
+def extract_plane(paths, index, crop=None, dtype=None, n_workers=None, cache=True, progress=True):
+    """Read the same page (plane) of many volumes, e.g. one plane of all the time points.
+
+    The files are read in parallel by a pool of threads, each reading only
+    the requested page.
+
+    Args:
+        paths (list): the TIFF files (or chunk stores) of the volumes, in time order.
+        index (int): the index of the page.
+        crop (tuple): (rows slice, columns slice) of the page, None for the whole page.
+        dtype: data type of the result, that of the pages by default.
+        n_workers (int): number of reading threads, see reduction.iter_stacks.
+        cache (bool): cache the IFD offsets of the files, see ifd_offsets.
+        progress (bool): show a progress bar.
+
+    Returns:
+        numpy.ndarray: the pages, of shape (len(paths), rows, columns)
+    """
+    # imported here, transformation imports storage
+    from ..transformation.reduction import iter_stacks
+
+    if not paths:
+        raise ValueError("no volume to read")
+    reader = partial(read_page, index=index, crop=crop, cache=cache)
+    out = None
+    for t, page in enumerate(tqdm(iter_stacks(paths, n_workers, reader), total=len(paths),
+                                  desc=f"Extract plane {index}", disable=not progress)):
+        if out is None:
+            out = np.empty((len(paths),) + page.shape, dtype=dtype or page.dtype)
+        elif page.shape != out.shape[1:]:
+            raise ValueError(f"{paths[t]}: page of shape {page.shape}, expected {out.shape[1:]}")
+        out[t] = page
+    return out
@@ -0,0 +1,443 @@
+"""Chunked and compressed storage of N-dimensional arrays.
+
+A ChunkStore is a folder (named *.chunks) holding the metadata of the
+array in meta.json and one compressed file per chunk, named by the chunk
+indices (e.g. 0.3.0.1 for the chunk (0, 3, 0, 1) of a (t, z, y, x)
+array). Compared to a multipage TIFF:
+
+- any sub-volume can be read or written, only the chunks it overlaps are
+  read or written;
+- different processes can write different chunks at the same time;
+- the chunks are compressed, chunks that are never written are not
+  stored at all (they read as fill_value).
+
+The zstd and blosc codecs need the zstandard and blosc packages, zlib is
+always available.
+"""
+
+import os
+import json
+import zlib
+import itertools
+import numpy as np
+import multipagetiff as mtif
+from concurrent.futures import ThreadPoolExecutor
+from tifffile import imread, imwrite
+
+import logging
+log = logging.getLogger(__name__)
+
+STORE_SUFFIX = '.chunks'
+_META = 'meta.json'
+
+# default size of a chunk, in bytes
+_CHUNK_BYTES = 2**22
+
+
+def _zstd():
+    import zstandard
+    return zstandard
+
+
+def _blosc():
+    import blosc
+    return blosc
+
+
+class _Codec:
+    """Compression of the chunk bytes"""
+
+    def __init__(self, name, level):
+        self.name = name
+        self.level = level
+        if name == 'zstd':
+            zstandard = _zstd()
+            self._compressor = zstandard.ZstdCompressor(level=level)
+            self._decompressor = zstandard.ZstdDecompressor()
+        elif name == 'blosc':
+            self._blosc = _blosc()
+        elif name not in ('zlib', 'none'):
+            raise ValueError(f"unknown codec {name}, use one of {CODECS}")
+
+    def encode(self, data, itemsize):
+        if self.name == 'zstd':
+            return self._compressor.compress(data)
+        if self.name == 'blosc':
+            return self._blosc.compress(data, typesize=itemsize, clevel=self.level, cname='zstd')
+        if self.name == 'zlib':
+            return zlib.compress(data, self.level)
+        return data
+
+    def decode(self, data):
+        if self.name == 'zstd':
+            return self._decompressor.decompress(data)
+        if self.name == 'blosc':
+            return self._blosc.decompress(data)
+        if self.name == 'zlib':
+            return zlib.decompress(data)
+        return data
+
+
+CODECS = ('zstd', 'blosc', 'zlib', 'none')
+DEFAULT_LEVELS = dict(zstd=3, blosc=5, zlib=1, none=0)
+
+
+def available_codecs():
+    """The codecs whose package is installed"""
+    available = []
+    for name in CODECS:
+        try:
+            _Codec(name, DEFAULT_LEVELS[name])
+            available.append(name)
+        except ImportError:
+            continue
+    return available
+
+
+def default_chunks(shape, itemsize):
+    """Chunk shape of about 4 MB, filled from the last axis: whole rows and
+    planes, then as many planes (and volumes) as fit."""
+    chunks = [1]*len(shape)
+    for axis in reversed(range(len(shape))):
+        fit = _CHUNK_BYTES//(itemsize*int(np.prod(chunks[axis + 1:])))
+        chunks[axis] = max(1, min(shape[axis], fit))
+    return tuple(chunks)
+
+
+def _shuffle(data, itemsize):
+    """Group the bytes of the same significance, as blosc's shuffle filter.
+
+    The most significant bytes of microscopy counts are mostly equal, this
+    makes them compress much better."""
+    if itemsize == 1:
+        return data
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(data, itemsize):
+    if itemsize == 1:
+        return data
+    return np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+class ChunkStore:
+    """An N-dimensional array stored as compressed chunks in a folder.
+
+    Use ChunkStore.create or ChunkStore.open (or open_store). The store
+    is read and written with numpy indexing by integers and slices:
+
+        store = ChunkStore.create("run.chunks", shape=(T, Z, Y, X), dtype='uint16')
+        store[t] = volume
+        plane = store[:, 10]
+        roi = store[t, :, 100:200, 300:400]
+
+    Writing a region that only partially covers a chunk reads the chunk
+    first, so parallel writers must write disjoint chunks.
+
+    Args:
+        path (str): the folder of the store.
+        n_threads (int): threads compressing and decompressing chunks.
+    """
+
+    def __init__(self, path, n_threads=None):
+        self.path = path
+        with open(os.path.join(path, _META)) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunks = tuple(meta['chunks'])
+        self.fill_value = meta['fill_value']
+        self.shuffle = meta['shuffle']
+        self.attrs = meta.get('attrs', {})
+        self._codec = _Codec(meta['codec'], meta['level'])
+        self.n_threads = n_threads if n_threads is not None else os.cpu_count()
+
+    @classmethod
+    def create(cls, path, shape, dtype, chunks=None, codec=None, level=None, shuffle=True,
+               fill_value=0, attrs=None, overwrite=False, n_threads=None):
+        """Create an empty store.
+
+        Args:
+            path (str): the folder of the store.
+            shape (tuple): shape of the array.
+            dtype: data type of the array.
+            chunks (tuple): shape of the chunks, see default_chunks.
+            codec (str): one of CODECS, defaults to the first available.
+            level (int): compression level, see DEFAULT_LEVELS.
+            shuffle (bool): shuffle the bytes before compression.
+            fill_value: value of the chunks never written.
+            attrs (dict): metadata saved with the array (JSON serializable).
+            overwrite (bool): replace an existing store.
+        """
+        dtype = np.dtype(dtype)
+        shape = tuple(int(n) for n in shape)
+        if chunks is None:
+            chunks = default_chunks(shape, dtype.itemsize)
+        if len(chunks) != len(shape):
+            raise ValueError(f"chunks {chunks} do not match the shape {shape}")
+        if codec is None:
+            codec = available_codecs()[0]
+        if level is None:
+            level = DEFAULT_LEVELS[codec]
+        # raise early on a missing codec
+        _Codec(codec, level)
+
+        if os.path.exists(path):
+            if not overwrite:
+                raise FileExistsError(f"{path} exists")
+            if not is_store(path):
+                raise ValueError(f"{path} exists and is not a chunk store")
+            for fname in os.listdir(path):
+                os.remove(os.path.join(path, fname))
+        os.makedirs(path, exist_ok=True)
+
+        meta = dict(shape=shape, dtype=dtype.str, chunks=[int(c) for c in chunks],
+                    codec=codec, level=level, shuffle=shuffle,
+                    fill_value=np.asarray(fill_value, dtype=dtype).item(), attrs=attrs or {})
+        with open(os.path.join(path, _META), 'w') as f:
+            json.dump(meta, f, indent=1)
+        return cls(path, n_threads=n_threads)
+
+    @classmethod
+    def open(cls, path, n_threads=None):
+        """Open an existing store."""
+        if not is_store(path):
+            raise FileNotFoundError(f"{path} is not a chunk store")
+        return cls(path, n_threads=n_threads)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size*self.dtype.itemsize
+
+    @property
+    def nbytes_stored(self):
+        """Size of the store on disk, in bytes"""
+        return sum(os.path.getsize(os.path.join(self.path, fname)) for fname in os.listdir(self.path))
+
+    @property
+    def grid(self):
+        """Number of chunks along each axis"""
+        return tuple(-(-n//c) for n, c in zip(self.shape, self.chunks))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return (f"ChunkStore({self.path!r}, shape={self.shape}, dtype={self.dtype}, "
+                f"chunks={self.chunks}, codec={self._codec.name})")
+
+    # chunk I/O
+
+    def _chunk_path(self, index):
+        return os.path.join(self.path, '.'.join(str(i) for i in index))
+
+    def _chunk_shape(self, index):
+        return tuple(min(c, n - i*c) for i, c, n in zip(index, self.chunks, self.shape))
+
+    def read_chunk(self, index):
+        """Read one chunk, by its indices in the chunk grid."""
+        shape = self._chunk_shape(index)
+        try:
+            with open(self._chunk_path(index), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return np.full(shape, self.fill_value, dtype=self.dtype)
+        data = self._codec.decode(data)
+        if self.shuffle:
+            data = _unshuffle(data, self.dtype.itemsize)
+        return np.frombuffer(data, dtype=self.dtype).reshape(shape)
+
+    def write_chunk(self, index, chunk):
+        """Write one chunk, by its indices in the chunk grid.
+
+        The chunk is written to a temporary file and renamed, so readers
+        never see a partial chunk. Chunks filled with fill_value are removed.
+        """
+        path = self._chunk_path(index)
+        chunk = np.ascontiguousarray(chunk, dtype=self.dtype)
+        if chunk.shape != self._chunk_shape(index):
+            raise ValueError(f"chunk {index} of shape {chunk.shape}, expected {self._chunk_shape(index)}")
+        if (chunk == self.fill_value).all():
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        data = chunk.tobytes()
+        if self.shuffle:
+            data = _shuffle(data, self.dtype.itemsize)
+        data = self._codec.encode(data, self.dtype.itemsize)
+        tmp_path = os.path.join(self.path, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    # indexing
+
+    def _normalize(self, key):
+        """Convert an index to a list of (start, stop, step) per axis, and the
+        axes indexed by an integer"""
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),)*(self.ndim - len(key) + 1) + key[i + 1:]
+        if len(key) > self.ndim:
+            raise IndexError(f"too many indices for a store of dimension {self.ndim}")
+        key = key + (slice(None),)*(self.ndim - len(key))
+
+        ranges, squeeze = [], []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step < 0:
+                    raise IndexError("negative steps are not supported")
+                stop = max(start, stop)
+            else:
+                k = int(k)
+                if k < -n or k >= n:
+                    raise IndexError(f"index {k} out of bounds for axis {axis} of size {n}")
+                start = k % n
+                stop, step = start + 1, 1
+                squeeze.append(axis)
+            ranges.append((start, stop, step))
+        return ranges, tuple(squeeze)
+
+    def _overlapping_chunks(self, ranges):
+        """The chunks overlapping the region, with the overlap in chunk and in region coordinates"""
+        per_axis = []
+        for (start, stop, step), c in zip(ranges, self.chunks):
+            axis = []
+            if stop > start:
+                last = start + ((stop - 1 - start)//step)*step
+                for i in range(start//c, last//c + 1):
+                    # first index of the region in the chunk
+                    lo = max(start, i*c)
+                    lo = start + -(-(lo - start)//step)*step
+                    hi = min(stop, (i + 1)*c)
+                    if lo >= hi:
+                        continue
+                    n = len(range(lo, hi, step))
+                    axis.append((i, slice(lo - i*c, hi - i*c, step),
+                                 slice((lo - start)//step, (lo - start)//step + n)))
+            per_axis.append(axis)
+        return itertools.product(*per_axis)
+
+    def _map(self, function, items):
+        if self.n_threads is None or self.n_threads <= 1:
+            return [function(item) for item in items]
+        # zlib and zstd release the GIL
+        with ThreadPoolExecutor(self.n_threads) as executor:
+            return list(executor.map(function, items))
+
+    def __getitem__(self, key):
+        ranges, squeeze = self._normalize(key)
+        out = np.empty(tuple(len(range(*r)) for r in ranges), dtype=self.dtype)
+
+        def read(overlap):
+            index = tuple(o[0] for o in overlap)
+            chunk = self.read_chunk(index)
+            out[tuple(o[2] for o in overlap)] = chunk[tuple(o[1] for o in overlap)]
+
+        self._map(read, list(self._overlapping_chunks(ranges)))
+        return out.reshape(tuple(n for axis, n in enumerate(out.shape) if axis not in squeeze))
+
+    def __setitem__(self, key, value):
+        ranges, squeeze = self._normalize(key)
+        shape = tuple(len(range(*r)) for r in ranges)
+        value = np.asarray(value, dtype=self.dtype)
+        # add the axes indexed by integers
+        value = np.broadcast_to(value.reshape(tuple(n for axis, n in enumerate(shape) if axis not in squeeze)
+                                              if value.ndim > 0 else ()), shape)
+
+        def write(overlap):
+            index = tuple(o[0] for o in overlap)
+            in_chunk = tuple(o[1] for o in overlap)
+            chunk_shape = self._chunk_shape(index)
+            covered = all(s.step == 1 and s.start == 0 and s.stop == n
+                          for s, n in zip(in_chunk, chunk_shape))
+            if covered:
+                chunk = value[tuple(o[2] for o in overlap)]
+            else:
+                # partial chunk: read, modify, write
+                chunk = self.read_chunk(index).copy()
+                chunk[in_chunk] = value[tuple(o[2] for o in overlap)]
+            self.write_chunk(index, chunk)
+
+        self._map(write, list(self._overlapping_chunks(ranges)))
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def chunk_slices(self):
+        """The regions of all the chunks, as tuples of slices (e.g. to split
+        the writing among processes)."""
+        for index in itertools.product(*(range(n) for n in self.grid)):
+            yield tuple(slice(i*c, min((i + 1)*c, n)) for i, c, n in zip(index, self.chunks, self.shape))
+
+
+def is_store(path):
+    """True if path is a chunk store"""
+    return os.path.isfile(os.path.join(path, _META))
+
+
+def _is_store_path(path):
+    return path.rstrip(os.sep).endswith(STORE_SUFFIX)
+
+
+def store_path(path):
+    """The path with its extension (e.g. .tif) replaced by .chunks"""
+    root, _ = os.path.splitext(path.rstrip(os.sep))
+    return root + STORE_SUFFIX
+
+
+def open_store(path, n_threads=None):
+    """Open an existing chunk store"""
+    return ChunkStore.open(path, n_threads=n_threads)
+
+
+def read_array(path):
+    """Read a whole array from a chunk store (*.chunks) or a tiff file."""
+    if _is_store_path(path):
+        return open_store(path)[...]
+    return imread(path)
+
+
+def read_stack(path):
+    """Read a stack from a chunk store (*.chunks) or a tiff file, as a mtif.Stack."""
+    if _is_store_path(path):
+        return mtif.Stack(open_store(path)[...])
+    return mtif.read_stack(path)
+
+
+def write_stack(stack, path, **kwargs):
+    """Write a mtif.Stack or an array to a chunk store (*.chunks) or a tiff file.
+
+    A mtif.Stack is written as mtif.write_stack does (its pages, converted
+    to dtype_out), an array as it is. An existing store is replaced.
+
+    Args:
+        stack (mtif.Stack or numpy.ndarray): the data.
+        path (str): a .chunks folder, or a tiff file.
+        **kwargs: passed to ChunkStore.create (chunks, codec, level...).
+    """
+    if not _is_store_path(path):
+        if isinstance(stack, mtif.Stack):
+            mtif.write_stack(stack, path)
+        else:
+            imwrite(path, stack)
+        return path
+
+    # the pages of a stack are already cropped and converted to dtype_out
+    pages = np.asarray(stack.pages if isinstance(stack, mtif.Stack) else stack)
+    store = ChunkStore.create(path, pages.shape, pages.dtype, overwrite=True, **kwargs)
+    store[...] = pages
+    return path
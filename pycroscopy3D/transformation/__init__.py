@@ -1 +1,3 @@
-from .transformation import build_4D_tiff, save_4d_tiff, create_planes_tiff, get_unpad_planes, load_unpad_save, calc_stacks_average, get_ordered_tiffs
\ No newline at end of file
+from .transformation import build_4D_tiff, save_4d_tiff, write_4d_tiff, convert_to_4D_stacks, create_planes_tiff, get_unpad_planes, load_unpad_save, calc_stacks_average, get_ordered_tiffs
+from .reduction import StackReducer, reduce_stacks, STATISTICS
+from .planes import scatter_planes, unpad_crops
@@ -0,0 +1,182 @@
+"""Plane-vs-time transposition of a time series of volumes.
+
+A run is saved as one (Z, Y, X) volume per time point, the analysis of
+each plane (e.g. Suite2P) needs one (T, Y, X) stack per plane.
+scatter_planes reads every volume once and writes its planes into
+preallocated memory-mapped per-plane outputs, instead of reading the
+whole time series once per plane.
+"""
+
+import os
+import numpy as np
+import multipagetiff as mtif
+import tifffile
+from functools import partial
+from tqdm import tqdm
+
+from .reduction import iter_stacks
+from ..storage import read_pages
+
+import logging
+log = logging.getLogger(__name__)
+
+FORMATS = ('tiff', 'npy')
+
+# every memory-mapped output holds a file descriptor, at most this number
+# of outputs are open at the same time
+MAX_OPEN_OUTPUTS = 256
+
+try:
+    import resource
+except ModuleNotFoundError:
+    # not on Windows
+    resource = None
+
+
+def _max_open_outputs(max_open):
+    """max_open, limited to a quarter of the file descriptors of the process"""
+    if resource is not None:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY:
+            max_open = min(max_open, soft//4)
+    return max(1, max_open)
+
+
+def _read_planes(path, planes=None):
+    """Read the pages of a volume, only the planes in the list if given."""
+    if planes is None:
+        return tifffile.imread(path)
+    # only the IFDs and the data of the planes are read
+    return read_pages(path, planes)
+
+
+def unpad_crops(volume):
+    """Crops removing the zero-valued borders of every plane of a volume.
+
+    The crops are the same as mtif.image_tools.unpad, they can be passed to
+    scatter_planes to unpad the planes of all the time points as the
+    reference volume.
+
+    Returns:
+        list: a (rows slice, columns slice) tuple per plane, None for empty planes
+    """
+    crops = []
+    for plane in volume:
+        try:
+            pad = mtif.image_tools.estimate_zero_padding(plane)
+        except mtif.image_tools.EmptyImageException:
+            crops.append(None)
+            continue
+        crops.append((slice(*pad['v']), slice(*pad['h'])))
+    return crops
+
+
+def _open_output(path, shape, dtype, fmt):
+    if fmt == 'tiff':
+        return tifffile.memmap(path, shape=shape, dtype=dtype, photometric='minisblack')
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def _scatter_group(paths, out_folder, planes, slices, plane_shape, n_planes, fmt, dtype,
+                   name_format, n_workers, progress):
+    """Write the outputs of some planes, see scatter_planes"""
+    if planes == list(range(n_planes)):
+        # the whole volumes
+        reader = _read_planes
+    else:
+        reader = partial(_read_planes, planes=planes)
+
+    out_paths, tmp_paths, outputs = {}, [], []
+    for z, (crop, shape) in zip(planes, slices):
+        fname = name_format.format(plane=z) + '.' + fmt
+        out_paths[z] = os.path.join(out_folder, fname)
+        tmp_paths.append(os.path.join(out_folder, f".{fname}.{os.getpid()}.tmp"))
+        outputs.append(_open_output(tmp_paths[-1], (len(paths),) + shape, dtype, fmt))
+
+    try:
+        volumes = iter_stacks(paths, n_workers, reader)
+        for t, volume in enumerate(tqdm(volumes, total=len(paths), desc="Scatter planes",
+                                        disable=not progress)):
+            if volume.shape[0] != len(planes) or volume.shape[1:] != plane_shape:
+                raise ValueError(f"{paths[t]}: volume of shape {volume.shape}, "
+                                 f"expected {(len(planes),) + plane_shape}")
+            for plane, out, (crop, _) in zip(volume, outputs, slices):
+                out[t] = plane[crop]
+    except BaseException:
+        del outputs
+        for tmp_path in tmp_paths:
+            os.remove(tmp_path)
+        raise
+
+    for out, tmp_path, z in zip(outputs, tmp_paths, planes):
+        out.flush()
+        os.replace(tmp_path, out_paths[z])
+    del outputs
+
+    return out_paths
+
+
+def scatter_planes(paths, out_folder, planes=None, crops=None, fmt='tiff', dtype=np.uint16,
+                   name_format="plane_{plane:05d}", n_workers=None, progress=True,
+                   max_open=MAX_OPEN_OUTPUTS):
+    """Transpose a time series of volumes into one (T, Y, X) stack per plane.
+
+    The planes of the volumes are copied into per-plane outputs,
+    memory-mapped and preallocated with the number of time points. The
+    outputs are written under a temporary name and renamed when complete.
+
+    At most max_open outputs are open at the same time (also limited by
+    the number of files the process can open): the planes are processed
+    in groups, and each volume is read once per group, only the pages of
+    the planes of the group. Every page is read once in total.
+
+    Args:
+        paths (list): the paths of the (Z, Y, X) volumes (TIFF), in time order.
+        out_folder (str): the folder of the per-plane stacks.
+        planes (list): the Z indices of the planes, defaults to all the planes.
+        crops (list or dict): (rows slice, columns slice) of each plane, indexed
+            by Z. None (the default) for the whole plane. See unpad_crops.
+        fmt (str): 'tiff' or 'npy'.
+        dtype: data type of the outputs.
+        name_format (str): name of the output of each plane, formatted with plane=Z.
+        n_workers (int): number of reading threads, see reduction.iter_stacks.
+        progress (bool): show a progress bar.
+        max_open (int): maximum number of outputs open at the same time.
+
+    Returns:
+        dict: the path of the (T, Y, X) stack of each plane
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt}, use one of {FORMATS}")
+    if not paths:
+        raise ValueError("no volume to transpose")
+
+    with tifffile.TiffFile(paths[0]) as tif:
+        n_planes = len(tif.pages)
+        plane_shape = tif.pages[0].shape
+    planes = list(range(n_planes)) if planes is None else list(planes)
+    if crops is None:
+        crops = {}
+    elif not isinstance(crops, dict):
+        crops = dict(enumerate(crops))
+
+    # slices of the planes in the volumes and the outputs
+    slices = []
+    for z in planes:
+        crop = crops.get(z)
+        if crop is None:
+            crop = (slice(None), slice(None))
+        shape = tuple(len(range(*s.indices(n))) for s, n in zip(crop, plane_shape))
+        slices.append((crop, shape))
+
+    os.makedirs(out_folder, exist_ok=True)
+    max_open = _max_open_outputs(max_open)
+    groups = range(0, len(planes), max_open)
+    if len(groups) > 1:
+        log.info(f"scattering {len(planes)} planes in {len(groups)} groups of {max_open} outputs")
+
+    out_paths = {}
+    for g in groups:
+        out_paths.update(_scatter_group(paths, out_folder, planes[g:g + max_open], slices[g:g + max_open],
+                                        plane_shape, n_planes, fmt, dtype, name_format, n_workers, progress))
+    return out_paths
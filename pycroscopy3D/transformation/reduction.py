@@ -0,0 +1,245 @@
+"""Voxel-wise statistics over many stacks.
+
+The statistics are accumulated one stack at a time, so that the memory
+does not depend on the number of stacks: e.g. the mean and the median
+volume of the thousands of volumes of a run.
+"""
+
+import numpy as np
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from tifffile import imread
+from tqdm import tqdm
+
+import logging
+log = logging.getLogger(__name__)
+
+STATISTICS = ('sum', 'mean', 'var', 'std', 'min', 'max', 'median')
+
+# default number of threads reading stacks: up to 2*READ_WORKERS volumes are
+# in memory, whatever the number of CPUs
+READ_WORKERS = 4
+
+# P² markers of the median: minimum, 1st quartile, median, 3rd quartile, maximum
+_P2_INCREMENTS = np.array([0, 0.25, 0.5, 0.75, 1])
+
+
+class StackReducer:
+    """Accumulate voxel-wise statistics of stacks of the same shape.
+
+    The sum is accumulated in float64, the variance is updated with
+    Welford's algorithm. The median is approximated with the P² algorithm
+    (Jain and Chlamtac, 1985) applied to every voxel: it keeps 5 markers
+    per voxel instead of all the values. It is exact up to 5 stacks.
+
+    Args:
+        variance (bool): also calculate the variance (one more float64 volume).
+        median (bool): also estimate the median (8 volumes of float32 and
+            int32 markers).
+        extrema (bool): also keep the minimum and the maximum (two volumes
+            of the dtype of the stacks).
+
+    Example:
+        r = StackReducer(variance=True)
+        for path in paths:
+            r.update(imread(path))
+        r.mean, r.std
+    """
+
+    def __init__(self, variance=False, median=False, extrema=False):
+        self.n = 0
+        self.with_variance = variance
+        self.with_median = median
+        self.with_extrema = extrema
+        self._sum = None
+        self._m2 = None
+        self._min = None
+        self._max = None
+        # P² state: marker heights and positions (the first and last positions
+        # are the same for all the voxels)
+        self._q = None
+        self._pos = None
+        self._first = []
+
+    def update(self, volume):
+        """Add a stack to the statistics."""
+        volume = np.asarray(volume)
+        if self.n == 0:
+            self._sum = np.zeros(volume.shape, dtype=np.float64)
+            if self.with_variance:
+                self._m2 = np.zeros(volume.shape, dtype=np.float64)
+            if self.with_extrema:
+                self._min = volume.copy()
+                self._max = volume.copy()
+        elif volume.shape != self._sum.shape:
+            raise ValueError(f"stack of shape {volume.shape}, expected {self._sum.shape}")
+        elif self.with_extrema:
+            np.minimum(self._min, volume, out=self._min)
+            np.maximum(self._max, volume, out=self._max)
+
+        if self.with_variance and self.n > 0:
+            # Welford: m2 += (x - previous mean)*(x - mean)
+            delta = volume - self._sum/self.n
+            self._sum += volume
+            self.n += 1
+            delta *= volume - self._sum/self.n
+            self._m2 += delta
+        else:
+            self._sum += volume
+            self.n += 1
+
+        if self.with_median:
+            self._update_median(volume)
+        return self
+
+    def _update_median(self, volume):
+        if self.n <= 5:
+            # the first values are kept to initialize the markers
+            self._first.append(volume.astype(np.float32))
+            if self.n == 5:
+                self._q = np.sort(np.stack(self._first), axis=0)
+                self._pos = np.empty((3,) + volume.shape, dtype=np.int32)
+                self._pos[:] = np.arange(1, 4).reshape((3,) + (1,)*volume.ndim)
+                self._first = []
+            return
+
+        # flat views of the markers
+        q = self._q.reshape(5, -1)
+        pos = self._pos.reshape(3, -1)
+        x = volume.reshape(-1).astype(np.float32)
+
+        # extreme markers
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        # increment the positions of the markers above x
+        for i in range(1, 4):
+            pos[i - 1] += x < q[i]
+
+        # adjust the middle markers, that are too far from their desired
+        # position (the extreme ones are at 0 and n-1)
+        desired = _P2_INCREMENTS*(self.n - 1)
+        for i in range(1, 4):
+            n_i = pos[i - 1]
+            lower = pos[i - 2] if i > 1 else 0
+            upper = pos[i] if i < 3 else self.n - 1
+            up = (n_i <= desired[i] - 1) & (upper - n_i > 1)
+            down = (n_i >= desired[i] + 1) & (lower - n_i < -1)
+            move = np.flatnonzero(up | down)
+            if move.size == 0:
+                continue
+
+            # only the moving markers are computed
+            step = np.where(up[move], 1, -1).astype(np.float32)
+            n_m = n_i[move]
+            n_lo = ((pos[i - 2][move] if i > 1 else 0) - n_m).astype(np.float32)
+            n_hi = ((pos[i][move] if i < 3 else self.n - 1) - n_m).astype(np.float32)
+            q_lo, q_i, q_hi = q[i - 1][move], q[i][move], q[i + 1][move]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q_i + step/(n_hi - n_lo)*(
+                    (-n_lo + step)*(q_hi - q_i)/n_hi + (n_hi - step)*(q_i - q_lo)/(-n_lo))
+            linear = np.where(step > 0, q_i + (q_hi - q_i)/n_hi, q_i - (q_lo - q_i)/n_lo)
+            q[i][move] = np.where((q_lo < parabolic) & (parabolic < q_hi), parabolic, linear)
+            n_i[move] += step.astype(np.int32)
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def mean(self):
+        return self._sum/self.n
+
+    @property
+    def var(self):
+        """The (population) variance"""
+        if not self.with_variance:
+            raise ValueError("the variance is computed only with StackReducer(variance=True)")
+        return self._m2/self.n
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def min(self):
+        if not self.with_extrema:
+            raise ValueError("the minimum is kept only with StackReducer(extrema=True)")
+        return self._min
+
+    @property
+    def max(self):
+        if not self.with_extrema:
+            raise ValueError("the maximum is kept only with StackReducer(extrema=True)")
+        return self._max
+
+    @property
+    def median(self):
+        if not self.with_median:
+            raise ValueError("the median is computed only with StackReducer(median=True)")
+        if self.n < 5:
+            return np.median(np.stack(self._first), axis=0)
+        return self._q[2]
+
+    def get(self, statistic):
+        """Get a statistic by name (see STATISTICS)"""
+        if statistic not in STATISTICS:
+            raise ValueError(f"unknown statistic {statistic}, use one of {STATISTICS}")
+        return getattr(self, statistic)
+
+
+def reduce_stacks(paths, statistics=('mean',), n_workers=None, reader=imread, progress=True):
+    """Calculate voxel-wise statistics over the stacks in paths.
+
+    The stacks are read in parallel by a pool of threads, at most
+    2*n_workers stacks are in memory at the same time besides the
+    accumulators of StackReducer. All the stacks must have the same shape.
+
+    Args:
+        paths (list): the paths of the stacks (TIFF files).
+        statistics (tuple): statistics to calculate, see STATISTICS.
+        n_workers (int): number of reading threads, defaults to READ_WORKERS.
+        reader (callable): function reading a stack from a path.
+        progress (bool): show a progress bar.
+
+    Returns:
+        dict: the statistics, as float arrays (min and max have the dtype of the stacks)
+    """
+    for statistic in statistics:
+        if statistic not in STATISTICS:
+            raise ValueError(f"unknown statistic {statistic}, use one of {STATISTICS}")
+    if not paths:
+        raise ValueError("no stack to reduce")
+
+    reducer = StackReducer(variance='var' in statistics or 'std' in statistics,
+                           median='median' in statistics,
+                           extrema='min' in statistics or 'max' in statistics)
+    for volume in tqdm(iter_stacks(paths, n_workers, reader), total=len(paths),
+                       desc="Reduce stacks", disable=not progress):
+        reducer.update(volume)
+
+    return {statistic: reducer.get(statistic) for statistic in statistics}
+
+
+def iter_stacks(paths, n_workers=None, reader=imread):
+    """Read the stacks in paths in parallel, and yield them in order.
+
+    The stacks are read by a pool of threads, at most 2*n_workers stacks
+    are read ahead.
+
+    Args:
+        paths (list): the paths of the stacks.
+        n_workers (int): number of reading threads, defaults to READ_WORKERS.
+        reader (callable): function reading a stack from a path.
+    """
+    if n_workers is None:
+        n_workers = READ_WORKERS
+
+    with ThreadPool(n_workers) as pool:
+        # keep a bounded number of stacks in flight, to bound the memory
+        pending = deque()
+        for path in paths:
+            pending.append(pool.apply_async(reader, (path,)))
+            if len(pending) >= 2*n_workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
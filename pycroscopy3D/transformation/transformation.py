@@ -1,11 +1,14 @@
 import multipagetiff as mtif
 import numpy as np
 import pandas as pd
-from tifffile import imwrite
+from tifffile import imwrite, imread, TiffFile, TiffWriter
 from tqdm import tqdm
 import os
 import psutil
-from multiprocessing import cpu_count
+
+from .reduction import reduce_stacks, iter_stacks, StackReducer
+from .planes import scatter_planes
+from ..storage import LazyStack, extract_plane
 
 import logging
 log = logging.getLogger(__name__)
@@ -80,74 +83,51 @@ def get_number_of_array_fitting_ram(numpy_array):
 
 def calc_stacks_average(paths, chunk_size=None):
     """Calculate the average of the images in paths.
+
+    The stacks are read in parallel and summed one at a time, chunk_size
+    (default: reduction.READ_WORKERS) is the number of reading threads (see
+    reduction.reduce_stacks).
     
     Returns:
     multipagetiff.Stack
     """
-
-    if chunk_size is None:
-        # chunk size equals CPUs number
-        try:
-            # array = mtif.read_stack(paths[0]).pages
-            # chunk_size = min(len(paths), get_number_of_array_fitting_ram(paths))
-            chunk_size = cpu_count()
-        except:
-            raise
-
-    try:
-        stack_sum = np.zeros(mtif.read_stack(paths[0]).shape, dtype=np.float64)
-    except:
-        raise
-
-    for i in tqdm(range(0,len(paths), chunk_size), desc=f"Average stacks (chunksize={chunk_size})"):
-        paths_batch = paths[i:i+chunk_size]
-        volumes = mtif.load_and_apply_batch(paths_batch, identity)
-        output = np.array(volumes)
-        
-        stack_sum += np.array(output).sum(axis=0)
-    
-    mean_img = (stack_sum/len(paths)).astype(np.uint16)
+    mean = reduce_stacks(paths, ('mean',), n_workers=chunk_size)['mean']
+    mean_img = mean.astype(np.uint16)
     return mtif.Stack(mean_img)
 
-def convert_to_4D_stacks(paths, path_out, mean_stack_path=None):
-    """Stack Volumes into 4D stacks of size chunk_size."""
+def convert_to_4D_stacks(paths, path_out, mean_stack_path=None, chunk_size=None):
+    """Stack Volumes into 4D stacks of size chunk_size (default: all the volumes in one stack).
+
+    The volumes are streamed into the 4D stacks (see write_4d_tiff), the
+    mean volume is calculated in the same pass.
+    """
     
     if chunk_size is None:
       chunk_size = len(paths)
       
-    stack_sum = np.zeros(mtif.read_stack(paths[0]).shape, dtype=np.float64)
+    reducer = StackReducer()
       
     for i in tqdm(range(0,len(paths), chunk_size), desc=f"Build 4d stack(chunksize={chunk_size})"):
         paths_batch = paths[i:i+chunk_size]
-        volumes = mtif.load_and_apply_batch(paths_batch, identity)
-        output = np.array(volumes)
-        
-        stack_sum += np.array(output).sum(axis=0)
-        
-        # SAVE AS NPY
-        # fname = os.path.join(path_out, 
-        #                       'hyperstack_{}_to_{}'.format(str(i).zfill(5),
-        #                                                       str(i+chunk_size-1).zfill(5)))
-        # np.save(fname, output)
-        
-        # SAVE AS TIFF
-
-        save_4d_tiff(path_out, 
-                    output, 
-                    default_name='hyperstack_{}_to_{}.tif'.format(str(i).zfill(5),
-                                                                str(i+len(paths_batch)-1).zfill(5)))
+        fname = os.path.join(path_out,
+                             'hyperstack_{}_to_{}.tif'.format(str(i).zfill(5),
+                                                              str(i+len(paths_batch)-1).zfill(5)))
+        write_4d_tiff(paths_batch, fname, reducer=reducer, progress=False)
     
     if mean_stack_path is not None:
-        mean_img = (stack_sum/len(paths)).astype(np.uint16)
+        mean_img = reducer.mean.astype(np.uint16)
         mtif.write_stack(mtif.Stack(mean_img), mean_stack_path)
     
     
 
-def build_4D_tiff(dataPath, frame_lim=None, plane_lim=None):
+def build_4D_tiff(dataPath, frame_lim=None, plane_lim=None, out_path=None):
     """
     Build a 4D stack from separate 3D tiff files.
     The 3D input volumes are stacked along the first dimension of the output 4D stack
 
+    All the volumes are loaded in memory, unless out_path is given: then
+    they are streamed into a 4D tiff file (see write_4d_tiff).
+
     Parameters
     ----------
     dataPath : str
@@ -157,12 +137,15 @@ def build_4D_tiff(dataPath, frame_lim=None, plane_lim=None):
             The default is None: all 3D images are used
     plane_lim : iterable of 2 ints, optional
         Selection interval of the pages in each 3D stack. The default is None.
+    out_path : str, optional
+        Path of the 4D tiff file. The default is None: the 4D stack is returned.
 
     Returns
     -------
     numpy array of shape (N,Z,Y,X) where.
         N is the number of input 3D images
         (Z,Y,X) is the shape of all 3D images
+    or out_path, if given.
 
     """
     # Get ordered list of tiff files in data folder that we need to load
@@ -171,6 +154,9 @@ def build_4D_tiff(dataPath, frame_lim=None, plane_lim=None):
     else:
         to_load = get_ordered_tiffs(dataPath)[frame_lim[0]:frame_lim[1]]
 
+    if out_path is not None:
+        return write_4d_tiff(to_load, out_path, plane_lim=plane_lim)
+
     # Loads tiff files
     hyperstack = mtif.load_and_apply_batch(to_load, 
                                            crop_planes, 
@@ -198,6 +184,66 @@ def save_4d_tiff(savePath, hyperstack, default_name='hyperstack_4D.tiff'):
     imwrite(fname, hyperstack)
 
 
+def write_4d_tiff(paths, fname, plane_lim=None, reducer=None, n_workers=None, ome=None, progress=True):
+    """Stream 3D tiff files into a 4D (T,Z,Y,X) BigTIFF file, with constant memory.
+
+    The volumes are read in parallel (see reduction.iter_stacks) and their
+    pages appended to the file one by one, so that only a few volumes are
+    in memory at any time.
+
+    Parameters
+    ----------
+    paths : list of str
+        The 3D volumes, in time order. All must have the same shape and dtype.
+    fname : str
+        Path of the 4D tiff file.
+    plane_lim : iterable of 2 ints, optional
+        Selection interval of the pages in each 3D stack. The default is None.
+    reducer : reduction.StackReducer, optional
+        Updated with every volume, e.g. to calculate the mean volume in the same pass.
+    n_workers : int, optional
+        Number of reading threads. The default is reduction.READ_WORKERS.
+    ome : bool, optional
+        Write an OME-TIFF. The default is None: if fname ends with .ome.tif(f).
+    progress : bool, optional
+        Show a progress bar.
+
+    Returns
+    -------
+    fname
+
+    """
+    if plane_lim is None:
+        reader = imread
+    else:
+        def reader(path):
+            return imread(path, key=slice(*plane_lim))
+
+    with TiffFile(paths[0]) as tif:
+        n_planes = len(range(len(tif.pages))[slice(*(plane_lim or (None,)))])
+        page = tif.pages[0]
+        shape = (len(paths), n_planes) + page.shape
+        dtype = page.dtype
+
+    def pages():
+        volumes = iter_stacks(paths, n_workers, reader)
+        for t, volume in enumerate(tqdm(volumes, total=len(paths), desc="Write 4D tiff",
+                                        disable=not progress)):
+            volume = volume.reshape((-1,) + volume.shape[-2:])
+            if volume.shape != shape[1:] or volume.dtype != dtype:
+                raise ValueError(f"{paths[t]}: volume {volume.shape} {volume.dtype}, "
+                                 f"expected {shape[1:]} {dtype}")
+            if reducer is not None:
+                reducer.update(volume)
+            yield from volume
+
+    with TiffWriter(fname, bigtiff=True, ome=ome) as tif:
+        tif.write(pages(), shape=shape, dtype=dtype, photometric='minisblack',
+                  metadata={'axes': 'TZYX'})
+
+    return fname
+
+
 def properNamePlane(i, nPlanes):
     lenToGet = len(str(nPlanes))
 
@@ -214,17 +260,20 @@ def properNamePlane(i, nPlanes):
 
 
 def get_image_specs(fname):
-    ref_stack = np.array(mtif.read_stack(fname))
+    # only the pages used are read
+    ref_stack = LazyStack(fname)
 
     nPlanes = ref_stack.shape[0]
 
-    y0, y1 = np.where(np.sum(ref_stack[10,], axis=0) != 0)[0][0], np.where(np.sum(ref_stack[10,], axis=0) != 0)[0][-1]
+    plane = ref_stack[10]
+    y0, y1 = np.where(np.sum(plane, axis=0) != 0)[0][0], np.where(np.sum(plane, axis=0) != 0)[0][-1]
 
     return ref_stack, nPlanes, (y0, y1)
 
 
 def get_minimal_fov(plane_id, ref_stack):
-    x_lim = np.where(np.sum(ref_stack[plane_id,], axis=1) != 0)[0][0], np.where(np.sum(ref_stack[plane_id,], axis=1) != 0)[0][-1]
+    plane = ref_stack[plane_id]
+    x_lim = np.where(np.sum(plane, axis=1) != 0)[0][0], np.where(np.sum(plane, axis=1) != 0)[0][-1]
 
     return x_lim
 
@@ -236,6 +285,29 @@ def get_plane_image(array, plane_id, x_lim, y_lim):
     return output
 
 
+def get_plane_limits(plane_id, y_lim, ref_stack, crop=True):
+    """Crop limits of a plane, and their row of limits_crop.csv.
+
+    Returns
+    -------
+    x_lim : tuple of 2 ints
+        The minimal FOV of the plane if crop is True, the entire FOV otherwise.
+    df_crop : pandas.DataFrame
+        The limits of the FOV used (x_lim, y_lim, plane_id, status).
+
+    """
+    # get minimal FOV for this plane if crop is True
+    if crop:
+        x_lim = get_minimal_fov(plane_id, ref_stack)
+    else: # get entire FOV
+        x_lim = (0, ref_stack.shape[1])
+    df_crop = pd.DataFrame({'x_lim': x_lim,
+                            'y_lim': y_lim,
+                            'plane_id': [plane_id]*2,
+                            'status': ['inf', 'sup']})  # store info to save it
+    return x_lim, df_crop
+
+
 def create_single_plane_tiff(plane_id, to_load, y_lim, ref_stack, crop=True):
     """Extract one plane at specified Z from a set of 3D images.
     
@@ -268,23 +340,10 @@ def create_single_plane_tiff(plane_id, to_load, y_lim, ref_stack, crop=True):
 
     """
 
-    # get minimal FOV for this plane if crop is True
-    if crop:
-        x_lim = get_minimal_fov(plane_id, ref_stack)
-    else: # get entire FOV
-        x_lim = (0, ref_stack.shape[1])
-    df_crop = pd.DataFrame({'x_lim': x_lim,
-                            'y_lim': y_lim,
-                            'plane_id': [plane_id]*2,
-                            'status': ['inf', 'sup']})  # store info to save it
-
-    # Load cropped stack of each time steps
-    stacks = mtif.load_and_apply_batch(to_load, get_plane_image, 
-                                       plane_id=plane_id, x_lim=x_lim, y_lim=y_lim)
+    x_lim, df_crop = get_plane_limits(plane_id, y_lim, ref_stack, crop)
 
-    # Build hyperstack
-    hyperstack = np.stack(stacks, axis=0).astype(np.uint16)
-    del stacks
+    # Read only the cropped plane of each time step, as get_plane_image
+    hyperstack = extract_plane(to_load, plane_id, crop=(slice(*x_lim), slice(*y_lim)), dtype=np.uint16)
 
     #  Save limits of FOV used
     return hyperstack, df_crop
@@ -330,17 +389,20 @@ def create_planes_tiff(dataPath, run, savePath, plane_lim=None, step_plane=5, cr
         start, end = 0, nPlanes
     else:
         start, end = plane_lim[0], nPlanes-2
-    
+    planes = list(range(start, end, step_plane))
+
     df_crop_all = {}
+    crops = {}
+
+    for plane_id in planes:
+        x_lim, df_crop_all[plane_id] = get_plane_limits(plane_id, y_lim, ref_stack, crop)
+        crops[plane_id] = (slice(*x_lim), slice(*y_lim))
 
-    for plane_id in range(start, end, step_plane):
-        stack, df_crop = create_single_plane_tiff(plane_id, to_load, y_lim, ref_stack, crop)
-        planeName = str(plane_id).zfill(len(str(nPlanes)))
-        # savePath = create_save_path(savePath, run + '/plane_' + planeName)
-        fname = os.path.join(savePath, 'plane_' + planeName + '.tiff')
-        imwrite(fname, stack, dtype=np.uint16)
+    # read every volume once, and write its planes in the plane stacks
+    fnames = scatter_planes(to_load, savePath, planes=planes, crops=crops, dtype=np.uint16,
+                            name_format=f"plane_{{plane:0{len(str(nPlanes))}d}}")
+    for fname in fnames.values():
         print('Saved hyperstack as:\n' + fname)
-        df_crop_all[plane_id] = df_crop
     pd.concat(df_crop_all).to_csv(savePath + '/limits_crop.csv')
 
 
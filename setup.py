@@ -23,9 +23,12 @@ iocbio_deconvolve = [
               include_dirs=[
                   numpy.get_include(), "deconvolve/cpp/include"],
               # the shared librairies linked at import time
-              libraries=['pthread', 'fftw3', 'fftw3f'],
+              libraries=['pthread', 'fftw3', 'fftw3f', 'fftw3_omp', 'fftw3f_omp'],
+              # OpenMP for the image operations and multithreaded FFTW
               extra_compile_args=[
-                  "-std=c++11", "-funroll-loops", "-Ofast", "-march=native", "-fPIC"],
+                  "-std=c++11", "-funroll-loops", "-Ofast", "-march=native", "-fPIC",
+                  "-fopenmp", "-DUSE_FFTW_THREADS"],
+              extra_link_args=["-fopenmp"],
               )
 ]
 
@@ -43,12 +46,13 @@ setup(name='Pycroscopy3D',
       package_data={'': ['pycroscopy3D/Matlab/*']},
       include_package_data=True,
       install_requires=['numpy', 'matplotlib', 'tqdm', 'psutil',
-                        'connected-components-3d', 'antspyx', 'multipagetiff'],
+                        'connected-components-3d', 'antspyx', 'multipagetiff', 'tifffile'],
       entry_points={'console_scripts': [
           'pycro_register=pycroscopy3D.cli.registration:main',
           'pycro_unpad=pycroscopy3D.cli.unpad:main',
           'pycro_sum_stacks=pycroscopy3D.cli.sum_stacks:main',
           'pycro_deconvolve=pycroscopy3D.cli.deconvolution:main',
+          'pycro_deconvolve_batch=pycroscopy3D.cli.deconvolution_batch:main',
           'pycro_convert=pycroscopy3D.cli.ants_to_tif:main',
           'pycro_skew_correct_one=pycroscopy3D.cli.skew_correct_one:main',
           'pycro_skew_correct_many=pycroscopy3D.cli.skew_correct_many:main',
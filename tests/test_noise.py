@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from pycroscopy3D.deconvolution.noise import NoiseHistogram, hist
+
+
+def single_array_hist(img):
+    """The former hist: np.histogram of the whole array at once"""
+    start = img.min()
+    end = img.max()
+    bins = np.arange(start, end)
+    bars, _ = np.histogram(
+        img, bins=np.array([*bins, end+1]), density=True)
+    return bins, bars
+
+
+def test_chunks_match_single_array_histogram():
+    data = 100 + np.random.default_rng(0).poisson(20, (30, 64, 64)).astype(np.uint16)
+    h = NoiseHistogram()
+    h.CHUNK_SIZE = 997
+    for page in data:
+        h.update(page)
+    old_bins, old_bars = single_array_hist(data)
+
+    np.testing.assert_array_equal(h.bins[:-1], old_bins)
+    np.testing.assert_allclose(h.bars[:-2], old_bars[:-1])
+    # np.histogram merged the maximum into the last bin, of width 2
+    np.testing.assert_allclose(old_bars[-1], (h.bars[-2] + h.bars[-1])/2)
+
+    bins, bars = hist(data)
+    np.testing.assert_array_equal(bins, h.bins)
+    np.testing.assert_array_equal(bars, h.bars)
+
+
+@pytest.mark.parametrize("dtype, start", [(np.uint8, 3), (np.uint64, 2**40), (np.int16, -30000),
+                                          (np.int64, -5), (np.float32, -5)])
+def test_dtypes(dtype, start):
+    # negative values, e.g. float noise after the offset subtraction
+    values = start + np.array([0, 0, 3, 5, 5, 5, 10])
+    h = NoiseHistogram().update(values.astype(dtype))
+    assert h.start == values.min()
+    np.testing.assert_array_equal(h.counts, np.bincount(values - values.min()))
+
+
+def test_invalid_values():
+    with pytest.raises(ValueError, match="NaN"):
+        NoiseHistogram().update(np.array([1., np.nan]))
+    with pytest.raises(ValueError, match="int64"):
+        NoiseHistogram().update(np.array([0, 2**63], dtype=np.uint64))
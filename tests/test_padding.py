@@ -0,0 +1,24 @@
+import numpy as np
+
+from pycroscopy3D.deconvolution.padding import fast_shape, fft_cost, next_fast_len, pad_stack
+
+
+def test_fast_shape_changes_parity_when_cheaper():
+    padded, speedup = fast_shape((317, 317, 101), (10, 10, 10))
+    assert padded == (336, 336, 112)
+    assert speedup > 1
+    assert fft_cost(padded) < fft_cost((343, 343, 125))
+
+
+def test_fast_shape_keep_parity():
+    shape, margin = (317, 470, 101), (10, 10, 10)
+    padded, _ = fast_shape(shape, margin, keep_parity=True)
+    assert [p % 2 for p in padded] == [n % 2 for n in shape]
+    assert all(p >= n + m for p, n, m in zip(padded, shape, margin))
+    assert padded == tuple(next_fast_len(n + m, parity=n % 2) for n, m in zip(shape, margin))
+
+
+def test_pad_stack_crops_back():
+    pages = np.random.default_rng(0).uniform(0, 1, (5, 7, 9))
+    padded, crop = pad_stack(pages, fast_shape(pages.shape)[0])
+    np.testing.assert_array_equal(padded[crop], pages)
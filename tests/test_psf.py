@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from pycroscopy3D.psf import psf as psf_module
+from pycroscopy3D.psf.psf import PSF
+
+
+def beads(shape=(40, 48, 48), n=30, seed=0):
+    """Gaussian beads at random sub-voxel positions, some across the slab boundaries"""
+    rng = np.random.default_rng(seed)
+    z, y, x = np.indices(shape)
+    stack = rng.uniform(0, 20, shape)
+    # centered on the boundaries between slabs of 7 pages
+    centers = [(7*k - 0.5 + rng.uniform(-0.3, 0.3), rng.uniform(5, shape[1]-5), rng.uniform(5, shape[2]-5))
+               for k in range(1, shape[0]//7)]
+    centers += [rng.uniform(4, np.array(shape)-4) for _ in range(n - len(centers))]
+    for cz, cy, cx in centers:
+        stack += rng.uniform(500, 1000)*np.exp(-((z-cz)**2/8 + (y-cy)**2/4 + (x-cx)**2/4))
+    return np.round(stack).astype(np.uint16)
+
+
+def centroids_by_bbox(psf):
+    return {tuple((s.start, s.stop) for s in psf.bboxes[label-1]): centroid
+            for label, centroid in zip(psf.labels, psf.centroids)}
+
+
+@pytest.mark.parametrize("value_tolerance", [0, 5])
+def test_slabs_match_whole_stack(value_tolerance):
+    stack = beads()
+    whole = PSF(stack, value_tolerance=value_tolerance)
+    slabs = PSF(stack, value_tolerance=value_tolerance, slab_size=7)
+
+    assert sorted(whole.bboxes, key=str) == sorted(slabs.bboxes, key=str)
+    assert whole.bbox_size == slabs.bbox_size
+    whole_centroids, slabs_centroids = centroids_by_bbox(whole), centroids_by_bbox(slabs)
+    assert whole_centroids.keys() == slabs_centroids.keys()
+    for bbox, centroid in whole_centroids.items():
+        if bbox[0][0] // 7 == (bbox[0][1] - 1) // 7:
+            # bit-identical, the crops of crop_PSF depend on the truncated centroids
+            assert slabs_centroids[bbox] == centroid
+        else:
+            # merged across slabs
+            np.testing.assert_allclose(slabs_centroids[bbox], centroid, rtol=0, atol=1e-9)
+    assert len(whole.PSFs) == len(slabs.PSFs)
+    np.testing.assert_allclose(whole.mean_PSF.pages, slabs.mean_PSF.pages)
+
+
+def test_slabs_plot_volumes():
+    slabs = PSF(beads(), slab_size=7)
+    with pytest.raises(ValueError, match="slab mode"):
+        slabs.plot_connected_components()
+
+
+def test_find_objects_in_slabs_merges_boundary_objects():
+    stack = beads()
+    bboxes, _ = psf_module.find_objects_in_slabs(stack, 7)
+    assert any(b[0].start < 7*k <= b[0].stop - 1 for b in bboxes for k in range(1, 6))
+
+
+def test_subpixel_keeps_the_same_psfs():
+    stack = beads()
+    psf = PSF(stack)
+    n_PSFs = len(psf.PSFs)
+    psf.calc_mean_psf(subpixel=True)
+    with pytest.raises(ValueError, match="not kept"):
+        psf.PSFs
+    psf.calc_mean_psf(subpixel=True, keep_PSFs=True)
+    assert len(psf.PSFs) == n_PSFs
+    np.testing.assert_allclose(psf.mean_PSF.pages, np.mean(psf.PSFs, axis=0))
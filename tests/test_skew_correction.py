@@ -0,0 +1,46 @@
+"""Tests of the NumPy skew correction.
+
+The output is compared with a reference written from the same linear
+interpolation model (scipy.ndimage.map_coordinates), not with the output of
+the MATLAB script: parity with MATLAB is not verified by these tests, there
+is no MATLAB fixture in the repository.
+"""
+import numpy as np
+import pytest
+from scipy.ndimage import map_coordinates
+
+from pycroscopy3D.skew_correction import skew_correct, skew_correct_planes
+from pycroscopy3D.skew_correction.skew_correction import _shear_geometry, SCAPE_SKEW_ANGLE
+
+
+def reference(stack, conversion_factors):
+    """Every output plane interpolated with map_coordinates (linear), zero outside the input"""
+    n_scan, n_lines, n_depth = stack.shape
+    n_out, starts = _shear_geometry(n_scan, n_depth, conversion_factors, SCAPE_SKEW_ANGLE)
+    # the input is flipped along the scan axis and the depth axis
+    flipped = stack[::-1, :, ::-1].astype(np.float64)
+    rows, lines = np.meshgrid(np.arange(n_out), np.arange(n_lines), indexing='ij')
+    out = np.zeros((n_depth, n_out, n_lines))
+    for k, t in enumerate(starts):
+        position = rows + t
+        inside = (position >= 0) & (position <= n_scan - 1)
+        plane = map_coordinates(flipped[:, :, k], [position, lines], order=1, mode='nearest')
+        out[k] = np.where(inside, plane, 0)
+    return out
+
+
+@pytest.mark.parametrize("conversion_factors", [
+    # a plane starts within roundoff of an integer (-4.9999999999999964)
+    (1.3, 1.1, 2.7),
+    (1.0, 1.7, 1.3),
+])
+def test_skew_correct_matches_map_coordinates(conversion_factors):
+    stack = np.random.default_rng(0).uniform(0, 1000, (60, 7, 25))
+    corrected = skew_correct(stack, conversion_factors, dtype=np.float64)
+    np.testing.assert_allclose(corrected, reference(stack, conversion_factors), atol=1e-3)
+
+
+def test_skew_correct_roundoff_start():
+    stack = np.zeros((60, 7, 25), np.uint16)
+    assert skew_correct(stack, (1.3, 1.1, 2.7)).shape[0] == 25
+    assert len(list(skew_correct_planes(stack, (1.3, 1.1, 2.7)))) == 25